@@ -0,0 +1,137 @@
+"""
+canal_websocket.py - Canal WebSocket persistente hacia el servidor
+Envía frames JPEG binarios por una sola conexión y recibe los veredictos
+de forma asíncrona en un hilo lector
+"""
+
+import json
+import threading
+import time
+import websocket
+from config import REQUEST_TIMEOUT
+
+
+class CanalWebSocket:
+    """
+    Conexión única con el endpoint /api/procesar-frame/ws
+
+    Limita los frames sin respuesta a `max_en_vuelo` (control de flujo del
+    lado de la Pi); si el servidor no responde en REQUEST_TIMEOUT segundos,
+    o la conexión se cae, se reconecta en el siguiente envío.
+    """
+
+    def __init__(self, url, headers, max_en_vuelo, al_recibir):
+        """
+        Args:
+            url (str): URL ws:// del endpoint
+            headers (dict): Headers del handshake (X-Device-ID, X-LED-Mode)
+            max_en_vuelo (int): Frames enviados sin respuesta como máximo
+            al_recibir (callable): (respuesta dict | None, rtt) por cada frame;
+                None si el frame se perdió por desconexión
+        """
+        self.url = url
+        self.headers = [f"{k}: {v}" for k, v in headers.items()]
+        self.max_en_vuelo = max_en_vuelo
+        self.al_recibir = al_recibir
+
+        self.ws = None
+        self.seq = 0
+        self.en_vuelo = {}  # seq -> instante de envío
+        self._cond = threading.Condition()
+        self._lock_envio = threading.Lock()
+        self.reconexiones = 0
+
+    def _conectar(self):
+        """Abre la conexión e inicia el hilo lector (llamar con _cond tomado)"""
+        ws = websocket.create_connection(self.url, header=self.headers, timeout=REQUEST_TIMEOUT)
+        self.ws = ws
+        self.seq = 0
+        self.reconexiones += 1
+        threading.Thread(target=self._hilo_lector, args=(ws,), name="ws-lector", daemon=True).start()
+        print(f"🔗 Canal WebSocket conectado: {self.url}")
+
+    def _cerrar(self, ws):
+        """Cierra la conexión y da por perdidos los frames sin respuesta"""
+        with self._cond:
+            if self.ws is not ws:
+                return
+            self.ws = None
+            perdidos = list(self.en_vuelo.values())
+            self.en_vuelo.clear()
+            self._cond.notify_all()
+
+        try:
+            ws.close()
+        except Exception:
+            pass
+
+        ahora = time.monotonic()
+        for inicio in perdidos:
+            self.al_recibir(None, ahora - inicio)
+
+    def enviar(self, payload):
+        """
+        Envía un frame (bytes JPEG) o un mensaje JSON (dict, p. ej. rostros)
+
+        Returns:
+            bool: True si se envió; False si no hubo cupo o falló la conexión
+        """
+        with self._cond:
+            hay_cupo = self._cond.wait_for(
+                lambda: len(self.en_vuelo) < self.max_en_vuelo, REQUEST_TIMEOUT
+            )
+            if hay_cupo:
+                try:
+                    if self.ws is None:
+                        self._conectar()
+                except Exception as e:
+                    print(f"🔌 Error de conexión WebSocket: {e}")
+                    return False
+
+                self.seq += 1
+                self.en_vuelo[self.seq] = time.monotonic()
+            conexion = self.ws
+
+        if not hay_cupo:
+            # El servidor no respondió a tiempo: reiniciar la conexión
+            print("⏱️  Timeout esperando respuestas por WebSocket")
+            if conexion is not None:
+                self._cerrar(conexion)
+            return False
+
+        try:
+            with self._lock_envio:
+                if isinstance(payload, dict):
+                    conexion.send(json.dumps(payload))
+                else:
+                    conexion.send_binary(payload)
+            return True
+        except Exception as e:
+            print(f"❌ Error al enviar por WebSocket: {e}")
+            self._cerrar(conexion)
+            return False
+
+    def _hilo_lector(self, ws):
+        """Recibe veredictos y libera cupo de envío"""
+        while True:
+            try:
+                respuesta = json.loads(ws.recv())
+            except websocket.WebSocketTimeoutException:
+                # Sin frames pendientes no llegan mensajes: seguir esperando
+                continue
+            except Exception:
+                self._cerrar(ws)
+                return
+
+            with self._cond:
+                inicio = self.en_vuelo.pop(respuesta.get('seq'), None)
+                self._cond.notify()
+
+            if inicio is not None:
+                self.al_recibir(respuesta, time.monotonic() - inicio)
+
+    def cerrar(self):
+        """Cierra el canal"""
+        ws = self.ws
+        if ws is not None:
+            self._cerrar(ws)
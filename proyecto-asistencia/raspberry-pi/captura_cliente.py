@@ -5,14 +5,52 @@ Captura frames y los envía al servidor para procesamiento
 
 import time
 import base64
+import json
 import requests
 import io
+import threading
+from collections import deque
+from requests.adapters import HTTPAdapter
 from picamera2 import Picamera2
 from PIL import Image
 from config import (
-    SERVER_URL, DEVICE_ID, FRAME_WIDTH, FRAME_HEIGHT,
-    CAPTURE_INTERVAL, JPEG_QUALITY, REQUEST_TIMEOUT
+    SERVER_URL, SERVER_WS_URL, DEVICE_ID, FRAME_WIDTH, FRAME_HEIGHT,
+    REQUEST_TIMEOUT, UPLOAD_MODE,
+    MOTION_GATE_ENABLED, PIPELINE_QUEUE_SIZE, MAX_INFLIGHT_REQUESTS,
+    ADAPTIVE_ENABLED, MOTION_KEEPALIVE_SECONDS, FACE_PREFILTER_ENABLED,
+    FACE_UPLOAD_MODE, LED_MODE, HEARTBEAT_INTERVAL
 )
+from canal_websocket import CanalWebSocket
+from detector_movimiento import DetectorMovimiento
+from detector_rostros import DetectorRostros
+from control_adaptativo import ControlAdaptativo
+
+
+class ColaDescartable:
+    """
+    Cola acotada entre etapas del pipeline
+    Si está llena descarta el elemento más antiguo: siempre se procesa lo más reciente
+    """
+    
+    def __init__(self, maxsize):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self.descartados = 0
+    
+    def put(self, item):
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.descartados += 1
+            self._items.append(item)
+            self._cond.notify()
+    
+    def get(self, timeout=None):
+        """Devuelve el elemento más antiguo, o None si no llegó nada en `timeout`"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
 
 class CapturaCliente:
     def __init__(self):
@@ -30,67 +68,225 @@ class CapturaCliente:
         # Esperar a que la cámara se estabilice
         time.sleep(2)
         
-        self.server_url = f"{SERVER_URL}/api/procesar-frame"
+        self.upload_mode = UPLOAD_MODE
+        if self.upload_mode == "raw":
+            self.server_url = f"{SERVER_URL}/api/procesar-frame/raw"
+        else:
+            self.server_url = f"{SERVER_URL}/api/procesar-frame"
         self.device_id = DEVICE_ID
         
+        # LEDs manejados desde la respuesta del frame (sin callback del servidor)
+        self.leds = None
+        if LED_MODE == "local":
+            import leds
+            leds.configurar()
+            self.leds = leds
+        
+        # Detector de cambios de escena (None = enviar todos los frames)
+        self.detector = DetectorMovimiento() if MOTION_GATE_ENABLED else None
+        self.frames_omitidos = 0
+        
+        # Pre-filtro de rostros (None si está deshabilitado o falta OpenCV)
+        self.detector_rostros = None
+        if FACE_PREFILTER_ENABLED:
+            detector = DetectorRostros()
+            if detector.disponible:
+                self.detector_rostros = detector
+        self.frames_sin_rostro = 0
+        self.ultimo_envio = 0.0
+        
+        # Intervalo, calidad y escala ajustados según el servidor
+        self.control = ControlAdaptativo()
+        
+        # Sesión HTTP persistente (keep-alive) compartida por los hilos de envío
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_INFLIGHT_REQUESTS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Modo "ws": una conexión persistente, los veredictos llegan en otro hilo
+        self.canal = None
+        if self.upload_mode == "ws":
+            headers = {"X-Device-ID": self.device_id}
+            if self.leds:
+                headers["X-LED-Mode"] = "local"
+            self.canal = CanalWebSocket(
+                f"{SERVER_WS_URL}/api/procesar-frame/ws",
+                headers,
+                MAX_INFLIGHT_REQUESTS,
+                self._registrar_resultado
+            )
+        
+        # Pipeline: captura -> codificación -> envío
+        self.cola_frames = ColaDescartable(PIPELINE_QUEUE_SIZE)
+        self.cola_envio = ColaDescartable(PIPELINE_QUEUE_SIZE)
+        self.detenido = threading.Event()
+        self.frames_enviados = 0
+        self.lock_contador = threading.Lock()
+        
         print(f"✅ Cámara inicializada: {FRAME_WIDTH}x{FRAME_HEIGHT}")
-        print(f"🌐 Servidor: {SERVER_URL}")
+        print(f"🌐 Servidor: {SERVER_URL} (modo {self.upload_mode})")
         print(f"🔖 Device ID: {DEVICE_ID}")
         
     def capturar_frame(self):
         """
-        Captura un frame de la cámara y lo convierte a JPEG base64
+        Captura un frame de la cámara
         
         Returns:
-            str: Frame en formato base64
+            numpy.ndarray: Frame capturado, o None si la escena no cambió
         """
         try:
             # Capturar frame
             frame = self.camera.capture_array()
             
+            # Omitir la compresión y el envío si no hay movimiento
+            if self.detector and not self.detector.debe_enviar(frame):
+                self.frames_omitidos += 1
+                return None
+            
+            return frame
+            
+        except Exception as e:
+            print(f"❌ Error al capturar frame: {e}")
+            return None
+    
+    def codificar_jpeg(self, frame, escala=None):
+        """
+        Comprime un frame a JPEG en memoria
+        
+        Args:
+            frame (numpy.ndarray): Frame capturado
+            escala (float): Factor de resolución (None = el del control adaptativo)
+            
+        Returns:
+            bytes: Frame en formato JPEG
+        """
+        try:
             # Convertir a PIL Image
             img = Image.fromarray(frame)
             
+            # Reducir resolución si el control adaptativo lo pide
+            if escala is None:
+                escala = self.control.escala
+            if escala < 1.0:
+                img = img.resize(
+                    (int(img.width * escala), int(img.height * escala)),
+                    Image.BILINEAR
+                )
+            
             # Comprimir a JPEG en memoria
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=JPEG_QUALITY)
-            buffer.seek(0)
-            
-            # Convertir a base64
-            img_base64 = base64.b64encode(buffer.read()).decode('utf-8')
+            img.save(buffer, format='JPEG', quality=self.control.calidad)
             
-            return img_base64
+            return buffer.getvalue()
             
         except Exception as e:
-            print(f"❌ Error al capturar frame: {e}")
+            print(f"❌ Error al codificar frame: {e}")
             return None
     
-    def enviar_frame(self, img_base64):
+    def enviar_frame(self, jpeg_bytes, origen=None):
         """
         Envía el frame al servidor para procesamiento
         
+        En modo "raw" el JPEG va directo en el cuerpo (image/jpeg); en modo
+        "json" se codifica en base64 para el endpoint original
+        
         Args:
-            img_base64 (str): Frame en base64
+            jpeg_bytes (bytes): Frame en formato JPEG
+            origen (list): [top, left, escala] si es una región del frame
             
         Returns:
             dict: Respuesta del servidor
         """
-        try:
-            payload = {
-                "image": img_base64,
-                "device_id": self.device_id
-            }
-            
+        if self.upload_mode == "raw":
             headers = {
-                "Content-Type": "application/json",
+                "Content-Type": "image/jpeg",
                 "X-Device-ID": self.device_id
             }
+            if origen:
+                headers["X-Frame-Origin"] = ",".join(str(v) for v in origen)
+            return self._post(data=jpeg_bytes, headers=headers)
+        
+        payload = self._payload_frame(jpeg_bytes, origen)
+        
+        headers = {
+            "Content-Type": "application/json",
+            "X-Device-ID": self.device_id
+        }
+        
+        return self._post(json=payload, headers=headers)
+    
+    def enviar_rostros(self, rostros):
+        """
+        Envía solo los recortes de rostros con sus cajas (el servidor no detecta)
+        
+        En modo "raw" cada recorte va como archivo "rostro" de un multipart y
+        las cajas en el campo "rostros"; en modo "json" se envían en base64
+        
+        Args:
+            rostros (list): dicts con 'jpeg' (bytes), 'location' (caja dentro
+                del recorte) y 'bbox' (caja en el frame)
             
-            response = requests.post(
+        Returns:
+            dict: Respuesta del servidor
+        """
+        if self.upload_mode == "raw":
+            archivos = [
+                ("rostro", (f"rostro_{i}.jpg", rostro["jpeg"], "image/jpeg"))
+                for i, rostro in enumerate(rostros)
+            ]
+            metadatos = [
+                {"bbox": rostro["bbox"], "location": rostro["location"]}
+                for rostro in rostros
+            ]
+            return self._post(
+                files=archivos,
+                data={"rostros": json.dumps(metadatos)},
+                headers={"X-Device-ID": self.device_id}
+            )
+        
+        return self._post(json=self._payload_rostros(rostros), headers={"X-Device-ID": self.device_id})
+    
+    def _payload_frame(self, jpeg_bytes, origen=None):
+        """Mensaje JSON de un frame (o región, con su origen) en base64"""
+        payload = {
+            "image": base64.b64encode(jpeg_bytes).decode('utf-8'),
+            "device_id": self.device_id
+        }
+        if origen:
+            payload["origen"] = origen
+        return payload
+    
+    def _payload_rostros(self, rostros):
+        """Mensaje JSON de recortes con las imágenes en base64"""
+        return {
+            "device_id": self.device_id,
+            "rostros": [
+                {
+                    "image": base64.b64encode(rostro["jpeg"]).decode('utf-8'),
+                    "bbox": rostro["bbox"],
+                    "location": rostro["location"]
+                }
+                for rostro in rostros
+            ]
+        }
+    
+    def _post(self, **kwargs):
+        """
+        POST al servidor con la sesión persistente
+        
+        Returns:
+            dict: Respuesta del servidor, o None si hubo error
+        """
+        if self.leds:
+            # El servidor no hace el callback a control_gpio_api.py
+            kwargs["headers"] = {**kwargs.get("headers", {}), "X-LED-Mode": "local"}
+        
+        try:
+            response = self.session.post(
                 self.server_url,
-                json=payload,
-                headers=headers,
-                timeout=REQUEST_TIMEOUT
+                timeout=REQUEST_TIMEOUT,
+                **kwargs
             )
             
             if response.status_code == 200:
@@ -109,6 +305,24 @@ class CapturaCliente:
             print(f"❌ Error al enviar frame: {e}")
             return None
     
+    def enviar_heartbeat(self):
+        """
+        Registra el dispositivo en el servidor (IP y último contacto)
+        
+        Returns:
+            bool: True si el servidor confirmó el registro
+        """
+        try:
+            response = self.session.post(
+                f"{SERVER_URL}/api/dispositivos/heartbeat",
+                json={"device_id": self.device_id},
+                timeout=REQUEST_TIMEOUT
+            )
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️  Heartbeat fallido: {e}")
+            return False
+    
     def procesar_respuesta(self, respuesta):
         """
         Procesa la respuesta del servidor y muestra información
@@ -119,6 +333,10 @@ class CapturaCliente:
         if not respuesta:
             return
         
+        led = respuesta.get('led')
+        if self.leds and led and led.get('color') in self.leds.PINES:
+            self.leds.encender(led['color'], led['duration'])
+        
         status = respuesta.get('status')
         
         if status == 'recognized':
@@ -128,46 +346,187 @@ class CapturaCliente:
         elif status == 'unknown':
             print("❌ ROSTRO NO RECONOCIDO")
             
-        elif status == 'no_face':
+        elif status in ('no_face', 'busy'):
             # No imprimir nada para evitar spam
             pass
             
+        elif status == 'error':
+            print(f"⚠️  Error del servidor: {respuesta.get('message')}")
+            
         else:
             print(f"⚠️  Respuesta inesperada: {respuesta}")
     
+    def _hilo_codificacion(self):
+        """
+        Etapa 2: filtra frames sin rostros y comprime a JPEG los restantes
+        
+        En la cola de envío quedan bytes JPEG del frame, (bytes JPEG, origen)
+        de una región o una lista de recortes por rostro (FACE_UPLOAD_MODE = "rostros")
+        """
+        while not self.detenido.is_set():
+            frame = self.cola_frames.get(timeout=0.5)
+            if frame is None:
+                continue
+            
+            region = None
+            
+            if self.detector_rostros:
+                cajas = self.detector_rostros.detectar(frame)
+                
+                if not cajas:
+                    # Sin rostros: no enviar, salvo el keepalive periódico
+                    if time.monotonic() - self.ultimo_envio < MOTION_KEEPALIVE_SECONDS:
+                        self.frames_sin_rostro += 1
+                        continue
+                elif FACE_UPLOAD_MODE == "rostros":
+                    rostros = self._codificar_rostros(frame, cajas)
+                    if rostros:
+                        self.ultimo_envio = time.monotonic()
+                        self.cola_envio.put(rostros)
+                    continue
+                elif FACE_UPLOAD_MODE == "region":
+                    frame, region = self.detector_rostros.recortar(frame, cajas)
+            
+            escala = min(1.0, self.control.escala)
+            jpeg_bytes = self.codificar_jpeg(frame, escala)
+            if jpeg_bytes:
+                self.ultimo_envio = time.monotonic()
+                if region:
+                    # El servidor ubica la región en el frame para seguir rostros entre frames
+                    self.cola_envio.put((jpeg_bytes, [int(region[0]), int(region[3]), float(escala)]))
+                else:
+                    self.cola_envio.put(jpeg_bytes)
+    
+    def _codificar_rostros(self, frame, cajas):
+        """
+        Comprime un recorte por rostro
+        
+        Los recortes se envían a resolución completa (ya son pequeños) para
+        que las cajas sigan en coordenadas del frame original
+        
+        Returns:
+            list: dicts con 'jpeg', 'location' y 'bbox' (vacía si falla la compresión)
+        """
+        rostros = []
+        for recorte, location, bbox in self.detector_rostros.recortar_rostros(frame, cajas):
+            jpeg_bytes = self.codificar_jpeg(recorte, escala=1.0)
+            if not jpeg_bytes:
+                return []
+            rostros.append({
+                "jpeg": jpeg_bytes,
+                "location": list(location),
+                "bbox": list(bbox)
+            })
+        return rostros
+    
+    def _hilo_envio(self):
+        """
+        Etapa 3: envía frames al servidor (MAX_INFLIGHT_REQUESTS hilos en paralelo)
+        """
+        while not self.detenido.is_set():
+            envio = self.cola_envio.get(timeout=0.5)
+            if envio is None:
+                continue
+            
+            origen = None
+            if isinstance(envio, tuple):
+                envio, origen = envio
+            
+            # Enviar al servidor
+            inicio = time.monotonic()
+            
+            if self.canal:
+                # La respuesta llega por el hilo lector del canal
+                if isinstance(envio, list):
+                    envio = self._payload_rostros(envio)
+                elif origen:
+                    envio = self._payload_frame(envio, origen)
+                if not self.canal.enviar(envio):
+                    self._registrar_resultado(None, time.monotonic() - inicio)
+                continue
+            
+            if isinstance(envio, list):
+                respuesta = self.enviar_rostros(envio)
+            else:
+                respuesta = self.enviar_frame(envio, origen)
+            
+            self._registrar_resultado(respuesta, time.monotonic() - inicio)
+    
+    def _registrar_resultado(self, respuesta, rtt):
+        """
+        Aplica la respuesta de un frame: control adaptativo, LEDs y estadísticas
+        
+        Args:
+            respuesta (dict): Respuesta del servidor, o None si falló el envío
+            rtt (float): Segundos entre el envío y la respuesta
+        """
+        if ADAPTIVE_ENABLED:
+            # "busy" y "error" cuentan como presión, igual que un 503
+            saturado = respuesta and respuesta.get('status') in ('busy', 'error')
+            self.control.registrar(rtt, None if saturado else respuesta)
+        
+        # Procesar respuesta
+        self.procesar_respuesta(respuesta)
+        
+        with self.lock_contador:
+            self.frames_enviados += 1
+            frame_count = self.frames_enviados
+        
+        # Mostrar contador cada 10 frames
+        if frame_count % 10 == 0:
+            descartados = self.cola_frames.descartados + self.cola_envio.descartados
+            print(f"📊 Frames procesados: {frame_count} "
+                  f"(omitidos sin movimiento: {self.frames_omitidos}, sin rostro: {self.frames_sin_rostro}, "
+                  f"descartados por atraso: {descartados}) "
+                  f"| {self.control.estado()}")
+    
+    def _hilo_heartbeat(self):
+        """
+        Registra el dispositivo al iniciar y luego cada HEARTBEAT_INTERVAL segundos
+        """
+        while not self.detenido.is_set():
+            self.enviar_heartbeat()
+            self.detenido.wait(HEARTBEAT_INTERVAL)
+    
     def run(self):
         """
-        Bucle principal de captura y envío
+        Bucle principal: captura a intervalo fijo y alimenta el pipeline
+        
+        La codificación y el envío corren en hilos propios conectados por colas
+        acotadas, así un servidor lento no frena el muestreo de la cámara
         """
         print("\n" + "="*50)
         print("🚀 INICIANDO CAPTURA Y TRANSMISIÓN")
         print("="*50 + "\n")
         
-        frame_count = 0
+        hilos = [
+            threading.Thread(target=self._hilo_heartbeat, name="heartbeat", daemon=True),
+            threading.Thread(target=self._hilo_codificacion, name="codificacion", daemon=True)
+        ]
+        # Con WebSocket un solo hilo envía; el canal limita los frames sin respuesta
+        for i in range(1 if self.canal else MAX_INFLIGHT_REQUESTS):
+            hilos.append(threading.Thread(target=self._hilo_envio, name=f"envio-{i}", daemon=True))
+        for hilo in hilos:
+            hilo.start()
         
         try:
             while True:
+                inicio = time.monotonic()
+                
                 # Capturar frame
-                img_base64 = self.capturar_frame()
+                frame = self.capturar_frame()
                 
-                if img_base64:
-                    frame_count += 1
-                    
-                    # Enviar al servidor
-                    respuesta = self.enviar_frame(img_base64)
-                    
-                    # Procesar respuesta
-                    self.procesar_respuesta(respuesta)
-                    
-                    # Mostrar contador cada 10 frames
-                    if frame_count % 10 == 0:
-                        print(f"📊 Frames procesados: {frame_count}")
+                if frame is not None:
+                    self.cola_frames.put(frame)
                 
-                # Esperar antes del siguiente frame
-                time.sleep(CAPTURE_INTERVAL)
+                # Esperar hasta el siguiente frame descontando el tiempo de captura
+                time.sleep(max(0.0, self.control.intervalo - (time.monotonic() - inicio)))
                 
         except KeyboardInterrupt:
             print("\n⚠️  Deteniendo captura...")
+            self.detenido.set()
+            for hilo in hilos:
+                hilo.join(timeout=REQUEST_TIMEOUT)
             self.cleanup()
     
     def cleanup(self):
@@ -175,6 +534,11 @@ class CapturaCliente:
         Limpieza al cerrar
         """
         print("🧹 Liberando recursos...")
+        self.session.close()
+        if self.canal:
+            self.canal.cerrar()
+        if self.leds:
+            self.leds.cleanup()
         self.camera.stop()
         self.camera.close()
         print("✅ Cámara cerrada correctamente")
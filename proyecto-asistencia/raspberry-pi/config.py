@@ -4,6 +4,7 @@
 SERVER_HOST = "192.168.1.100"  # Cambiar por IP del servidor
 SERVER_PORT = 8000
 SERVER_URL = f"http://{SERVER_HOST}:{SERVER_PORT}"
+SERVER_WS_URL = f"ws://{SERVER_HOST}:{SERVER_PORT}"
 
 # Identificación del dispositivo
 DEVICE_ID = "pi-aula-101"  # Identificador único de esta Pi
@@ -13,14 +14,53 @@ FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 CAPTURE_INTERVAL = 0.5  # Segundos entre capturas
 JPEG_QUALITY = 70  # Calidad de compresión (0-100)
+UPLOAD_MODE = "raw"  # "raw" (JPEG binario, sin base64), "json" (base64, compatible) o "ws" (WebSocket persistente)
+
+# Detector de movimiento (no enviar frames de una escena sin cambios)
+MOTION_GATE_ENABLED = True
+MOTION_DOWNSAMPLE = 8  # Tomar 1 de cada N píxeles por eje (640x480 -> 80x60)
+MOTION_PIXEL_THRESHOLD = 25  # Diferencia de gris (0-255) para contar un píxel como cambiado
+MOTION_MIN_AREA = 0.01  # Fracción mínima de píxeles cambiados para considerar movimiento
+MOTION_BACKGROUND_ALPHA = 0.05  # Velocidad de adaptación del fondo
+MOTION_HOLD_SECONDS = 3  # Seguir enviando N segundos después del último cambio
+MOTION_KEEPALIVE_SECONDS = 30  # Enviar un frame cada N segundos aunque no haya cambios
+
+# Pre-filtro de rostros en la Pi (requiere OpenCV)
+FACE_PREFILTER_ENABLED = True  # Enviar solo frames donde se detecta un rostro
+FACE_PREFILTER_WIDTH = 320  # Ancho de la imagen reducida para el detector Haar
+FACE_PREFILTER_MIN_SIZE = 40  # Tamaño mínimo de rostro (px en la imagen reducida)
+# Qué se envía cuando hay rostros:
+#   "frame"   -> frame completo
+#   "region"  -> un recorte con todos los rostros y su origen en el frame (el servidor vuelve a detectar)
+#   "rostros" -> un recorte por rostro con su caja en el frame (el servidor no detecta)
+FACE_UPLOAD_MODE = "frame"
+FACE_CROP_PADDING = 0.3  # Margen del recorte relativo al tamaño de la región o del rostro
+
+# Pipeline de captura / codificación / envío
+PIPELINE_QUEUE_SIZE = 2  # Frames en espera por etapa (si se llena se descarta el más antiguo)
+MAX_INFLIGHT_REQUESTS = 2  # Envíos simultáneos al servidor
+
+# Control adaptativo según latencia y carga del servidor
+ADAPTIVE_ENABLED = True
+ADAPT_MIN_INTERVAL = 0.25  # Intervalo con un rostro presente
+ADAPT_IDLE_INTERVAL = 1.0  # Intervalo máximo sin rostros (servidor holgado)
+ADAPT_MAX_INTERVAL = 3.0  # Intervalo máximo bajo presión
+ADAPT_MIN_QUALITY = 40  # Calidad JPEG mínima bajo presión
+ADAPT_MIN_SCALE = 0.5  # Escala mínima de resolución bajo presión
+ADAPT_RTT_HIGH = 1.0  # Latencia (s) que se considera presión
+ADAPT_LOAD_HIGH = 0.7  # Carga informada por el servidor (0-1) que se considera presión
 
 # Configuración GPIO
 LED_GREEN_PIN = 17  # GPIO para LED verde
 LED_RED_PIN = 27    # GPIO para LED rojo
 LED_DURATION = 2    # Segundos que permanece encendido el LED
+LED_MODE = "local"  # "local" (captura_cliente.py usa el veredicto de la respuesta) o "callback" (control_gpio_api.py)
 
-# Puerto para API de control local
+# Puerto para API de control local (solo con LED_MODE = "callback")
 GPIO_API_PORT = 5000
 
+# Registro en el servidor (IP para comandos LED y último contacto)
+HEARTBEAT_INTERVAL = 60  # Segundos entre heartbeats
+
 # Timeout de conexión
 REQUEST_TIMEOUT = 5  # Segundos
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+control_adaptativo.py - Control adaptativo de frecuencia y calidad de captura
+Ajusta intervalo, calidad JPEG y resolución según la latencia medida y la
+carga que informa el servidor en cada respuesta
+"""
+
+import threading
+from config import (
+    CAPTURE_INTERVAL, JPEG_QUALITY,
+    ADAPT_MIN_INTERVAL, ADAPT_IDLE_INTERVAL, ADAPT_MAX_INTERVAL,
+    ADAPT_MIN_QUALITY, ADAPT_MIN_SCALE, ADAPT_RTT_HIGH, ADAPT_LOAD_HIGH
+)
+
+# Peso de la última medición en el promedio móvil de latencia
+_ALPHA_RTT = 0.3
+
+
+class ControlAdaptativo:
+    """
+    Controlador AIMD simple:
+    - Bajo presión (carga alta, latencia alta, timeouts o 503) retrocede
+      multiplicativamente: más intervalo, menos calidad y resolución.
+    - Con un rostro presente y servidor holgado, captura al máximo ritmo.
+    - Sin rostros, se relaja hacia ADAPT_IDLE_INTERVAL.
+    - Sin presión, recupera gradualmente calidad y resolución.
+    """
+
+    def __init__(self):
+        self.intervalo = CAPTURE_INTERVAL
+        self.calidad = JPEG_QUALITY
+        self.escala = 1.0
+        self.rtt = None
+        self._lock = threading.Lock()
+
+    def registrar(self, rtt, respuesta):
+        """
+        Actualiza los parámetros con el resultado de un envío
+
+        Args:
+            rtt (float): Segundos que tardó el envío
+            respuesta (dict): Respuesta del servidor, o None si hubo error/timeout/503
+        """
+        with self._lock:
+            if self.rtt is None:
+                self.rtt = rtt
+            else:
+                self.rtt += _ALPHA_RTT * (rtt - self.rtt)
+
+            carga = (respuesta or {}).get('carga', 0.0)
+            presion = respuesta is None or carga >= ADAPT_LOAD_HIGH or self.rtt >= ADAPT_RTT_HIGH
+
+            if presion:
+                self.intervalo = min(ADAPT_MAX_INTERVAL, self.intervalo * 1.5)
+                self.calidad = max(ADAPT_MIN_QUALITY, self.calidad - 10)
+                self.escala = max(ADAPT_MIN_SCALE, round(self.escala - 0.1, 2))
+                return
+
+            if respuesta.get('status') in ('recognized', 'unknown'):
+                # Hay alguien frente a la cámara: muestrear más seguido
+                self.intervalo = ADAPT_MIN_INTERVAL
+            else:
+                self.intervalo = min(ADAPT_IDLE_INTERVAL, max(ADAPT_MIN_INTERVAL, self.intervalo * 1.2))
+
+            self.calidad = min(JPEG_QUALITY, self.calidad + 5)
+            self.escala = min(1.0, round(self.escala + 0.1, 2))
+
+    def estado(self):
+        """
+        Returns:
+            dict: Parámetros actuales y latencia promedio
+        """
+        return {
+            "intervalo": round(self.intervalo, 2),
+            "calidad": self.calidad,
+            "escala": self.escala,
+            "rtt": round(self.rtt, 3) if self.rtt is not None else None
+        }
@@ -1,34 +1,19 @@
 """
 control_gpio_api.py - API Flask para control remoto de LEDs en Raspberry Pi
 Servidor ligero que recibe comandos del servidor principal para encender LEDs
+
+Solo es necesario con LED_MODE = "callback"; en modo "local" captura_cliente.py
+enciende los LEDs con el veredicto de la respuesta de cada frame
 """
 
 from flask import Flask, request, jsonify
-import RPi.GPIO as GPIO
-import threading
-import time
 from config import LED_GREEN_PIN, LED_RED_PIN, GPIO_API_PORT
+import leds
 
 app = Flask(__name__)
 
 # Configuración GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(LED_GREEN_PIN, GPIO.OUT)
-GPIO.setup(LED_RED_PIN, GPIO.OUT)
-
-# Asegurar que los LEDs estén apagados al inicio
-GPIO.output(LED_GREEN_PIN, GPIO.LOW)
-GPIO.output(LED_RED_PIN, GPIO.LOW)
-
-
-def blink_led(pin, duration):
-    """
-    Enciende un LED por una duración específica en un thread separado
-    """
-    GPIO.output(pin, GPIO.HIGH)
-    time.sleep(duration)
-    GPIO.output(pin, GPIO.LOW)
+leds.configurar()
 
 
 @app.route('/api/led', methods=['POST'])
@@ -59,12 +44,8 @@ def control_led():
         if not isinstance(duration, (int, float)) or duration <= 0 or duration > 10:
             return jsonify({"error": "Duración debe ser entre 0 y 10 segundos"}), 400
         
-        # Seleccionar pin según color
-        pin = LED_GREEN_PIN if color == 'green' else LED_RED_PIN
-        
         # Encender LED en thread separado para no bloquear
-        led_thread = threading.Thread(target=blink_led, args=(pin, duration))
-        led_thread.start()
+        leds.encender(color, duration)
         
         return jsonify({
             "status": "ok",
@@ -95,20 +76,12 @@ def leds_off():
     Apagar todos los LEDs inmediatamente
     """
     try:
-        GPIO.output(LED_GREEN_PIN, GPIO.LOW)
-        GPIO.output(LED_RED_PIN, GPIO.LOW)
+        leds.apagar()
         return jsonify({"status": "ok", "message": "LEDs apagados"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def cleanup():
-    """
-    Limpieza de GPIO al cerrar
-    """
-    GPIO.cleanup()
-
-
 if __name__ == '__main__':
     try:
         print(f"🚀 Iniciando API de control GPIO en puerto {GPIO_API_PORT}")
@@ -117,4 +90,4 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=GPIO_API_PORT, debug=False)
     except KeyboardInterrupt:
         print("\n⚠️  Cerrando servidor...")
-        cleanup()
\ No newline at end of file
+        leds.cleanup()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+detector_movimiento.py - Detector de cambios de escena para la Raspberry Pi
+Evita comprimir y enviar frames cuando el pasillo está vacío
+"""
+
+import time
+import numpy as np
+from config import (
+    MOTION_DOWNSAMPLE, MOTION_PIXEL_THRESHOLD, MOTION_MIN_AREA,
+    MOTION_BACKGROUND_ALPHA, MOTION_HOLD_SECONDS, MOTION_KEEPALIVE_SECONDS
+)
+
+
+class DetectorMovimiento:
+    """
+    Compara un frame reducido en escala de grises contra un fondo promedio
+
+    El fondo se actualiza con un promedio móvil, por lo que cambios lentos
+    (luz del día) se absorben sin disparar envíos. Tras un cambio se siguen
+    enviando frames durante MOTION_HOLD_SECONDS para reconocer a quien se
+    detiene frente a la cámara, y cada MOTION_KEEPALIVE_SECONDS se envía uno
+    aunque no haya cambios.
+    """
+
+    def __init__(self, paso=MOTION_DOWNSAMPLE, umbral=MOTION_PIXEL_THRESHOLD,
+                 area_min=MOTION_MIN_AREA, alpha=MOTION_BACKGROUND_ALPHA,
+                 mantener=MOTION_HOLD_SECONDS, keepalive=MOTION_KEEPALIVE_SECONDS):
+        self.paso = paso
+        self.umbral = umbral
+        self.area_min = area_min
+        self.alpha = alpha
+        self.mantener = mantener
+        self.keepalive = keepalive
+
+        self.fondo = None
+        self.ultimo_cambio = 0.0
+        self.ultimo_envio = 0.0
+
+    def _reducir(self, frame):
+        """Submuestrea y convierte a gris (promedio de canales, válido para RGB o BGR)"""
+        pequeno = frame[::self.paso, ::self.paso, :3]
+        return pequeno.mean(axis=2, dtype=np.float32)
+
+    def debe_enviar(self, frame):
+        """
+        Decide si el frame vale la pena enviarlo al servidor
+
+        Args:
+            frame (numpy.ndarray): Salida de capture_array()
+
+        Returns:
+            bool: True si hubo cambio reciente o toca keepalive
+        """
+        ahora = time.monotonic()
+        gris = self._reducir(frame)
+
+        if self.fondo is None or self.fondo.shape != gris.shape:
+            self.fondo = gris
+            self.ultimo_cambio = ahora
+        else:
+            cambiados = np.abs(gris - self.fondo) > self.umbral
+            if cambiados.mean() >= self.area_min:
+                self.ultimo_cambio = ahora
+
+            # Promedio móvil del fondo
+            self.fondo += self.alpha * (gris - self.fondo)
+
+        enviar = (
+            ahora - self.ultimo_cambio <= self.mantener
+            or ahora - self.ultimo_envio >= self.keepalive
+        )
+
+        if enviar:
+            self.ultimo_envio = ahora
+
+        return enviar
@@ -0,0 +1,124 @@
+"""
+detector_rostros.py - Pre-filtro de presencia de rostros en la Raspberry Pi
+Usa un clasificador Haar de OpenCV sobre una imagen reducida en gris para
+enviar al servidor solo frames que contienen rostros
+"""
+
+from config import FACE_PREFILTER_WIDTH, FACE_PREFILTER_MIN_SIZE, FACE_CROP_PADDING
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+class DetectorRostros:
+    """Detector Haar liviano; las cajas se devuelven en coordenadas del frame original"""
+
+    def __init__(self, ancho=FACE_PREFILTER_WIDTH, tamano_min=FACE_PREFILTER_MIN_SIZE):
+        self.ancho = ancho
+        self.tamano_min = tamano_min
+        self.clasificador = None
+
+        if cv2 is None:
+            print("⚠️  OpenCV no instalado: pre-filtro de rostros deshabilitado")
+            return
+
+        self.clasificador = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+
+    @property
+    def disponible(self):
+        return self.clasificador is not None
+
+    def detectar(self, frame):
+        """
+        Busca rostros en el frame
+
+        Args:
+            frame (numpy.ndarray): Frame RGB o XBGR de capture_array()
+
+        Returns:
+            list: Cajas (top, right, bottom, left) en coordenadas del frame
+        """
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            gris = cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY)
+        else:
+            gris = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+
+        alto, ancho = gris.shape
+        escala = 1.0
+        if ancho > self.ancho:
+            escala = ancho / self.ancho
+            gris = cv2.resize(gris, (self.ancho, int(alto / escala)), interpolation=cv2.INTER_AREA)
+
+        rostros = self.clasificador.detectMultiScale(
+            gris,
+            scaleFactor=1.1,
+            minNeighbors=4,
+            minSize=(self.tamano_min, self.tamano_min)
+        )
+
+        return [
+            (int(y * escala), int((x + w) * escala), int((y + h) * escala), int(x * escala))
+            for (x, y, w, h) in rostros
+        ]
+
+    def recortar(self, frame, cajas, padding=FACE_CROP_PADDING):
+        """
+        Recorta la región que contiene todos los rostros, con margen
+
+        Args:
+            frame (numpy.ndarray): Frame original
+            cajas (list): Cajas (top, right, bottom, left)
+            padding (float): Margen relativo al tamaño de la región
+
+        Returns:
+            tuple: (recorte numpy.ndarray, (top, right, bottom, left) del recorte en el frame)
+        """
+        region = (
+            min(c[0] for c in cajas),
+            max(c[1] for c in cajas),
+            max(c[2] for c in cajas),
+            min(c[3] for c in cajas)
+        )
+        top, right, bottom, left = _expandir(region, padding, frame.shape)
+
+        return frame[top:bottom, left:right], (top, right, bottom, left)
+
+    def recortar_rostros(self, frame, cajas, padding=FACE_CROP_PADDING):
+        """
+        Recorta cada rostro por separado, con margen para los landmarks
+
+        Args:
+            frame (numpy.ndarray): Frame original
+            cajas (list): Cajas (top, right, bottom, left)
+            padding (float): Margen relativo al tamaño de cada rostro
+
+        Returns:
+            list: (recorte numpy.ndarray, caja del rostro dentro del recorte,
+                caja del rostro en el frame) por cada rostro
+        """
+        recortes = []
+        for caja in cajas:
+            top, right, bottom, left = _expandir(caja, padding, frame.shape)
+            en_recorte = (caja[0] - top, caja[1] - left, caja[2] - top, caja[3] - left)
+            recortes.append((frame[top:bottom, left:right], en_recorte, tuple(caja)))
+        return recortes
+
+
+def _expandir(caja, padding, forma):
+    """Agrega margen a una caja (top, right, bottom, left) sin salir del frame"""
+    alto, ancho = forma[:2]
+    top, right, bottom, left = caja
+
+    margen_y = int((bottom - top) * padding)
+    margen_x = int((right - left) * padding)
+
+    return (
+        max(0, top - margen_y),
+        min(ancho, right + margen_x),
+        min(alto, bottom + margen_y),
+        max(0, left - margen_x)
+    )
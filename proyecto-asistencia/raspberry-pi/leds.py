@@ -0,0 +1,64 @@
+"""
+leds.py - Control de los LEDs indicadores de la Raspberry Pi
+Compartido por control_gpio_api.py (comandos del servidor) y captura_cliente.py
+(veredicto incluido en la respuesta de cada frame)
+"""
+
+import RPi.GPIO as GPIO
+import threading
+import time
+from config import LED_GREEN_PIN, LED_RED_PIN
+
+PINES = {
+    "green": LED_GREEN_PIN,
+    "red": LED_RED_PIN
+}
+
+
+def configurar():
+    """
+    Configura los pines de los LEDs y los deja apagados
+    """
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setwarnings(False)
+    GPIO.setup(LED_GREEN_PIN, GPIO.OUT)
+    GPIO.setup(LED_RED_PIN, GPIO.OUT)
+
+    # Asegurar que los LEDs estén apagados al inicio
+    apagar()
+
+
+def blink_led(pin, duration):
+    """
+    Enciende un LED por una duración específica en un thread separado
+    """
+    GPIO.output(pin, GPIO.HIGH)
+    time.sleep(duration)
+    GPIO.output(pin, GPIO.LOW)
+
+
+def encender(color, duration):
+    """
+    Enciende el LED del color indicado sin bloquear al llamador
+
+    Args:
+        color (str): 'green' o 'red'
+        duration (float): Segundos encendido
+    """
+    led_thread = threading.Thread(target=blink_led, args=(PINES[color], duration), daemon=True)
+    led_thread.start()
+
+
+def apagar():
+    """
+    Apaga todos los LEDs inmediatamente
+    """
+    GPIO.output(LED_GREEN_PIN, GPIO.LOW)
+    GPIO.output(LED_RED_PIN, GPIO.LOW)
+
+
+def cleanup():
+    """
+    Limpieza de GPIO al cerrar
+    """
+    GPIO.cleanup()
@@ -0,0 +1,438 @@
+"""
+ann_index.py - Índices de búsqueda de vecinos cercanos para la galería
+Implementados en NumPy puro: búsqueda exacta, índice IVF (particiones k-means)
+e índice de prototipos (una partición por estudiante con varias fotos)
+"""
+
+import logging
+import numpy as np
+from config import (
+    ANN_INDEX, ANN_MIN_GALLERY, IVF_NLIST, IVF_NPROBE,
+    IVF_EXACT_TOLERANCE, IVF_KMEANS_ITER, IVF_TRAIN_SAMPLE,
+    GALLERY_PROTOTYPES, PROTOTYPE_CANDIDATES
+)
+
+logger = logging.getLogger(__name__)
+
+# Filas procesadas por bloque al asignar la galería a los centroides
+_BLOQUE_ASIGNACION = 8192
+
+# Margen para que el redondeo de float32 nunca descarte una partición válida
+_HOLGURA_COTA = 1e-4
+
+# Si hay que revisar más de esta fracción de la galería se recorre completa
+_FRACCION_FUERZA_BRUTA = 0.5
+
+
+def distancias_sq(consultas, normas_q, matriz, normas_sq):
+    """
+    Distancia euclidiana al cuadrado entre consultas (F, D) y filas de matriz (N, D)
+
+    Returns:
+        numpy.ndarray: Matriz (F, N), recortada a >= 0
+    """
+    dist_sq = consultas @ matriz.T
+    dist_sq *= -2
+    dist_sq += normas_q[:, None]
+    dist_sq += normas_sq[None, :]
+    np.maximum(dist_sq, 0, out=dist_sq)
+    return dist_sq
+
+
+def _top_k(distancias, indices, k):
+    """Ordena las k menores distancias; rellena con -1/inf si hay menos de k"""
+    top_i = np.full(k, -1, dtype=np.int64)
+    top_d = np.full(k, np.inf, dtype=distancias.dtype)
+
+    n = min(k, len(distancias))
+    if n == 0:
+        return top_i, top_d
+
+    if len(distancias) > n:
+        parte = np.argpartition(distancias, n - 1)[:n]
+    else:
+        parte = np.arange(len(distancias))
+    orden = parte[np.argsort(distancias[parte])]
+
+    top_i[:n] = indices[orden]
+    top_d[:n] = distancias[orden]
+    return top_i, top_d
+
+
+class ExactIndex:
+    """Búsqueda por fuerza bruta: una multiplicación de matrices contra toda la galería"""
+
+    nombre = "exacto"
+
+    def __init__(self, matriz, normas_sq):
+        self.matriz = matriz
+        self.normas_sq = normas_sq
+
+    def buscar(self, consultas, normas_q, k=1, tolerance=None):
+        """
+        Args:
+            consultas (numpy.ndarray): Encodings (F, D)
+            normas_q (numpy.ndarray): Normas al cuadrado de las consultas (F,)
+            k (int): Cantidad de vecinos por consulta
+            tolerance (float): No se usa; la búsqueda ya es exacta
+
+        Returns:
+            tuple: (indices (F, k), distancias (F, k)) ordenados de menor a mayor
+        """
+        dist = np.sqrt(distancias_sq(consultas, normas_q, self.matriz, self.normas_sq))
+        todos = np.arange(self.matriz.shape[0])
+
+        indices = np.empty((len(consultas), k), dtype=np.int64)
+        distancias = np.empty((len(consultas), k), dtype=dist.dtype)
+        for q in range(len(consultas)):
+            indices[q], distancias[q] = _top_k(dist[q], todos, k)
+
+        return indices, distancias
+
+
+class IVFIndex:
+    """
+    Índice de archivo invertido: la galería se particiona con k-means y cada
+    consulta solo recorre las listas de los `nprobe` centroides más cercanos.
+
+    Los candidatos se re-ordenan con la distancia exacta. Con `exacto_bajo_tolerancia`
+    además se revisan las listas cuya cota inferior (desigualdad triangular:
+    ||q - g|| >= ||q - c|| - radio_c) no descarta una coincidencia bajo la
+    tolerancia, de modo que todo resultado bajo FACE_TOLERANCE es idéntico
+    al de la búsqueda exacta. Con encodings dispersos (distancias típicas
+    ~0.9 y radios ~0.6) la cota casi no poda y el lote se resuelve con un
+    GEMM completo, por eso viene desactivado y el recall se ajusta con nprobe.
+    """
+
+    nombre = "ivf"
+
+    def __init__(self, matriz, normas_sq, nlist=IVF_NLIST, nprobe=IVF_NPROBE,
+                 exacto_bajo_tolerancia=IVF_EXACT_TOLERANCE,
+                 iteraciones=IVF_KMEANS_ITER, muestra=IVF_TRAIN_SAMPLE, semilla=0,
+                 centroides=None, asignacion=None, dist_centroide=None):
+        """
+        Args:
+            matriz (numpy.ndarray): Galería contigua (N, D)
+            normas_sq (numpy.ndarray): Normas al cuadrado de cada fila (N,)
+            nlist (int): Cantidad de particiones (0 = automático, ~4·√N)
+            nprobe (int): Particiones recorridas por consulta (recall vs latencia)
+            exacto_bajo_tolerancia (bool): Garantizar resultados exactos bajo la tolerancia
+            iteraciones (int): Iteraciones de k-means
+            muestra (int): Filas usadas para entrenar k-means
+            semilla (int): Semilla para resultados reproducibles
+            centroides (numpy.ndarray): Centroides ya entrenados (omite k-means)
+            asignacion (numpy.ndarray): Partición de cada fila, junto con centroides
+            dist_centroide (numpy.ndarray): Distancia de cada fila a su centroide
+        """
+        self.matriz = matriz
+        self.normas_sq = normas_sq
+        self.exacto_bajo_tolerancia = exacto_bajo_tolerancia
+
+        n = matriz.shape[0]
+        if centroides is not None:
+            nlist = len(centroides)
+        elif not nlist:
+            nlist = int(4 * np.sqrt(n))
+        self.nlist = max(1, min(nlist, n)) if centroides is None else nlist
+        self.nprobe = max(1, min(nprobe, self.nlist))
+
+        if centroides is None:
+            rng = np.random.default_rng(semilla)
+            self.centroides = self._entrenar(rng, iteraciones, muestra)
+        else:
+            self.centroides = centroides
+        self.normas_c = np.einsum('ij,ij->i', self.centroides, self.centroides)
+
+        if asignacion is None:
+            asignacion, dist_centroide = self._asignar(self.matriz, self.normas_sq)
+        self.asignacion = asignacion
+        self.dist_centroide = dist_centroide
+
+        # Listas invertidas en formato compacto (CSR): miembros ordenados por partición
+        self.miembros = np.argsort(asignacion, kind='stable')
+        conteos = np.bincount(asignacion, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(conteos)))
+
+        # Radio de cada partición para la cota de la desigualdad triangular
+        self.radios = np.zeros(self.nlist, dtype=matriz.dtype)
+        np.maximum.at(self.radios, asignacion, dist_centroide)
+
+        if centroides is None:
+            logger.info(f"🗂️  Índice IVF construido: {n} rostros, {self.nlist} listas, nprobe={self.nprobe}")
+
+    def actualizar(self, matriz, normas_sq, conservadas):
+        """
+        Índice para la galería modificada sin volver a entrenar k-means
+
+        Las filas conservadas mantienen su partición y solo las nuevas se
+        asignan a los centroides existentes
+
+        Args:
+            matriz (numpy.ndarray): Filas `conservadas` de esta galería seguidas de las nuevas
+            normas_sq (numpy.ndarray): Normas al cuadrado de matriz
+            conservadas (numpy.ndarray): Índices (en esta galería) de las filas que siguen
+
+        Returns:
+            IVFIndex
+        """
+        desde = len(conservadas)
+        nuevas_a, nuevas_d = self._asignar(matriz[desde:], normas_sq[desde:])
+
+        return IVFIndex(
+            matriz, normas_sq, nprobe=self.nprobe,
+            exacto_bajo_tolerancia=self.exacto_bajo_tolerancia,
+            centroides=self.centroides,
+            asignacion=np.concatenate((self.asignacion[conservadas], nuevas_a)),
+            dist_centroide=np.concatenate((self.dist_centroide[conservadas], nuevas_d))
+        )
+
+    def _asignar(self, filas, normas):
+        """Asigna cada fila a su centroide más cercano (por bloques para acotar memoria)"""
+        asignacion = np.empty(filas.shape[0], dtype=np.int64)
+        distancia = np.empty(filas.shape[0], dtype=filas.dtype)
+
+        for inicio in range(0, filas.shape[0], _BLOQUE_ASIGNACION):
+            fin = inicio + _BLOQUE_ASIGNACION
+            d = distancias_sq(filas[inicio:fin], normas[inicio:fin], self.centroides, self.normas_c)
+            asignacion[inicio:fin] = np.argmin(d, axis=1)
+            distancia[inicio:fin] = np.sqrt(d[np.arange(d.shape[0]), asignacion[inicio:fin]])
+
+        return asignacion, distancia
+
+    def _entrenar(self, rng, iteraciones, muestra):
+        """k-means (Lloyd) sobre una muestra de la galería"""
+        n = self.matriz.shape[0]
+        if n > muestra:
+            idx = rng.choice(n, size=muestra, replace=False)
+            datos = self.matriz[idx]
+            normas = self.normas_sq[idx]
+        else:
+            datos = self.matriz
+            normas = self.normas_sq
+
+        # No puede haber más particiones que filas en la muestra (IVF_NLIST > IVF_TRAIN_SAMPLE)
+        self.nlist = min(self.nlist, datos.shape[0])
+        self.nprobe = min(self.nprobe, self.nlist)
+
+        self.centroides = datos[rng.choice(datos.shape[0], size=self.nlist, replace=False)].copy()
+
+        for _ in range(iteraciones):
+            self.normas_c = np.einsum('ij,ij->i', self.centroides, self.centroides)
+            asignacion, _dist = self._asignar(datos, normas)
+
+            sumas = np.zeros_like(self.centroides)
+            np.add.at(sumas, asignacion, datos)
+            conteos = np.bincount(asignacion, minlength=self.nlist)
+
+            vacios = conteos == 0
+            conteos[vacios] = 1
+            self.centroides = sumas / conteos[:, None].astype(datos.dtype)
+
+            # Reiniciar particiones vacías con puntos al azar de la muestra
+            if vacios.any():
+                self.centroides[vacios] = datos[rng.choice(datos.shape[0], size=int(vacios.sum()))]
+
+        return np.ascontiguousarray(self.centroides)
+
+    def _recorrer(self, consulta, norma_q, listas):
+        """Distancias exactas de la consulta a todos los miembros de las listas dadas"""
+        indices = np.concatenate([self.miembros[self.offsets[l]:self.offsets[l + 1]] for l in listas])
+        if len(indices) == 0:
+            return indices, np.empty(0, dtype=self.matriz.dtype)
+
+        d = distancias_sq(consulta[None, :], norma_q[None], self.matriz[indices], self.normas_sq[indices])
+        return indices, np.sqrt(d[0])
+
+    def buscar(self, consultas, normas_q, k=1, tolerance=None):
+        """
+        Args:
+            consultas (numpy.ndarray): Encodings (F, D)
+            normas_q (numpy.ndarray): Normas al cuadrado de las consultas (F,)
+            k (int): Cantidad de vecinos por consulta
+            tolerance (float): Distancia bajo la cual los resultados deben ser exactos
+
+        Returns:
+            tuple: (indices (F, k), distancias (F, k)) ordenados de menor a mayor
+        """
+        dist_c = np.sqrt(distancias_sq(consultas, normas_q, self.centroides, self.normas_c))
+        orden = np.argsort(dist_c, axis=1)
+        exacto = self.exacto_bajo_tolerancia and tolerance is not None
+
+        if exacto:
+            # Filas que la cota con la tolerancia no descarta, decidido una vez por lote
+            revisar = dist_c - self.radios[None, :] <= tolerance + _HOLGURA_COTA
+            np.put_along_axis(revisar, orden[:, :self.nprobe], True, axis=1)
+            filas = revisar @ np.diff(self.offsets)
+
+            if filas.sum() > len(consultas) * self.matriz.shape[0] * _FRACCION_FUERZA_BRUTA:
+                # La cota no poda lo suficiente: un solo GEMM para todo el lote es más barato
+                return ExactIndex(self.matriz, self.normas_sq).buscar(consultas, normas_q, k)
+
+        indices = np.empty((len(consultas), k), dtype=np.int64)
+        distancias = np.empty((len(consultas), k), dtype=self.matriz.dtype)
+
+        for q in range(len(consultas)):
+            sondeadas = orden[q, :self.nprobe]
+
+            cand_i, cand_d = self._recorrer(consultas[q], normas_q[q], sondeadas)
+            top_i, top_d = _top_k(cand_d, cand_i, k)
+
+            if exacto:
+                limite = min(top_d[-1], tolerance)
+                restantes = orden[q, self.nprobe:]
+                cota = dist_c[q][restantes] - self.radios[restantes]
+                extra = restantes[cota <= limite + _HOLGURA_COTA]
+
+                if len(extra) > 0:
+                    extra_i, extra_d = self._recorrer(consultas[q], normas_q[q], extra)
+                    top_i, top_d = _top_k(
+                        np.concatenate((top_d[top_i >= 0], extra_d)),
+                        np.concatenate((top_i[top_i >= 0], extra_i)),
+                        k
+                    )
+
+            indices[q], distancias[q] = top_i, top_d
+
+        return indices, distancias
+
+
+class PrototipoIndex(IVFIndex):
+    """
+    Índice para galerías con varias fotos por estudiante
+
+    Es un IVF cuyas particiones son los estudiantes y cuyos centroides son
+    sus prototipos (media o medoide de sus encodings): cada consulta se
+    compara con un prototipo por estudiante y luego con todas las fotos de
+    los `candidatos` más cercanos, más las de cualquier estudiante cuya cota
+    no descarte una coincidencia bajo la tolerancia. El costo crece con la
+    cantidad de estudiantes, no con la de fotos.
+    """
+
+    nombre = "prototipos"
+
+    def __init__(self, matriz, normas_sq, ids, modo=GALLERY_PROTOTYPES,
+                 candidatos=PROTOTYPE_CANDIDATES, exacto_bajo_tolerancia=True):
+        """
+        Args:
+            matriz (numpy.ndarray): Galería contigua (N, D)
+            normas_sq (numpy.ndarray): Normas al cuadrado de cada fila (N,)
+            ids (list): ID de estudiante de cada fila
+            modo (str): 'media' o 'medoide'
+            candidatos (int): Estudiantes revisados completos por consulta
+            exacto_bajo_tolerancia (bool): Garantizar resultados exactos bajo la tolerancia
+                (las particiones son las fotos de un estudiante, así que la cota sí poda)
+        """
+        _ids, grupos = np.unique(np.asarray(ids), return_inverse=True)
+        grupos = grupos.reshape(-1).astype(np.int64)
+
+        prototipos = _prototipos(matriz, grupos, len(_ids), modo)
+        diferencias = matriz - prototipos[grupos]
+        dist_prototipo = np.sqrt(np.einsum('ij,ij->i', diferencias, diferencias))
+
+        super().__init__(
+            matriz, normas_sq, nprobe=candidatos,
+            exacto_bajo_tolerancia=exacto_bajo_tolerancia,
+            centroides=prototipos, asignacion=grupos, dist_centroide=dist_prototipo
+        )
+
+        logger.info(f"🧬 Índice de prototipos ({modo}): {matriz.shape[0]} rostros de {self.nlist} estudiantes")
+
+
+def _prototipos(matriz, grupos, total, modo):
+    """Prototipo de cada grupo: media de sus filas o la fila más central (medoide)"""
+    orden = np.argsort(grupos, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(grupos, minlength=total))))
+    ordenada = np.asarray(matriz)[orden]
+
+    if modo == "medoide":
+        prototipos = np.empty((total, matriz.shape[1]), dtype=matriz.dtype)
+        for g in range(total):
+            filas = ordenada[offsets[g]:offsets[g + 1]]
+            normas = np.einsum('ij,ij->i', filas, filas)
+            dist = np.sqrt(distancias_sq(filas, normas, filas, normas))
+            prototipos[g] = filas[np.argmin(dist.sum(axis=1))]
+        return prototipos
+
+    sumas = np.add.reduceat(ordenada, offsets[:-1], axis=0)
+    return (sumas / np.diff(offsets)[:, None]).astype(matriz.dtype)
+
+
+def _elegir_tipo(n, tipo, ids):
+    """'prototipos', 'ivf' o 'exacto' según la configuración y la galería (ver crear_indice)"""
+    if tipo == "auto" and ids is not None and GALLERY_PROTOTYPES != "ninguno":
+        estudiantes = len(set(ids))
+        if 0 < estudiantes < n and estudiantes < ANN_MIN_GALLERY:
+            return "prototipos"
+
+    if n > 0 and (tipo == "ivf" or (tipo == "auto" and n >= ANN_MIN_GALLERY)):
+        return "ivf"
+
+    return "exacto"
+
+
+def crear_indice(matriz, normas_sq, tipo=ANN_INDEX, ids=None, centroides=None):
+    """
+    Construye el índice configurado para la galería
+
+    Args:
+        matriz (numpy.ndarray): Galería contigua (N, D)
+        normas_sq (numpy.ndarray): Normas al cuadrado (N,)
+        tipo (str): 'exacto', 'ivf' o 'auto' (prototipos si hay estudiantes
+            con varias fotos y son menos de ANN_MIN_GALLERY; si no, IVF desde
+            ANN_MIN_GALLERY rostros)
+        ids (list): ID de estudiante de cada fila (habilita los prototipos)
+        centroides (numpy.ndarray): Centroides publicados con la galería
+            (ver entrenar_centroides); el IVF solo asigna las filas sin k-means
+
+    Returns:
+        ExactIndex | IVFIndex | PrototipoIndex
+    """
+    elegido = _elegir_tipo(matriz.shape[0], tipo, ids)
+
+    if elegido == "prototipos":
+        return PrototipoIndex(matriz, normas_sq, ids)
+
+    if elegido == "ivf":
+        if centroides is not None and len(centroides) > 0:
+            return IVFIndex(matriz, normas_sq, centroides=np.ascontiguousarray(centroides, dtype=matriz.dtype))
+        return IVFIndex(matriz, normas_sq)
+
+    return ExactIndex(matriz, normas_sq)
+
+
+def entrenar_centroides(matriz, tipo=ANN_INDEX, ids=None):
+    """
+    Entrena una vez los centroides k-means de una galería a publicar, para
+    que los workers que la carguen no repitan el entrenamiento
+
+    Args:
+        matriz (numpy.ndarray): Galería (N, D)
+        tipo (str): Como en crear_indice
+        ids (list): ID de estudiante de cada fila
+
+    Returns:
+        numpy.ndarray: Centroides float32 (nlist, D), o None si la galería no usa IVF
+    """
+    if _elegir_tipo(len(matriz), tipo, ids) != "ivf":
+        return None
+
+    matriz = np.ascontiguousarray(np.asarray(matriz, dtype=np.float32).reshape(len(matriz), -1))
+    normas_sq = np.einsum('ij,ij->i', matriz, matriz)
+    return IVFIndex(matriz, normas_sq).centroides
+
+
+def actualizar_indice(indice, matriz, normas_sq, conservadas, tipo=ANN_INDEX, ids=None):
+    """
+    Índice para una galería derivada de la de `indice` (filas conservadas + nuevas)
+
+    El IVF reutiliza sus centroides; el exacto no tiene estado que conservar
+    y, en modo 'auto', pasa a IVF al cruzar ANN_MIN_GALLERY. Los prototipos
+    se recalculan (es un solo recorrido de la matriz, sin k-means)
+
+    Returns:
+        ExactIndex | IVFIndex | PrototipoIndex
+    """
+    if type(indice) is IVFIndex and matriz.shape[0] > 0:
+        return indice.actualizar(matriz, normas_sq, conservadas)
+
+    return crear_indice(matriz, normas_sq, tipo, ids)
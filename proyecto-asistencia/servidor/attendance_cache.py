@@ -0,0 +1,105 @@
+"""
+attendance_cache.py - Cache en memoria de asistencia y cooldown
+Evita consultar MySQL en cada reconocimiento repetido del mismo estudiante
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+from config import COOLDOWN_SECONDS
+
+# Intervalo mínimo entre barridos completos de entradas expiradas
+_INTERVALO_PURGA = 60
+
+
+class AttendanceCache:
+    """
+    Último registro de asistencia por (id_estudiante, fecha)
+
+    Se calienta desde la tabla `asistencia` al iniciar y al cambiar de día, y
+    se actualiza write-through en cada registro. Las entradas expiran cuando
+    superan el cooldown (`ttl`), momento en que el estudiante puede volver a
+    registrarse.
+
+    Nota: el cache es local a cada proceso. Con varios workers de uvicorn un
+    registro hecho en otro worker no se ve hasta el siguiente calentamiento.
+    """
+
+    def __init__(self, ttl=COOLDOWN_SECONDS):
+        self.ttl = ttl
+        self.fecha = None
+        self._registros = {}
+        self._lock = threading.Lock()
+        self._ultima_purga = time.monotonic()
+        self.consultas = 0
+
+    @property
+    def vigente(self):
+        """True si el cache fue calentado para el día actual"""
+        return self.fecha == date.today()
+
+    def cargar(self, fecha, registros):
+        """
+        Reemplaza el contenido con los registros del día
+
+        Args:
+            fecha (date): Día al que corresponden los registros
+            registros (list): [(id_estudiante, hora_ingreso datetime)]
+        """
+        limite = datetime.now() - timedelta(seconds=self.ttl)
+        with self._lock:
+            self._registros = {
+                (id_estudiante, fecha): hora
+                for id_estudiante, hora in registros
+                if hora is not None and hora > limite
+            }
+            self.fecha = fecha
+
+    def registrar(self, id_estudiante, hora=None):
+        """Write-through: anota un registro recién guardado"""
+        hora = hora or datetime.now()
+        with self._lock:
+            if self.fecha == hora.date():
+                self._registros[(id_estudiante, self.fecha)] = hora
+
+    def en_cooldown(self, id_estudiante, segundos):
+        """
+        Args:
+            id_estudiante (int): ID del estudiante
+            segundos (int): Segundos de cooldown (<= ttl)
+
+        Returns:
+            bool: True si el estudiante se registró hace menos de `segundos`
+        """
+        ahora = datetime.now()
+        with self._lock:
+            self._purgar(ahora)
+            self.consultas += 1
+
+            hora = self._registros.get((id_estudiante, self.fecha))
+            if hora is None:
+                return False
+
+            return ahora - hora < timedelta(seconds=segundos)
+
+    def _purgar(self, ahora):
+        """Elimina entradas con más de `ttl` segundos (llamar con el lock tomado)"""
+        if time.monotonic() - self._ultima_purga < _INTERVALO_PURGA:
+            return
+
+        limite = ahora - timedelta(seconds=self.ttl)
+        self._registros = {
+            clave: hora for clave, hora in self._registros.items() if hora > limite
+        }
+        self._ultima_purga = time.monotonic()
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Día vigente, entradas y consultas resueltas sin SQL
+        """
+        return {
+            "fecha": self.fecha.isoformat() if self.fecha else None,
+            "entradas": len(self._registros),
+            "consultas": self.consultas
+        }
@@ -0,0 +1,297 @@
+"""
+attendance_writer.py - Escritura diferida (write-behind) de asistencia
+Agrupa los registros de todos los dispositivos y los inserta en lotes,
+con un spool local en disco para no perder eventos si MySQL no responde
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from mysql.connector.errors import DataError, IntegrityError
+from config import (
+    WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_SPOOL_FILE,
+    WRITE_BEHIND_FSYNC, WRITE_BEHIND_RETRY_SECONDS, WRITE_BEHIND_MAX_RETRIES,
+    WRITE_BEHIND_DEAD_LETTER_FILE
+)
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class AttendanceWriter:
+    """
+    Cola write-behind de registros de asistencia
+
+    Cada evento se agrega al spool activo (archivo append-only) y al buffer en
+    memoria bajo el mismo lock. Al vaciar, el spool activo se renombra a
+    `.flushing`, de modo que ese archivo contiene exactamente el lote que se
+    está insertando; solo se borra cuando MySQL confirma el INSERT.
+
+    Si un lote falla WRITE_BEHIND_MAX_RETRIES veces seguidas se escribe fila
+    por fila y las que MySQL rechaza (clave foránea, dato inválido) pasan al
+    archivo de rechazados, para que no bloqueen las escrituras siguientes.
+    """
+
+    def __init__(self, spool_file=WRITE_BEHIND_SPOOL_FILE, flush_ms=WRITE_BEHIND_FLUSH_MS,
+                 batch_size=WRITE_BEHIND_BATCH_SIZE, fsync=WRITE_BEHIND_FSYNC,
+                 max_reintentos=WRITE_BEHIND_MAX_RETRIES, rechazados_file=WRITE_BEHIND_DEAD_LETTER_FILE):
+        self.spool_file = spool_file
+        self.spool_flushing = spool_file + ".flushing"
+        self.rechazados_file = rechazados_file
+        self.max_reintentos = max_reintentos
+        self.flush_s = flush_ms / 1000
+        self.batch_size = batch_size
+        self.fsync = fsync
+
+        self._buffer = []
+        self._reintento = []
+        self._fallos_lote = 0
+        self._primer_evento = None
+        self._spool = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._activo = False
+
+        # Métricas
+        self.encolados = 0
+        self.escritos = 0
+        self.lotes = 0
+        self.fallos = 0
+        self.rechazados = 0
+
+    def iniciar(self):
+        """
+        Reinserta eventos pendientes de una ejecución anterior e inicia el hilo de escritura
+
+        La reinserción es asíncrona: los pendientes se anotan en db.cache para
+        que su cooldown valga desde ya, por lo que el cache debe calentarse antes
+        """
+        os.makedirs(os.path.dirname(self.spool_file) or ".", exist_ok=True)
+        os.makedirs(os.path.dirname(self.rechazados_file) or ".", exist_ok=True)
+
+        pendientes = self._leer_spool(self.spool_flushing) + self._leer_spool(self.spool_file)
+        if pendientes:
+            logger.info(f"📼 Reinsertando {len(pendientes)} registros pendientes del spool")
+            # Consolidar todo en .flushing antes de abrir un spool activo nuevo
+            self._escribir_spool(self.spool_flushing, pendientes)
+            if os.path.exists(self.spool_file):
+                os.remove(self.spool_file)
+            self._reintento = pendientes
+
+            if db.cache:
+                for evento in pendientes:
+                    db.cache.registrar(evento['id_estudiante'], datetime.fromisoformat(evento['hora']))
+
+        self._spool = open(self.spool_file, "a", encoding="utf-8")
+        self._activo = True
+        self._thread = threading.Thread(target=self._bucle, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def detener(self):
+        """Vacía lo pendiente y detiene el hilo de escritura"""
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+
+        if self._thread:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+        if self._spool:
+            self._spool.close()
+            self._spool = None
+
+    def encolar(self, id_estudiante, device_id=None):
+        """
+        Registra la asistencia en el spool y la deja pendiente de escritura
+
+        Hace I/O de disco bajo el lock del hilo de escritura: desde código
+        asíncrono llamarlo con run_in_threadpool
+
+        Args:
+            id_estudiante (int): ID del estudiante
+            device_id (str): Identificador del dispositivo
+
+        Returns:
+            dict: Resultado con el mismo formato que Database.registrar_asistencia
+        """
+        hora = datetime.now()
+        evento = {
+            "id_estudiante": id_estudiante,
+            "fecha": hora.date().isoformat(),
+            "hora": hora.isoformat(timespec="seconds"),
+            "device_id": device_id
+        }
+
+        try:
+            with self._cond:
+                self._spool.write(json.dumps(evento) + "\n")
+                self._spool.flush()
+                if self.fsync:
+                    os.fsync(self._spool.fileno())
+
+                self._buffer.append(evento)
+                self.encolados += 1
+
+                # Despertar al hilo para iniciar el plazo del lote o vaciarlo si está lleno
+                if self._primer_evento is None:
+                    self._primer_evento = time.monotonic()
+                    self._cond.notify()
+                elif len(self._buffer) >= self.batch_size:
+                    self._cond.notify()
+
+        except Exception as e:
+            logger.error(f"Error al escribir spool de asistencia: {e}")
+            return {"success": False, "error": str(e)}
+
+        # El cooldown debe respetarse aunque el lote aún no llegue a MySQL
+        if db.cache:
+            db.cache.registrar(id_estudiante, hora)
+
+        return {
+            "success": True,
+            "resultado": "encolado",
+            "id_estudiante": id_estudiante
+        }
+
+    def _bucle(self):
+        """Hilo de escritura: vacía cada flush_ms o al juntar batch_size eventos"""
+        while True:
+            if self._reintento:
+                pendientes = [] if self._escribir(self._reintento) else self._reintento
+                if pendientes:
+                    self._fallos_lote += 1
+                    if self._fallos_lote >= self.max_reintentos:
+                        # Puede haber filas que MySQL nunca aceptará: separarlas del lote
+                        self._fallos_lote = 0
+                        pendientes = self._separar(pendientes)
+                        if pendientes:
+                            self._escribir_spool(self.spool_flushing, pendientes)
+
+                if pendientes:
+                    self._reintento = pendientes
+                    time.sleep(WRITE_BEHIND_RETRY_SECONDS)
+                    if self._activo:
+                        continue
+                    logger.warning("⚠️  Registros sin escribir quedan en el spool para el próximo inicio")
+                    return
+                self._fallos_lote = 0
+                self._reintento = []
+                os.remove(self.spool_flushing)
+
+            with self._cond:
+                while self._activo and not self._listo_para_vaciar():
+                    espera = None
+                    if self._primer_evento is not None:
+                        espera = max(0.0, self._primer_evento + self.flush_s - time.monotonic())
+                    self._cond.wait(timeout=espera)
+
+                if not self._buffer:
+                    if not self._activo:
+                        return
+                    continue
+
+                # Sellar el spool: .flushing contiene exactamente este lote
+                lote = self._buffer
+                self._buffer = []
+                self._primer_evento = None
+                self._spool.close()
+                os.replace(self.spool_file, self.spool_flushing)
+                self._spool = open(self.spool_file, "a", encoding="utf-8")
+
+            self._reintento = lote
+
+    def _listo_para_vaciar(self):
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return (self._primer_evento is not None
+                and time.monotonic() - self._primer_evento >= self.flush_s)
+
+    def _escribir(self, lote):
+        """Inserta un lote en MySQL; devuelve False si hay que reintentar"""
+        try:
+            db.registrar_asistencias_lote(lote)
+            self.escritos += len(lote)
+            self.lotes += 1
+            return True
+        except Exception as e:
+            self.fallos += 1
+            logger.error(f"❌ Error al escribir lote de asistencia ({len(lote)} registros): {e}")
+            return False
+
+    def _separar(self, lote):
+        """
+        Escribe un lote fila por fila; las filas que MySQL rechaza van al archivo de rechazados
+
+        Returns:
+            list: Filas aún pendientes (desde la primera que falló por un error
+                transitorio, ej. MySQL no disponible)
+        """
+        rechazados = []
+        pendientes = []
+
+        for i, evento in enumerate(lote):
+            try:
+                db.registrar_asistencias_lote([evento])
+                self.escritos += 1
+            except (IntegrityError, DataError) as e:
+                logger.error(f"❌ Registro de asistencia rechazado por MySQL: {evento} ({e})")
+                rechazados.append(dict(evento, error=str(e)))
+            except Exception:
+                pendientes = lote[i:]
+                break
+
+        if rechazados:
+            with open(self.rechazados_file, "a", encoding="utf-8") as f:
+                for evento in rechazados:
+                    f.write(json.dumps(evento) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.rechazados += len(rechazados)
+            logger.warning(f"⚠️  {len(rechazados)} registros movidos a {self.rechazados_file}")
+
+        return pendientes
+
+    def _leer_spool(self, path):
+        if not os.path.exists(path):
+            return []
+
+        eventos = []
+        with open(path, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    eventos.append(json.loads(linea))
+                except ValueError:
+                    # Línea truncada por un cierre abrupto
+                    logger.warning(f"⚠️  Línea inválida en spool ignorada: {linea!r}")
+        return eventos
+
+    def _escribir_spool(self, path, eventos):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for evento in eventos:
+                f.write(json.dumps(evento) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Eventos encolados, escritos, pendientes, lotes fallidos y rechazados
+        """
+        return {
+            "encolados": self.encolados,
+            "escritos": self.escritos,
+            "pendientes": len(self._buffer) + len(self._reintento or []),
+            "lotes": self.lotes,
+            "fallos": self.fallos,
+            "rechazados": self.rechazados
+        }
+
+
+# Instancia global
+attendance_writer = AttendanceWriter()
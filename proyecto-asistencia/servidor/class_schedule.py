@@ -0,0 +1,155 @@
+"""
+class_schedule.py - Horario de clases para acotar el reconocimiento
+Resuelve dispositivo → sala → curso con clase en este momento → estudiantes
+inscritos, para comparar cada rostro primero contra ese grupo reducido
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import SCHEDULE_ENABLED, SCHEDULE_REFRESH_SECONDS, SCHEDULE_MARGIN_MINUTES
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+def _minutos(hora):
+    """Minutos desde medianoche de un TIME de MySQL (timedelta) o datetime.time"""
+    if hasattr(hora, "total_seconds"):
+        return int(hora.total_seconds() // 60)
+    return hora.hour * 60 + hora.minute
+
+
+class ClassSchedule:
+    """
+    Horario en memoria, releído de la BD cada SCHEDULE_REFRESH_SECONDS
+
+    La consulta por frame no toca la BD: si el horario venció se relee en
+    segundo plano y mientras tanto se usa el anterior.
+    """
+
+    def __init__(self, habilitado=SCHEDULE_ENABLED, refresco=SCHEDULE_REFRESH_SECONDS,
+                 margen=SCHEDULE_MARGIN_MINUTES):
+        self.habilitado = habilitado
+        self.refresco = refresco
+        self.margen = margen
+        self._datos = None
+        self._cargado = 0.0
+        self._lock = threading.Lock()
+        self._actualizando = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="horario")
+
+        # Métricas
+        self.consultas = 0
+        self.con_candidatos = 0
+
+    def cargar(self):
+        """
+        Lee salas, horarios e inscripciones desde la BD (bloqueante)
+
+        Returns:
+            bool: True si se cargó; ante un error se conserva el horario anterior
+        """
+        if not self.habilitado:
+            return False
+
+        try:
+            horario = db.obtener_horario()
+            if horario is None:
+                return False
+
+            salas = {dispositivo: sala for dispositivo, sala in horario['salas']}
+
+            bloques = {}
+            for sala, dia, inicio, fin, id_curso in horario['horarios']:
+                bloques.setdefault(sala, []).append((int(dia), _minutos(inicio), _minutos(fin), id_curso))
+
+            inscritos = {}
+            for id_curso, id_estudiante in horario['inscripciones']:
+                inscritos.setdefault(id_curso, set()).add(id_estudiante)
+
+            self._datos = {'salas': salas, 'bloques': bloques, 'inscritos': inscritos}
+            logger.info(f"🗓️  Horario cargado: {len(salas)} salas con dispositivo, "
+                        f"{sum(len(b) for b in bloques.values())} bloques, {len(inscritos)} cursos")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al cargar horario: {e}")
+            return False
+
+        finally:
+            self._cargado = time.monotonic()
+            with self._lock:
+                self._actualizando = False
+
+    def _refrescar_si_vencido(self):
+        if time.monotonic() - self._cargado < self.refresco:
+            return
+
+        with self._lock:
+            if self._actualizando:
+                return
+            self._actualizando = True
+
+        self._executor.submit(self.cargar)
+
+    def candidatos(self, device_id, ahora=None):
+        """
+        Estudiantes que pueden estar frente al dispositivo según el horario
+
+        Args:
+            device_id (str): Identificador del dispositivo
+            ahora (datetime): Momento de la consulta (por defecto, ahora)
+
+        Returns:
+            tuple: IDs ordenados de los inscritos en los cursos con clase en la
+                sala (con SCHEDULE_MARGIN_MINUTES de margen), o None si el
+                dispositivo no tiene sala o no hay clase
+        """
+        if not self.habilitado or not device_id:
+            return None
+
+        self._refrescar_si_vencido()
+        self.consultas += 1
+
+        datos = self._datos
+        if not datos:
+            return None
+
+        sala = datos['salas'].get(device_id)
+        if sala is None:
+            return None
+
+        ahora = ahora or datetime.now()
+        dia = ahora.weekday()
+        minuto = ahora.hour * 60 + ahora.minute
+
+        ids = set()
+        for dia_bloque, inicio, fin, id_curso in datos['bloques'].get(sala, ()):
+            if dia_bloque == dia and inicio - self.margen <= minuto <= fin + self.margen:
+                ids.update(datos['inscritos'].get(id_curso, ()))
+
+        if not ids:
+            return None
+
+        self.con_candidatos += 1
+        return tuple(sorted(ids))
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Salas con dispositivo y consultas resueltas con candidatos
+        """
+        datos = self._datos or {}
+        return {
+            "habilitado": self.habilitado,
+            "salas": len(datos.get('salas', {})),
+            "consultas": self.consultas,
+            "con_candidatos": self.con_candidatos
+        }
+
+
+# Instancia global
+class_schedule = ClassSchedule()
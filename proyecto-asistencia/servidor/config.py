@@ -9,27 +9,98 @@ DB_CONFIG = {
     "port": 3306
 }
 
+# Pool de conexiones MySQL
+DB_POOL_SIZE = 10  # Conexiones persistentes
+DB_POOL_TIMEOUT = 5  # Segundos máximos esperando una conexión libre
+DB_POOL_PING_INTERVAL = 30  # Verificar conexiones inactivas por más de N segundos
+
 # Configuración del servidor
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 8000
 
 # Rutas de archivos
 FOTOS_DIR = "fotos_conocidas"
-ENCODINGS_FILE = "fotos_conocidas/encodings.pkl"
+GALLERY_DIR = "fotos_conocidas/galeria"  # Matriz float32 (.npy, memmap) + metadatos versionados
+ENCODINGS_FILE = "fotos_conocidas/encodings.pkl"  # Formato anterior (pickle): solo se lee para migrar
+ENCODING_WORKERS = 0  # Procesos para generar encodings de fotos nuevas o modificadas (0 = un proceso por núcleo)
 
 # Configuración de reconocimiento facial
 FACE_TOLERANCE = 0.6  # Menor = más estricto (0.4-0.7 recomendado)
 FACE_DETECTION_MODEL = "hog"  # "hog" (rápido, CPU) o "cnn" (preciso, GPU)
+MATCHER_DTYPE = "float32"  # Precisión de la matriz de encodings: "float32" o "float64"
+
+# Índice de búsqueda aproximada (galerías grandes)
+ANN_INDEX = "auto"  # "exacto", "ivf" o "auto" (IVF desde ANN_MIN_GALLERY rostros)
+ANN_MIN_GALLERY = 5000  # Tamaño mínimo de galería para usar IVF en modo "auto"
+IVF_NLIST = 0  # Particiones k-means (0 = automático, ~4·√N)
+IVF_NPROBE = 8  # Particiones recorridas por consulta (más = mejor recall, más latencia)
+IVF_EXACT_TOLERANCE = False  # True = resultado exacto bajo FACE_TOLERANCE; con rostros dispersos casi no poda y cuesta más que "exacto"
+# Sin modo exacto el recall depende de IVF_NPROBE: subirlo recupera coincidencias que caen en particiones vecinas
+IVF_KMEANS_ITER = 10  # Iteraciones de k-means al construir el índice
+IVF_TRAIN_SAMPLE = 20000  # Rostros usados para entrenar k-means
+
+# Varias fotos por estudiante
+GALLERY_PROTOTYPES = "media"  # Prototipo de cada estudiante con varias fotos: "media", "medoide" o "ninguno"
+PROTOTYPE_CANDIDATES = 3  # Estudiantes más cercanos por prototipo cuyas fotos se comparan todas
 
 # Configuración de procesamiento de imágenes
-FRAME_RESIZE_WIDTH = 480  # Redimensionar frame para procesamiento más rápido
-MAX_FRAME_SIZE_MB = 5  # Tamaño máximo del frame en MB
+FRAME_RESIZE_WIDTH = 480  # Ancho para detectar rostros (0 = resolución completa); los encodings usan la completa
+MAX_FRAME_SIZE_MB = 5  # Tamaño máximo del frame en MB (mayores se rechazan con 413)
+MAX_CROPS_PER_FRAME = 10  # Recortes de rostro aceptados por request (protocolo de recortes)
+WS_MAX_INFLIGHT = 2  # Frames en proceso por conexión WebSocket (los excedentes se responden "busy")
+
+# Seguimiento de rostros entre frames (evita recalcular encodings)
+TRACKING_ENABLED = True
+TRACK_IOU_MIN = 0.3  # IoU mínimo para asociar una caja con un track existente
+TRACK_CENTROID_MAX = 0.5  # Alternativa: distancia de centros / ancho de la caja (siempre recalcula el encoding)
+TRACK_SCALE_JUMP = 1.5  # Cambio de área de la caja entre frames que obliga a recalcular el encoding
+TRACK_REENCODE_EVERY = 10  # Recalcular el encoding de un track confirmado cada N frames
+TRACK_CONFIRM_HITS = 2  # Encodings seguidos con la misma identidad para confirmar un track
+TRACK_TTL_SECONDS = 2.0  # Descartar tracks no vistos en N segundos
+
+# Motor de reconocimiento (fuera del event loop)
+RECOGNITION_EXECUTOR = "process"  # "process" (un proceso por núcleo) o "thread"
+RECOGNITION_WORKERS = 0  # Cantidad de workers (0 = uno por núcleo)
+RECOGNITION_QUEUE_MAX = 32  # Frames pendientes antes de responder 503
+RECOGNITION_DEVICE_AFFINITY = True  # Enviar cada dispositivo siempre al mismo proceso (conserva sus tracks)
+RECOGNITION_BATCH_ENABLED = True  # Agrupar frames concurrentes en un solo paso de encodings y búsqueda (solo con RECOGNITION_DEVICE_AFFINITY en modo "process")
+RECOGNITION_BATCH_WAIT_MS = 5  # Espera máxima para completar un lote (latencia agregada)
+RECOGNITION_BATCH_MAX = 8  # Frames por lote (al completarse se despacha sin esperar)
 
 # Cooldown para evitar registros duplicados
 COOLDOWN_SECONDS = 300  # 5 minutos entre registros del mismo estudiante
+ATTENDANCE_CACHE_ENABLED = True  # Resolver el cooldown en memoria sin consultar MySQL
+
+# Escritura diferida de asistencia (write-behind)
+WRITE_BEHIND_ENABLED = True  # Responder al frame sin esperar el commit de MySQL
+WRITE_BEHIND_FLUSH_MS = 200  # Vaciar el lote cada N milisegundos...
+WRITE_BEHIND_BATCH_SIZE = 100  # ...o al juntar N registros
+WRITE_BEHIND_SPOOL_FILE = "spool/asistencia.log"  # Spool append-only para no perder registros
+WRITE_BEHIND_FSYNC = False  # fsync por registro (más durable ante cortes de luz, más lento)
+WRITE_BEHIND_RETRY_SECONDS = 2  # Espera entre reintentos si MySQL no está disponible
+WRITE_BEHIND_MAX_RETRIES = 5  # Fallos seguidos de un lote antes de escribirlo fila por fila
+WRITE_BEHIND_DEAD_LETTER_FILE = "spool/asistencia.rechazados.log"  # Registros que MySQL rechaza (ej. estudiante eliminado)
+
+# Registro de dispositivos (tabla dispositivos + cache en memoria)
+DEVICE_CACHE_TTL = 60  # Segundos antes de releer de la BD la IP de un dispositivo
+DEVICE_PING_WRITE_SECONDS = 30  # Actualizar ultimo_ping en la BD como máximo cada N segundos por dispositivo
+
+# Candidatos por horario (dispositivo → sala → curso con clase → inscritos)
+SCHEDULE_ENABLED = True  # Comparar primero con los inscritos del curso en la sala del dispositivo
+SCHEDULE_REFRESH_SECONDS = 300  # Cada cuánto se relee el horario desde la BD
+SCHEDULE_MARGIN_MINUTES = 15  # Minutos antes del inicio y después del fin en que la clase sigue vigente
+SCHEDULE_MAX_SUBGALLERIES = 64  # Subgalerías por curso cacheadas en cada worker
 
 # Configuración de LEDs remotos
 LED_CONTROL_TIMEOUT = 2  # Timeout para llamadas a API de GPIO
+LED_API_PORT = 5000  # Puerto de control_gpio_api.py en la Raspberry Pi
+LED_GREEN_DURATION = 2  # Segundos de LED verde al registrar asistencia
+LED_RED_DURATION = 1  # Segundos de LED rojo ante un rostro no reconocido
+LED_DISPATCH_WORKERS = 4  # Envíos de comandos LED simultáneos
+LED_QUEUE_MAX = 256  # Dispositivos con comando pendiente antes de descartar
+LED_KEEPALIVE_SECONDS = 30  # Tiempo que se conserva abierta la conexión con cada Pi
+LED_BREAKER_FAILURES = 3  # Fallos seguidos para abrir el circuito de un dispositivo
+LED_BREAKER_COOLDOWN = 30  # Segundos sin enviar a un dispositivo con el circuito abierto
 
 # Logging
 LOG_FILE = "/var/log/asistencia_server.log"
@@ -4,19 +4,171 @@ database.py - Módulo de conexión y operaciones con MySQL
 
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 from contextlib import contextmanager
 from datetime import date, datetime
-from config import DB_CONFIG
+from config import (
+    DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_INTERVAL,
+    ATTENDANCE_CACHE_ENABLED
+)
+from attendance_cache import AttendanceCache
 import logging
+import queue
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 
+class ConnectionPool:
+    """
+    Pool de conexiones MySQL persistentes
+    
+    Las conexiones se crean bajo demanda hasta `size`, se reutilizan en orden
+    LIFO (la más reciente está "caliente") y se verifican con ping antes de
+    entregarse si estuvieron inactivas más de `ping_interval` segundos.
+    """
+    
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 ping_interval=DB_POOL_PING_INTERVAL):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        
+        self._libres = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._creadas = 0
+        
+        # Métricas
+        self._solicitudes = 0
+        self._esperas = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._agotado = 0
+        self._timeouts = 0
+        self._reconexiones = 0
+    
+    def _crear_si_hay_cupo(self):
+        """Abre una conexión nueva si no se alcanzó el tamaño del pool"""
+        with self._lock:
+            if self._creadas >= self.size:
+                return None
+            self._creadas += 1
+        
+        try:
+            return mysql.connector.connect(**self.config)
+        except Error:
+            with self._lock:
+                self._creadas -= 1
+            raise
+    
+    def _descartar(self, conn):
+        """Cierra una conexión y libera su cupo"""
+        with self._lock:
+            self._creadas -= 1
+        try:
+            conn.close()
+        except Error:
+            pass
+    
+    def _verificar(self, conn, ultimo_uso):
+        """
+        Health check: hace ping a conexiones inactivas y reconecta si están caídas
+        
+        Returns:
+            Conexión lista para usar
+        """
+        if time.monotonic() - ultimo_uso < self.ping_interval:
+            return conn
+        
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return conn
+        except Error:
+            logger.warning("🔄 Conexión MySQL inactiva caída, reconectando...")
+            with self._lock:
+                self._reconexiones += 1
+            self._descartar(conn)
+            nueva = self._crear_si_hay_cupo()
+            if nueva is None:
+                raise PoolError("No se pudo reponer la conexión del pool")
+            return nueva
+    
+    def obtener(self):
+        """
+        Entrega una conexión del pool, esperando hasta `timeout` si está agotado
+        
+        Raises:
+            PoolError: Si no hay conexiones libres dentro del timeout
+        """
+        with self._lock:
+            self._solicitudes += 1
+        
+        try:
+            conn, ultimo_uso = self._libres.get_nowait()
+            return self._verificar(conn, ultimo_uso)
+        except queue.Empty:
+            pass
+        
+        conn = self._crear_si_hay_cupo()
+        if conn is not None:
+            return conn
+        
+        # Pool agotado: esperar a que otro hilo devuelva una conexión
+        with self._lock:
+            self._agotado += 1
+        inicio = time.monotonic()
+        try:
+            conn, ultimo_uso = self._libres.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolError(f"Pool MySQL agotado ({self.size} conexiones en uso)")
+        finally:
+            espera = time.monotonic() - inicio
+            with self._lock:
+                self._esperas += 1
+                self._espera_total += espera
+                self._espera_max = max(self._espera_max, espera)
+        
+        return self._verificar(conn, ultimo_uso)
+    
+    def devolver(self, conn, reutilizable=True):
+        """Devuelve una conexión al pool (o la descarta si quedó inválida)"""
+        if reutilizable:
+            self._libres.put((conn, time.monotonic()))
+        else:
+            self._descartar(conn)
+    
+    def metricas(self):
+        """
+        Returns:
+            dict: Estado y métricas del pool
+        """
+        libres = self._libres.qsize()
+        with self._lock:
+            return {
+                "tamano": self.size,
+                "abiertas": self._creadas,
+                "en_uso": self._creadas - libres,
+                "libres": libres,
+                "solicitudes": self._solicitudes,
+                "agotado": self._agotado,
+                "timeouts": self._timeouts,
+                "reconexiones": self._reconexiones,
+                "espera_promedio_ms": round(1000 * self._espera_total / self._esperas, 2) if self._esperas else 0.0,
+                "espera_max_ms": round(1000 * self._espera_max, 2)
+            }
+
+
 class Database:
     """Clase para manejar operaciones con MySQL"""
     
     def __init__(self):
         self.config = DB_CONFIG
+        self.pool = ConnectionPool(self.config)
+        self.cache = AttendanceCache() if ATTENDANCE_CACHE_ENABLED else None
     
     @contextmanager
     def get_connection(self):
@@ -29,18 +181,26 @@ class Database:
                 cursor.execute(...)
         """
         conn = None
+        reutilizable = True
         try:
-            conn = mysql.connector.connect(**self.config)
+            conn = self.pool.obtener()
             yield conn
             conn.commit()
         except Error as e:
             if conn:
-                conn.rollback()
+                try:
+                    conn.rollback()
+                except Error:
+                    reutilizable = False
             logger.error(f"Error de base de datos: {e}")
             raise
+        except BaseException:
+            # Estado de transacción desconocido: no devolver la conexión al pool
+            reutilizable = False
+            raise
         finally:
-            if conn and conn.is_connected():
-                conn.close()
+            if conn:
+                self.pool.devolver(conn, reutilizable)
     
     def registrar_asistencia(self, id_estudiante, device_id=None):
         """
@@ -80,11 +240,15 @@ class Database:
                 
                 cursor.close()
                 
-                return {
-                    "success": True,
-                    "resultado": resultado,
-                    "id_estudiante": id_estudiante
-                }
+            # Write-through: el registro ya está confirmado en la BD
+            if self.cache:
+                self.cache.registrar(id_estudiante)
+            
+            return {
+                "success": True,
+                "resultado": resultado,
+                "id_estudiante": id_estudiante
+            }
                 
         except Error as e:
             logger.error(f"Error al registrar asistencia: {e}")
@@ -93,6 +257,47 @@ class Database:
                 "error": str(e)
             }
     
+    def registrar_asistencias_lote(self, eventos):
+        """
+        Inserta varios registros de asistencia en un solo INSERT multi-fila
+        
+        Se conserva la hora del evento (no la del INSERT) y, ante duplicados,
+        la hora más reciente, por lo que reinsertar un lote es idempotente.
+        
+        Args:
+            eventos (list): [{'id_estudiante', 'fecha', 'hora', 'device_id'}]
+                con fecha y hora en formato ISO
+            
+        Raises:
+            Error: Si la inserción falla (el lote debe reintentarse)
+        """
+        if not eventos:
+            return
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            filas = ", ".join(["(%s, %s, %s, %s)"] * len(eventos))
+            query = f"""
+            INSERT INTO asistencia (id_estudiante, fecha_registro, hora_ingreso, dispositivo_id)
+            VALUES {filas}
+            ON DUPLICATE KEY UPDATE 
+                dispositivo_id = IF(VALUES(hora_ingreso) >= hora_ingreso, VALUES(dispositivo_id), dispositivo_id),
+                hora_ingreso = GREATEST(hora_ingreso, VALUES(hora_ingreso))
+            """
+            
+            parametros = []
+            for evento in eventos:
+                parametros.extend((
+                    evento['id_estudiante'],
+                    date.fromisoformat(evento['fecha']),
+                    datetime.fromisoformat(evento['hora']),
+                    evento.get('device_id')
+                ))
+            
+            cursor.execute(query, parametros)
+            cursor.close()
+    
     def obtener_estudiantes(self):
         """
         Obtiene la lista completa de estudiantes
@@ -196,6 +401,9 @@ class Database:
         """
         Verifica si un estudiante ya fue registrado recientemente
         
+        Se responde desde el cache en memoria cuando está vigente; solo se
+        consulta MySQL si el cache está deshabilitado o no se pudo calentar
+        
         Args:
             id_estudiante (int): ID del estudiante
             segundos (int): Segundos de cooldown
@@ -203,6 +411,12 @@ class Database:
         Returns:
             bool: True si está en cooldown, False si puede registrarse
         """
+        if self.cache and segundos <= self.cache.ttl:
+            if not self.cache.vigente:
+                self.calentar_cache()
+            if self.cache.vigente:
+                return self.cache.en_cooldown(id_estudiante, segundos)
+        
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor(dictionary=True)
@@ -225,6 +439,171 @@ class Database:
         except Error as e:
             logger.error(f"Error al verificar cooldown: {e}")
             return False
+    
+    def registrar_dispositivo(self, nombre, ip_address):
+        """
+        Crea o actualiza un dispositivo con su IP y último contacto
+        
+        Args:
+            nombre (str): Identificador del dispositivo (device_id)
+            ip_address (str): IP desde la que se comunicó
+            
+        Returns:
+            bool: True si se guardó
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                query = """
+                INSERT INTO dispositivos (nombre, ip_address, ultimo_ping, activo)
+                VALUES (%s, %s, CURRENT_TIMESTAMP, TRUE)
+                ON DUPLICATE KEY UPDATE 
+                    ip_address = VALUES(ip_address),
+                    ultimo_ping = CURRENT_TIMESTAMP,
+                    activo = TRUE
+                """
+                
+                cursor.execute(query, (nombre, ip_address))
+                cursor.close()
+                
+            return True
+                
+        except Error as e:
+            logger.error(f"Error al registrar dispositivo: {e}")
+            return False
+    
+    def obtener_dispositivo(self, nombre):
+        """
+        Obtiene un dispositivo activo por su identificador
+        
+        Args:
+            nombre (str): Identificador del dispositivo (device_id)
+            
+        Returns:
+            dict: Dispositivo o None
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                
+                query = """
+                SELECT nombre, ip_address, ultimo_ping
+                FROM dispositivos
+                WHERE nombre = %s AND activo = TRUE
+                ORDER BY ultimo_ping DESC
+                LIMIT 1
+                """
+                
+                cursor.execute(query, (nombre,))
+                dispositivo = cursor.fetchone()
+                cursor.close()
+                
+                return dispositivo
+                
+        except Error as e:
+            logger.error(f"Error al obtener dispositivo: {e}")
+            return None
+    
+    def obtener_dispositivos(self):
+        """
+        Obtiene todos los dispositivos registrados
+        
+        Returns:
+            list: Lista de dispositivos
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                
+                query = """
+                SELECT nombre, ip_address, ultimo_ping, activo
+                FROM dispositivos
+                ORDER BY nombre
+                """
+                
+                cursor.execute(query)
+                dispositivos = cursor.fetchall()
+                cursor.close()
+                
+                return dispositivos
+                
+        except Error as e:
+            logger.error(f"Error al obtener dispositivos: {e}")
+            return []
+    
+    def obtener_horario(self):
+        """
+        Obtiene la sala de cada dispositivo, el horario semanal y las inscripciones
+        
+        Returns:
+            dict: 'salas' (dispositivo, sala), 'horarios' (sala, dia_semana,
+                hora_inicio, hora_fin, id_curso) e 'inscripciones'
+                (id_curso, id_estudiante), o None si hubo un error
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                SELECT nombre, sala
+                FROM dispositivos
+                WHERE sala IS NOT NULL AND activo = TRUE
+                """)
+                salas = cursor.fetchall()
+                
+                cursor.execute("""
+                SELECT sala, dia_semana, hora_inicio, hora_fin, id_curso
+                FROM horarios
+                """)
+                horarios = cursor.fetchall()
+                
+                cursor.execute("""
+                SELECT id_curso, id_estudiante
+                FROM inscripciones
+                """)
+                inscripciones = cursor.fetchall()
+                cursor.close()
+                
+                return {
+                    'salas': salas,
+                    'horarios': horarios,
+                    'inscripciones': inscripciones
+                }
+                
+        except Error as e:
+            logger.error(f"Error al obtener horario: {e}")
+            return None
+    
+    def calentar_cache(self):
+        """
+        Carga en el cache los registros de asistencia del día actual
+        (al iniciar y en el cambio de fecha)
+        """
+        if not self.cache:
+            return
+        
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                fecha_hoy = date.today()
+                
+                query = """
+                SELECT id_estudiante, hora_ingreso
+                FROM asistencia
+                WHERE fecha_registro = %s
+                """
+                
+                cursor.execute(query, (fecha_hoy,))
+                registros = cursor.fetchall()
+                cursor.close()
+                
+            self.cache.cargar(fecha_hoy, registros)
+            logger.info(f"🧠 Cache de asistencia calentado: {len(registros)} registros de hoy")
+            
+        except Error as e:
+            logger.error(f"Error al calentar cache de asistencia: {e}")
 
 
 # Instancia global
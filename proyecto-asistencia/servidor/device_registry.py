@@ -0,0 +1,133 @@
+"""
+device_registry.py - Registro de dispositivos (Raspberry Pi)
+Mantiene la IP y el último contacto de cada dispositivo en la tabla
+dispositivos, con un cache en memoria para no consultar MySQL por frame
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import DEVICE_CACHE_TTL, DEVICE_PING_WRITE_SECONDS
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRegistry:
+    """
+    Cache de dispositivos respaldado por la BD
+
+    Cada frame actualiza el cache al instante (antes de procesarlo, así el
+    primer comando LED ya tiene IP) y el ultimo_ping se escribe en segundo
+    plano como máximo cada DEVICE_PING_WRITE_SECONDS. Las entradas con más de
+    DEVICE_CACHE_TTL segundos se releen de la BD, de modo que varios workers
+    o nodos convergen a la IP registrada por cualquiera de ellos.
+    """
+
+    def __init__(self, ttl=DEVICE_CACHE_TTL, intervalo_ping=DEVICE_PING_WRITE_SECONDS):
+        self.ttl = ttl
+        self.intervalo_ping = intervalo_ping
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dispositivos")
+
+        # Métricas
+        self.lecturas_bd = 0
+        self.escrituras_bd = 0
+
+    def visto(self, device_id, ip_address):
+        """
+        Registra el contacto de un dispositivo sin bloquear (se llama por frame)
+
+        Args:
+            device_id (str): Identificador del dispositivo
+            ip_address (str): IP de origen del request
+        """
+        if not device_id or not ip_address:
+            return
+
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._cache.get(device_id)
+            if entrada and entrada['ip'] == ip_address:
+                entrada['actualizado'] = ahora
+                if ahora - entrada['persistido'] < self.intervalo_ping:
+                    return
+                entrada['persistido'] = ahora
+            else:
+                self._cache[device_id] = {
+                    'ip': ip_address,
+                    'actualizado': ahora,
+                    'persistido': ahora
+                }
+
+        self.escrituras_bd += 1
+        self._executor.submit(db.registrar_dispositivo, device_id, ip_address)
+
+    def registrar(self, device_id, ip_address):
+        """
+        Registro explícito / heartbeat: escribe en la BD de inmediato
+
+        Returns:
+            bool: True si se guardó en la BD
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            self._cache[device_id] = {
+                'ip': ip_address,
+                'actualizado': ahora,
+                'persistido': ahora
+            }
+
+        self.escrituras_bd += 1
+        return db.registrar_dispositivo(device_id, ip_address)
+
+    def ip_de(self, device_id):
+        """
+        IP del dispositivo (puede consultar la BD: llamar fuera del event loop)
+
+        Returns:
+            str: IP, o None si el dispositivo no está registrado
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._cache.get(device_id)
+            if entrada and ahora - entrada['actualizado'] <= self.ttl:
+                return entrada['ip']
+
+        self.lecturas_bd += 1
+        dispositivo = db.obtener_dispositivo(device_id)
+
+        if not dispositivo or not dispositivo['ip_address']:
+            # Sin dato en la BD: usar lo último conocido por este proceso
+            return entrada['ip'] if entrada else None
+
+        with self._lock:
+            entrada = self._cache.setdefault(device_id, {'persistido': 0.0})
+            entrada['ip'] = dispositivo['ip_address']
+            entrada['actualizado'] = ahora
+
+        return dispositivo['ip_address']
+
+    def listar(self):
+        """
+        Returns:
+            list: Dispositivos de la BD con su último contacto
+        """
+        return db.obtener_dispositivos()
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Dispositivos en cache y accesos a la BD
+        """
+        return {
+            "en_cache": len(self._cache),
+            "lecturas_bd": self.lecturas_bd,
+            "escrituras_bd": self.escrituras_bd
+        }
+
+
+# Instancia global
+device_registry = DeviceRegistry()
@@ -0,0 +1,256 @@
+"""
+encodings_store.py - Almacenamiento en disco de la galería de encodings
+Matriz float32 contigua en formato .npy (abierta con memmap, compartida por
+todos los workers a través del page cache) y metadatos JSON con versión,
+tablas de ids/nombres/fotos de origen y checksum
+"""
+
+import fcntl
+import json
+import logging
+import os
+import zlib
+from contextlib import contextmanager
+import numpy as np
+from config import GALLERY_DIR
+
+logger = logging.getLogger(__name__)
+
+FORMATO = 1
+DIMENSION = 128
+ARCHIVO_METADATOS = "galeria.json"
+ARCHIVO_BLOQUEO = ".publicacion.lock"
+
+
+class GaleriaCorrupta(Exception):
+    """Los metadatos no coinciden con la matriz en disco"""
+
+
+def _checksum(matriz):
+    """CRC32 de los bytes de la matriz (lee el memmap secuencialmente)"""
+    return zlib.crc32(np.ascontiguousarray(matriz).reshape(-1).view(np.uint8)) & 0xFFFFFFFF
+
+
+def _como_matriz(encodings):
+    """Encodings como matriz float32 contigua (N, 128)"""
+    if len(encodings) == 0:
+        return np.empty((0, DIMENSION), dtype=np.float32)
+    return np.ascontiguousarray(np.asarray(encodings, dtype=np.float32).reshape(len(encodings), DIMENSION))
+
+
+class EncodingsStore:
+    """
+    Galería versionada en un directorio
+
+    Cada versión escribe su propia matriz `encodings-v{N}.npy`; el archivo
+    de metadatos se reemplaza con os.replace y es el punto de commit, así un
+    lector nunca ve la matriz de una versión con los ids de otra. Las
+    matrices anteriores se borran después: los procesos que las tengan
+    mapeadas las siguen leyendo hasta recargar.
+
+    Publicar toma un bloqueo exclusivo (flock) sobre un archivo del
+    directorio, así el servidor y generate_encodings.py nunca calculan la
+    misma versión ni se pisan los metadatos.
+    """
+
+    def __init__(self, directorio=GALLERY_DIR):
+        self.directorio = directorio
+        self.ruta_metadatos = os.path.join(directorio, ARCHIVO_METADATOS)
+
+    @contextmanager
+    def _bloqueo(self):
+        """Bloqueo exclusivo entre procesos para leer la versión actual y publicar la siguiente"""
+        os.makedirs(self.directorio, exist_ok=True)
+        with open(os.path.join(self.directorio, ARCHIVO_BLOQUEO), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def existe(self):
+        return os.path.exists(self.ruta_metadatos)
+
+    def _leer_metadatos(self):
+        with open(self.ruta_metadatos, encoding="utf-8") as f:
+            return json.load(f)
+
+    def version_actual(self):
+        """
+        Returns:
+            int: Versión publicada en disco (0 si no hay galería)
+        """
+        try:
+            return self._leer_metadatos()["version"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def cargar(self, verificar=True):
+        """
+        Abre la galería publicada sin copiarla a memoria
+
+        Args:
+            verificar (bool): Comprobar el checksum de la matriz
+
+        Returns:
+            dict: 'matriz' (memmap float32 de solo lectura, (N, 128)), 'ids',
+                'names', 'fuentes' (huella de la foto de cada fila o None),
+                'version', 'cambios' ({'base', 'quitadas'} si la versión se
+                derivó de la anterior con actualizar, o None) y 'centroides'
+                (centroides IVF entrenados al publicar, o None)
+
+        Raises:
+            GaleriaCorrupta: Si la matriz no coincide con los metadatos
+        """
+        metadatos = self._leer_metadatos()
+        if metadatos.get("formato") != FORMATO:
+            raise GaleriaCorrupta(f"Formato de galería no soportado: {metadatos.get('formato')}")
+
+        ruta_matriz = os.path.join(self.directorio, metadatos["matriz"])
+        matriz = np.load(ruta_matriz, mmap_mode="r")
+
+        total = metadatos["total"]
+        if matriz.shape != (total, DIMENSION) or matriz.dtype != np.float32:
+            raise GaleriaCorrupta(f"Matriz {matriz.shape} {matriz.dtype}, se esperaba ({total}, {DIMENSION}) float32")
+        fuentes = metadatos.get("fuentes") or [None] * total
+        if len(metadatos["ids"]) != total or len(metadatos["names"]) != total or len(fuentes) != total:
+            raise GaleriaCorrupta("Las tablas de ids/nombres no coinciden con la matriz")
+        if verificar and _checksum(matriz) != metadatos["crc32"]:
+            raise GaleriaCorrupta("Checksum de la matriz inválido")
+
+        centroides = None
+        if metadatos.get("centroides"):
+            centroides = np.load(os.path.join(self.directorio, metadatos["centroides"]))
+            if centroides.ndim != 2 or centroides.shape[1] != DIMENSION:
+                raise GaleriaCorrupta(f"Centroides {centroides.shape}, se esperaba (K, {DIMENSION})")
+
+        return {
+            "matriz": matriz,
+            "ids": metadatos["ids"],
+            "names": metadatos["names"],
+            "fuentes": fuentes,
+            "version": metadatos["version"],
+            "cambios": metadatos.get("cambios"),
+            "centroides": centroides
+        }
+
+    def guardar(self, encodings, ids, names, fuentes=None, centroides=None):
+        """
+        Publica una nueva versión de la galería
+
+        Args:
+            encodings (list | numpy.ndarray): Encodings de 128 dimensiones
+            ids (list): ID de estudiante de cada encoding
+            names (list): Nombre de cada encoding
+            fuentes (list): Huella de la foto de origen de cada encoding
+                ({'ruta', 'mtime', 'tamano', 'sha1'}) para regenerar en forma incremental
+            centroides (numpy.ndarray): Centroides IVF ya entrenados (ver
+                ann_index.entrenar_centroides), para que los workers no repitan k-means
+
+        Returns:
+            int: Versión publicada
+        """
+        matriz = _como_matriz(encodings)
+        with self._bloqueo():
+            return self._publicar(matriz, ids, names, fuentes, centroides=centroides)
+
+    def actualizar(self, agregar=(), quitar_ids=()):
+        """
+        Publica una versión derivada de la actual: quita las filas de algunos
+        estudiantes y agrega filas nuevas al final, sin recalcular el resto
+
+        Los metadatos registran la versión base y las filas quitadas para que
+        quien tenga cargada la base derive la nueva en forma incremental; los
+        centroides IVF de la base se conservan (las filas nuevas se asignan a ellos)
+
+        Args:
+            agregar (list): (encoding, id, nombre, fuente) por cada fila nueva
+            quitar_ids (iterable): Estudiantes cuyas filas se eliminan
+
+        Returns:
+            tuple: (versión publicada, filas quitadas)
+        """
+        # La versión base se lee bajo el mismo bloqueo que la publicación
+        with self._bloqueo():
+            if self.existe():
+                actual = self.cargar(verificar=False)
+            else:
+                actual = {"matriz": _como_matriz([]), "ids": [], "names": [], "fuentes": [], "version": 0,
+                          "centroides": None}
+
+            quitar = {int(i) for i in quitar_ids}
+            conservadas = [i for i, id_est in enumerate(actual["ids"]) if id_est not in quitar]
+            quitadas = [i for i, id_est in enumerate(actual["ids"]) if id_est in quitar]
+
+            matriz = np.concatenate((
+                actual["matriz"][conservadas],
+                _como_matriz([fila[0] for fila in agregar])
+            ))
+            ids = [actual["ids"][i] for i in conservadas] + [fila[1] for fila in agregar]
+            names = [actual["names"][i] for i in conservadas] + [fila[2] for fila in agregar]
+            fuentes = [actual["fuentes"][i] for i in conservadas] + [fila[3] for fila in agregar]
+
+            version = self._publicar(matriz, ids, names, fuentes,
+                                     cambios={"base": actual["version"], "quitadas": quitadas},
+                                     centroides=actual["centroides"])
+            return version, len(quitadas)
+
+    def _publicar(self, matriz, ids, names, fuentes=None, cambios=None, centroides=None):
+        """
+        Escribe la matriz (y los centroides) y publica los metadatos (punto de commit)
+
+        Se llama con _bloqueo tomado
+        """
+
+        version = self.version_actual() + 1
+        nombre_matriz = f"encodings-v{version}.npy"
+        self._escribir_npy(nombre_matriz, matriz)
+
+        nombre_centroides = None
+        if centroides is not None:
+            nombre_centroides = f"centroides-v{version}.npy"
+            self._escribir_npy(nombre_centroides, np.ascontiguousarray(centroides, dtype=np.float32))
+
+        metadatos = {
+            "formato": FORMATO,
+            "version": version,
+            "matriz": nombre_matriz,
+            "total": len(matriz),
+            "dimension": DIMENSION,
+            "crc32": _checksum(matriz),
+            "ids": [int(i) for i in ids],
+            "names": list(names),
+            "fuentes": list(fuentes) if fuentes is not None else [None] * len(matriz),
+            "cambios": cambios,
+            "centroides": nombre_centroides
+        }
+
+        with open(self.ruta_metadatos + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(metadatos, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.ruta_metadatos + ".tmp", self.ruta_metadatos)
+
+        self._limpiar((nombre_matriz, nombre_centroides))
+        return version
+
+    def _escribir_npy(self, nombre, matriz):
+        ruta = os.path.join(self.directorio, nombre)
+        with open(ruta + ".tmp", "wb") as f:
+            np.save(f, matriz)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta + ".tmp", ruta)
+
+    def _limpiar(self, vigentes):
+        """Borra las matrices y centroides de versiones anteriores"""
+        for archivo in os.listdir(self.directorio):
+            if archivo.startswith(("encodings-v", "centroides-v")) and archivo not in vigentes:
+                try:
+                    os.remove(os.path.join(self.directorio, archivo))
+                except OSError as e:
+                    logger.warning(f"No se pudo borrar {archivo}: {e}")
+
+
+# Instancia global
+encodings_store = EncodingsStore()
@@ -4,198 +4,848 @@ Carga encodings y compara rostros
 """
 
 import face_recognition
+import face_recognition.api as fr_api
+import dlib
 import numpy as np
+import hashlib
 import pickle
 import os
 from PIL import Image
 import io
 import logging
-from config import FOTOS_DIR, ENCODINGS_FILE, FACE_TOLERANCE, FACE_DETECTION_MODEL
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from config import (
+    FOTOS_DIR, ENCODINGS_FILE, FACE_TOLERANCE, FACE_DETECTION_MODEL,
+    FRAME_RESIZE_WIDTH, TRACKING_ENABLED, ENCODING_WORKERS, SCHEDULE_MAX_SUBGALLERIES
+)
+from encodings_store import encodings_store
+from matcher import GalleryMatcher
+from ann_index import entrenar_centroides
+from face_tracker import FaceTracker
 
 logger = logging.getLogger(__name__)
 
+EXTENSIONES_FOTO = ('.jpg', '.jpeg', '.png')
+
+
+def _sha1_archivo(ruta):
+    """SHA-1 del contenido de un archivo"""
+    sha1 = hashlib.sha1()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(bloque)
+    return sha1.hexdigest()
+
+
+def _fotos_referencia(ruta):
+    """
+    Fotos de referencia de un estudiante
+    
+    La de path_foto_referencia más las de la carpeta con su mismo nombre
+    (sin extensión), p. ej. juan.jpg y juan/*.jpg; si path_foto_referencia
+    es una carpeta, todas las fotos que contiene
+    
+    Returns:
+        list: Rutas existentes, la principal primero
+    """
+    carpeta = ruta if os.path.isdir(ruta) else os.path.splitext(ruta)[0]
+    fotos = [ruta] if os.path.isfile(ruta) else []
+    
+    if os.path.isdir(carpeta):
+        fotos += sorted(
+            os.path.join(carpeta, archivo) for archivo in os.listdir(carpeta)
+            if archivo.lower().endswith(EXTENSIONES_FOTO)
+        )
+    return fotos
+
+
+def _codificar_foto(ruta):
+    """
+    Encoding del primer rostro de una foto de referencia (corre en un proceso del pool)
+    
+    Returns:
+        tuple: (encoding o None si no hay rostro, mensaje de error o None)
+    """
+    try:
+        image = face_recognition.load_image_file(ruta)
+        face_encodings = face_recognition.face_encodings(image)
+        return (face_encodings[0] if face_encodings else None), None
+    except Exception as e:
+        return None, str(e)
+
+
+class Galeria:
+    """
+    Instantánea inmutable de una versión de la galería
+    
+    Matriz, tablas e índice se construyen juntos y se publican con una sola
+    asignación, así un frame nunca ve ids de una versión y encodings de otra
+    """
+    
+    def __init__(self, matriz, ids, names, fuentes, version, anterior=None, conservadas=None,
+                 centroides=None):
+        """
+        Args:
+            anterior (Galeria): Versión de la que deriva esta (ver EncodingsStore.actualizar);
+                su índice se actualiza en lugar de reconstruirse
+            conservadas (numpy.ndarray): Filas de `anterior` que siguen, en orden
+            centroides (numpy.ndarray): Centroides IVF publicados con esta versión
+        """
+        self.matriz = matriz
+        self.ids = tuple(ids)
+        self.names = tuple(names)
+        self.fuentes = tuple(fuentes)
+        self.version = version
+        self.matcher = GalleryMatcher(
+            matriz, ids, names,
+            anterior=anterior.matcher if anterior else None,
+            conservadas=conservadas,
+            centroides=centroides
+        )
+        
+        # Subgalerías por grupo de candidatos (derivadas, se arman al usarlas)
+        self._filas_por_id = None
+        self._subgalerias = OrderedDict()
+        self._lock_subgalerias = threading.Lock()
+    
+    def buscar(self, face_encodings, candidatos=None, tolerance=FACE_TOLERANCE):
+        """
+        Busca la mejor coincidencia de cada rostro, primero entre sus candidatos
+        
+        Los rostros con candidatos (p. ej. los inscritos del curso con clase
+        en la sala) se comparan con esa subgalería; solo los que no coinciden
+        ahí, y los que no tienen candidatos, se buscan en toda la galería
+        
+        Args:
+            face_encodings (list): Encodings de los rostros
+            candidatos (list): Por rostro, tupla de IDs de estudiante o None
+            tolerance (float): Distancia máxima para aceptar una coincidencia
+            
+        Returns:
+            list: Como GalleryMatcher.buscar
+        """
+        if not candidatos or not any(candidatos):
+            return self.matcher.buscar(face_encodings, tolerance=tolerance)
+        
+        resultados = [None] * len(face_encodings)
+        globales = []
+        grupos = {}
+        for k, grupo in enumerate(candidatos):
+            if grupo:
+                grupos.setdefault(grupo, []).append(k)
+            else:
+                globales.append(k)
+        
+        for grupo, indices in grupos.items():
+            encontrados = self._subgaleria(grupo).buscar([face_encodings[k] for k in indices], tolerance=tolerance)
+            for k, coincidencia in zip(indices, encontrados):
+                if coincidencia is None:
+                    globales.append(k)
+                else:
+                    resultados[k] = coincidencia
+        
+        if globales:
+            encontrados = self.matcher.buscar([face_encodings[k] for k in globales], tolerance=tolerance)
+            for k, coincidencia in zip(globales, encontrados):
+                resultados[k] = coincidencia
+        
+        return resultados
+    
+    def _subgaleria(self, grupo):
+        """Matcher con solo las filas de los estudiantes del grupo (cacheado por grupo)"""
+        with self._lock_subgalerias:
+            matcher = self._subgalerias.get(grupo)
+        if matcher is not None:
+            return matcher
+        
+        if self._filas_por_id is None:
+            filas_por_id = {}
+            for fila, id_estudiante in enumerate(self.ids):
+                filas_por_id.setdefault(id_estudiante, []).append(fila)
+            self._filas_por_id = filas_por_id
+        
+        filas = [fila for id_estudiante in grupo for fila in self._filas_por_id.get(id_estudiante, ())]
+        matcher = GalleryMatcher(
+            self.matriz[filas] if filas else np.empty((0, self.matriz.shape[1]), dtype=self.matriz.dtype),
+            [self.ids[f] for f in filas],
+            [self.names[f] for f in filas]
+        )
+        
+        # Con RECOGNITION_EXECUTOR="thread" varios hilos pueden agregar a la vez
+        with self._lock_subgalerias:
+            while len(self._subgalerias) >= SCHEDULE_MAX_SUBGALLERIES:
+                self._subgalerias.popitem(last=False)
+            self._subgalerias[grupo] = matcher
+        return matcher
+    
+    @classmethod
+    def vacia(cls):
+        return cls(np.empty((0, 128), dtype=np.float32), [], [], [], 0)
+    
+    @property
+    def cargada(self):
+        return self.version > 0
+
 
 class FaceProcessor:
     """Clase para procesar reconocimiento facial"""
     
     def __init__(self):
-        self.known_encodings = []
-        self.known_ids = []
-        self.known_names = []
-        self.encodings_loaded = False
+        # Galería publicada: se reemplaza entera, nunca se modifica
+        self.galeria = Galeria.vacia()
+        self.tracker = FaceTracker() if TRACKING_ENABLED else None
+        self._recargando = threading.Lock()
+        self._publicando = threading.Lock()  # Una sola escritura de la galería a la vez
+        
+        # Cargar la galería (migrando el pickle anterior si es lo único que hay)
+        if not encodings_store.existe() and os.path.exists(ENCODINGS_FILE):
+            self.migrar_pickle()
         
-        # Cargar encodings si existe el archivo
-        if os.path.exists(ENCODINGS_FILE):
+        if encodings_store.existe():
             self.cargar_encodings()
         else:
-            logger.warning(f"Archivo de encodings no encontrado: {ENCODINGS_FILE}")
+            logger.warning(f"Galería de encodings no encontrada: {encodings_store.directorio}")
+    
+    @property
+    def encodings_loaded(self):
+        return self.galeria.cargada
+    
+    @property
+    def known_encodings(self):
+        return self.galeria.matriz
+    
+    @property
+    def known_ids(self):
+        return self.galeria.ids
+    
+    @property
+    def known_names(self):
+        return self.galeria.names
+    
+    @property
+    def version(self):
+        return self.galeria.version
     
     def cargar_encodings(self):
         """
-        Carga los encodings pre-calculados desde archivo pickle
+        Abre la galería publicada con memmap (sin copiar la matriz a memoria)
+        
+        La nueva instantánea (incluido el índice) se arma aparte y reemplaza
+        a la anterior recién al final; si falla se conserva la anterior. Si
+        la versión publicada deriva de la cargada, el índice se actualiza
+        en lugar de reconstruirse; si no, el IVF usa los centroides
+        publicados con la galería (k-means se entrena una vez, al publicar)
         """
         try:
-            with open(ENCODINGS_FILE, 'rb') as f:
-                data = pickle.load(f)
+            datos = encodings_store.cargar()
+            
+            anterior = self.galeria
+            cambios = datos['cambios']
+            if cambios and anterior.cargada and cambios['base'] == anterior.version:
+                conservadas = np.setdiff1d(np.arange(len(anterior.ids)), cambios['quitadas'])
+            else:
+                anterior = conservadas = None
+            
+            galeria = Galeria(datos['matriz'], datos['ids'], datos['names'],
+                              datos['fuentes'], datos['version'],
+                              anterior=anterior, conservadas=conservadas,
+                              centroides=datos['centroides'])
             
-            self.known_encodings = data['encodings']
-            self.known_ids = data['ids']
-            self.known_names = data['names']
-            self.encodings_loaded = True
+            self.galeria = galeria
             
-            logger.info(f"✅ Encodings cargados: {len(self.known_encodings)} rostros")
+            logger.info(f"✅ Encodings cargados: {len(galeria.matriz)} rostros (v{galeria.version})")
             
         except Exception as e:
             logger.error(f"Error al cargar encodings: {e}")
-            self.encodings_loaded = False
     
-    def generar_encodings_desde_fotos(self, estudiantes_db):
+    def sincronizar(self, version):
+        """
+        Carga en segundo plano la versión publicada si difiere de la actual
+        
+        Lo llaman los workers antes de cada lote; los frames siguen usando
+        la galería anterior hasta que la nueva está lista
+        
+        Args:
+            version (int): Versión publicada (0 = sin información)
+        """
+        if not version or version == self.galeria.version:
+            return
+        
+        if not self._recargando.acquire(blocking=False):
+            return
+        
+        def recargar():
+            try:
+                self.cargar_encodings()
+            finally:
+                self._recargando.release()
+        
+        threading.Thread(target=recargar, name="carga-galeria", daemon=True).start()
+    
+    def migrar_pickle(self):
+        """
+        Convierte el encodings.pkl del formato anterior a la galería versionada
+        
+        El pickle solo se lee esta vez (es un archivo local generado por
+        versiones anteriores de este mismo servidor)
+        """
+        try:
+            with open(ENCODINGS_FILE, 'rb') as f:
+                data = pickle.load(f)
+            
+            version = encodings_store.guardar(
+                data['encodings'], data['ids'], data['names'],
+                centroides=entrenar_centroides(data['encodings'], ids=data['ids'])
+            )
+            logger.info(f"📦 {ENCODINGS_FILE} migrado a {encodings_store.directorio} (v{version})")
+            
+        except Exception as e:
+            logger.error(f"Error al migrar {ENCODINGS_FILE}: {e}")
+    
+    def generar_encodings_desde_fotos(self, estudiantes_db, progreso=None):
         """
         Genera encodings desde las fotos en la carpeta y los guarda
         
+        Cada estudiante puede tener varias fotos (ver _fotos_referencia);
+        todas sus filas quedan juntas en la galería.
+        
+        Es incremental: cada foto se identifica por ruta + mtime + tamaño y,
+        si cambiaron, por su SHA-1; las fotos sin cambios reutilizan el
+        encoding de la galería actual y solo las nuevas o modificadas se
+        codifican, repartidas en ENCODING_WORKERS procesos.
+        
         Args:
             estudiantes_db (list): Lista de estudiantes desde la BD
+            progreso (callable): progreso(codificadas, total) tras cada foto codificada
+            
+        Returns:
+            dict: Totales de la generación (reutilizados, codificados, fallidos)
         """
+        with self._publicando:
+            return self._generar_encodings(estudiantes_db, progreso)
+    
+    def _generar_encodings(self, estudiantes_db, progreso=None):
+        """Cuerpo de generar_encodings_desde_fotos (con el lock de publicación tomado)"""
         logger.info("🔄 Generando encodings desde fotos...")
         
-        encodings = []
-        ids = []
-        names = []
+        # Encodings actuales indexados por la foto de la que salieron
+        galeria = self.galeria
+        anteriores = {}
+        for encoding, fuente in zip(galeria.matriz, galeria.fuentes):
+            if fuente:
+                anteriores[fuente['ruta']] = (fuente, encoding)
+        
+        resultados = {}
+        pendientes = []
         
-        for estudiante in estudiantes_db:
-            id_estudiante = estudiante['id_estudiante']
-            nombre = estudiante['nombre_completo']
+        for i, estudiante in enumerate(estudiantes_db):
             path_foto = estudiante['path_foto_referencia']
             
             # Construir ruta completa
             full_path = os.path.join(FOTOS_DIR, path_foto)
             
-            if not os.path.exists(full_path):
+            fotos = _fotos_referencia(full_path)
+            if not fotos:
                 logger.warning(f"⚠️  Foto no encontrada: {full_path}")
                 continue
             
-            try:
-                # Cargar imagen
-                image = face_recognition.load_image_file(full_path)
+            for j, ruta in enumerate(fotos):
+                estado = os.stat(ruta)
+                fuente = {'ruta': ruta, 'mtime': estado.st_mtime, 'tamano': estado.st_size}
+                previo = anteriores.get(ruta)
                 
-                # Generar encoding
-                face_encodings = face_recognition.face_encodings(image)
+                if previo and previo[0]['mtime'] == fuente['mtime'] and previo[0]['tamano'] == fuente['tamano']:
+                    resultados[i, j] = (previo[1], previo[0])
+                    continue
                 
-                if len(face_encodings) > 0:
-                    encodings.append(face_encodings[0])
-                    ids.append(id_estudiante)
-                    names.append(nombre)
-                    logger.info(f"✅ Encoding generado: {nombre}")
-                else:
-                    logger.warning(f"⚠️  No se detectó rostro en: {path_foto}")
-                    
-            except Exception as e:
-                logger.error(f"❌ Error procesando {path_foto}: {e}")
+                fuente['sha1'] = _sha1_archivo(ruta)
+                if previo and previo[0].get('sha1') == fuente['sha1']:
+                    # Misma foto con otra fecha de modificación
+                    resultados[i, j] = (previo[1], fuente)
+                    continue
+                
+                pendientes.append(((i, j), fuente))
+        
+        reutilizados = len(resultados)
+        fallidos = 0
+        
+        for (clave, fuente), (encoding, error) in zip(pendientes, self._codificar_fotos([f['ruta'] for _, f in pendientes], progreso)):
+            path_foto = os.path.relpath(fuente['ruta'], FOTOS_DIR)
+            if error:
+                fallidos += 1
+                logger.error(f"❌ Error procesando {path_foto}: {error}")
+            elif encoding is None:
+                fallidos += 1
+                logger.warning(f"⚠️  No se detectó rostro en: {path_foto}")
+            else:
+                resultados[clave] = (encoding, fuente)
+                logger.info(f"✅ Encoding generado: {estudiantes_db[clave[0]]['nombre_completo']} ({path_foto})")
+        
+        encodings = []
+        ids = []
+        names = []
+        fuentes = []
         
-        # Guardar encodings
+        # Las filas de cada estudiante quedan contiguas (un bloque por estudiante)
+        for i, j in sorted(resultados):
+            encoding, fuente = resultados[i, j]
+            encodings.append(encoding)
+            ids.append(estudiantes_db[i]['id_estudiante'])
+            names.append(estudiantes_db[i]['nombre_completo'])
+            fuentes.append(fuente)
+        
+        resumen = {
+            'total': len(encodings),
+            'estudiantes': len(set(ids)),
+            'reutilizados': reutilizados,
+            'codificados': len(pendientes) - fallidos,
+            'fallidos': fallidos
+        }
+        
+        # Guardar encodings y abrir la versión publicada
         if len(encodings) > 0:
-            data = {
-                'encodings': encodings,
-                'ids': ids,
-                'names': names
+            # k-means se entrena una sola vez aquí y no en cada worker al recargar
+            version = encodings_store.guardar(encodings, ids, names, fuentes,
+                                              centroides=entrenar_centroides(encodings, ids=ids))
+            self.cargar_encodings()
+            
+            logger.info(f"💾 Encodings guardados: {len(encodings)} rostros de {resumen['estudiantes']} estudiantes (v{version}, "
+                        f"♻️  {reutilizados} reutilizados, 🆕 {resumen['codificados']} nuevos)")
+        else:
+            logger.error("❌ No se generó ningún encoding")
+        
+        return resumen
+    
+    def _codificar_fotos(self, rutas, progreso=None):
+        """
+        Codifica fotos de referencia en paralelo
+        
+        Returns:
+            list: (encoding o None, error o None) por ruta, en el mismo orden
+        """
+        resultados = []
+        
+        def registrar(resultado):
+            resultados.append(resultado)
+            if progreso:
+                progreso(len(resultados), len(rutas))
+        
+        if len(rutas) <= 1:
+            for ruta in rutas:
+                registrar(_codificar_foto(ruta))
+            return resultados
+        
+        workers = min(ENCODING_WORKERS or os.cpu_count() or 1, len(rutas))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for resultado in executor.map(_codificar_foto, rutas, chunksize=max(1, len(rutas) // (workers * 4))):
+                registrar(resultado)
+        return resultados
+    
+    def enrolar(self, estudiante, img_data, adicional=False):
+        """
+        Enrola (o vuelve a enrolar) a un estudiante con una foto, sin regenerar la galería
+        
+        La foto se guarda en su path_foto_referencia (o, si es adicional, en
+        la carpeta de fotos del estudiante) con su huella, así una recarga
+        completa posterior la reutiliza sin volver a codificarla. Las demás
+        fotos del estudiante se conservan y su bloque se reescribe completo;
+        al reemplazar la principal se descartan sus filas migradas del pickle
+        
+        Args:
+            estudiante (dict): Estudiante desde la BD
+            img_data (bytes): Foto JPEG/PNG con un solo rostro
+            adicional (bool): Agregar una foto más en lugar de reemplazar la principal
+            
+        Returns:
+            int: Versión de galería publicada
+            
+        Raises:
+            ValueError: Si la foto no se puede leer o no tiene exactamente un rostro
+        """
+        image = self.decode_image_from_bytes(img_data)
+        if image is None:
+            raise ValueError("Imagen inválida")
+        
+        face_locations = self._detectar(image)
+        if len(face_locations) != 1:
+            raise ValueError(f"La foto debe tener un solo rostro ({len(face_locations)} detectados)")
+        
+        encoding = face_recognition.face_encodings(image, face_locations)[0]
+        id_estudiante = estudiante['id_estudiante']
+        nombre = estudiante['nombre_completo']
+        
+        sha1 = hashlib.sha1(img_data).hexdigest()
+        
+        with self._publicando:
+            ruta = os.path.join(FOTOS_DIR, estudiante['path_foto_referencia'])
+            if adicional or os.path.isdir(ruta):
+                carpeta = ruta if os.path.isdir(ruta) else os.path.splitext(ruta)[0]
+                ruta = os.path.join(carpeta, sha1[:12] + (os.path.splitext(ruta)[1] or '.jpg'))
+            
+            os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+            with open(ruta + '.tmp', 'wb') as f:
+                f.write(img_data)
+            os.replace(ruta + '.tmp', ruta)
+            
+            estado = os.stat(ruta)
+            fuente = {
+                'ruta': ruta,
+                'mtime': estado.st_mtime,
+                'tamano': estado.st_size,
+                'sha1': sha1
             }
             
-            with open(ENCODINGS_FILE, 'wb') as f:
-                pickle.dump(data, f)
+            # Resto de las fotos del estudiante, para que su bloque siga contiguo.
+            # Las filas migradas del pickle no tienen fuente: son la foto principal,
+            # así que solo se conservan al agregar una foto adicional
+            galeria = self.galeria
+            filas = [
+                (galeria.matriz[k], id_estudiante, nombre, galeria.fuentes[k])
+                for k, id_fila in enumerate(galeria.ids)
+                if id_fila == id_estudiante and (
+                    adicional if galeria.fuentes[k] is None else galeria.fuentes[k]['ruta'] != ruta
+                )
+            ]
             
-            self.known_encodings = encodings
-            self.known_ids = ids
-            self.known_names = names
-            self.encodings_loaded = True
+            version, _quitadas = encodings_store.actualizar(
+                agregar=filas + [(encoding, id_estudiante, nombre, fuente)],
+                quitar_ids=[id_estudiante]
+            )
+            self.cargar_encodings()
+        
+        logger.info(f"🧑‍🎓 Estudiante enrolado: {nombre}, {len(filas) + 1} fotos (v{version})")
+        return version
+    
+    def desenrolar(self, id_estudiante):
+        """
+        Quita de la galería los encodings de un estudiante
+        
+        Args:
+            id_estudiante (int): ID del estudiante
             
-            logger.info(f"💾 Encodings guardados: {len(encodings)} rostros")
-        else:
-            logger.error("❌ No se generó ningún encoding")
+        Returns:
+            int: Versión de galería publicada, o None si no estaba enrolado
+        """
+        with self._publicando:
+            if id_estudiante not in self.galeria.ids:
+                return None
+            
+            version, quitadas = encodings_store.actualizar(quitar_ids=[id_estudiante])
+            self.cargar_encodings()
+        
+        logger.info(f"🗑️  Estudiante {id_estudiante} quitado de la galería: {quitadas} encodings (v{version})")
+        return version
     
-    def procesar_frame(self, image_array):
+    def procesar_imagen(self, img_data, device_id=None, candidatos=None, origen=None):
         """
-        Procesa un frame y busca rostros conocidos
+        Procesa un frame comprimido detectando rostros a resolución reducida
+        
+        1. Decodifica directo a ~FRAME_RESIZE_WIDTH (modo draft de JPEG)
+        2. Detecta rostros sobre la imagen reducida (HOG escala con los píxeles)
+        3. Solo si hay rostros decodifica a resolución completa y genera los
+           encodings con las ubicaciones reescaladas
         
         Args:
-            image_array (numpy.ndarray): Frame en formato numpy array (RGB)
+            img_data (bytes): Imagen JPEG/PNG
+            device_id (str): Dispositivo de origen (habilita el seguimiento entre frames)
+            candidatos (tuple): IDs a probar antes que toda la galería (horario de la sala)
+            origen (tuple): (top, left, escala) si la imagen es una región del frame
+                del dispositivo (el seguimiento usa coordenadas del frame)
             
         Returns:
             dict: Resultado del procesamiento {
                 'faces_found': int,
-                'matches': [{'id': int, 'name': str, 'location': tuple}]
-            }
+                'faces_encoded': int,
+                'matches': [{'id': int, 'name': str, 'location': tuple, 'confidence': float}]
+            } (ubicaciones en resolución completa), o None si la imagen no se pudo decodificar
         """
-        if not self.encodings_loaded:
-            return {
-                'faces_found': 0,
-                'matches': [],
-                'error': 'Encodings no cargados'
-            }
+        return self.procesar_lote([
+            {'image': img_data, 'device_id': device_id, 'candidatos': candidatos, 'origen': origen}
+        ])[0]
+    
+    def procesar_recortes(self, recortes, device_id=None, candidatos=None):
+        """
+        Procesa recortes de rostros ya detectados por el cliente
+        
+        No se ejecuta detección: cada recorte trae la caja del rostro dentro
+        del recorte y su caja en el frame original, así que solo se calculan
+        los encodings sobre imágenes pequeñas.
+        
+        Args:
+            recortes (list): dicts con 'image' (bytes JPEG), 'location'
+                (top, right, bottom, left) dentro del recorte o None para usar
+                el recorte completo, y 'bbox' (top, right, bottom, left) en el frame
+            device_id (str): Dispositivo de origen (habilita el seguimiento entre frames)
+            candidatos (tuple): IDs a probar antes que toda la galería (horario de la sala)
+            
+        Returns:
+            dict: Igual que procesar_imagen (ubicaciones en coordenadas del frame),
+                o None si algún recorte no se pudo decodificar
+        """
+        return self.procesar_lote([{'rostros': recortes, 'device_id': device_id, 'candidatos': candidatos}])[0]
+    
+    def procesar_lote(self, solicitudes):
+        """
+        Procesa varias solicitudes (de uno o más dispositivos) con un solo
+        paso de encodings en dlib y una sola búsqueda en la galería
+        
+        Args:
+            solicitudes (list): dicts con 'device_id' y 'image' (bytes del
+                frame) o 'rostros' (recortes, como en procesar_recortes), y
+                opcionalmente 'candidatos' (IDs a probar antes que toda la galería)
+                y 'origen' (como en procesar_imagen)
+            
+        Returns:
+            list: Un resultado por solicitud, igual que procesar_imagen /
+                procesar_recortes (None si no se pudo decodificar)
+        """
+        # Toda la solicitud usa la misma versión aunque se publique otra en el medio
+        galeria = self.galeria
+        
+        if not galeria.cargada:
+            return [
+                {'faces_found': 0, 'matches': [], 'error': 'Encodings no cargados'}
+                for _ in solicitudes
+            ]
+        
+        resultados = [None] * len(solicitudes)
+        planes = []
+        candidatos = []
+        
+        for i, solicitud in enumerate(solicitudes):
+            try:
+                if 'rostros' in solicitud:
+                    localizado = self._localizar_recortes(solicitud['rostros'])
+                else:
+                    localizado = self._localizar_imagen(solicitud['image'])
+                
+                if localizado is None:
+                    continue
+                
+                face_locations, trabajos_para = localizado
+                if len(face_locations) == 0:
+                    resultados[i] = {
+                        'faces_found': 0,
+                        'matches': []
+                    }
+                    continue
+                
+                tracks, pendientes = self._planificar(
+                    face_locations, solicitud.get('device_id'), solicitud.get('origen')
+                )
+                planes.append((i, face_locations, tracks, pendientes, trabajos_para(pendientes)))
+                
+                grupo = solicitud.get('candidatos')
+                candidatos.extend([tuple(grupo) if grupo else None] * len(pendientes))
+                
+            except Exception as e:
+                logger.error(f"Error al procesar frame: {e}")
+                resultados[i] = {
+                    'faces_found': 0,
+                    'matches': [],
+                    'error': str(e)
+                }
+        
+        if not planes:
+            return resultados
         
         try:
-            # Detectar ubicaciones de rostros
-            face_locations = face_recognition.face_locations(
-                image_array, 
-                model=FACE_DETECTION_MODEL
-            )
+            # Encodings de todas las solicitudes juntas y una sola búsqueda por grupo de candidatos
+            face_encodings = self._codificar_lote([t for plan in planes for t in plan[4]])
+            coincidencias = galeria.buscar(face_encodings, candidatos, tolerance=FACE_TOLERANCE) if face_encodings else []
             
-            if len(face_locations) == 0:
-                return {
+        except Exception as e:
+            logger.error(f"Error al procesar lote: {e}")
+            for plan in planes:
+                resultados[plan[0]] = {
                     'faces_found': 0,
-                    'matches': []
+                    'matches': [],
+                    'error': str(e)
                 }
+            return resultados
+        
+        inicio = 0
+        for i, face_locations, tracks, pendientes, _trabajos in planes:
+            nuevas = coincidencias[inicio:inicio + len(pendientes)]
+            inicio += len(pendientes)
+            resultados[i] = self._componer(face_locations, tracks, pendientes, nuevas)
+        
+        return resultados
+    
+    def _localizar_imagen(self, img_data):
+        """
+        Decodifica y detecta rostros a resolución reducida (ver procesar_imagen)
+        
+        Returns:
+            tuple: (ubicaciones en resolución completa, trabajos_para) donde
+                trabajos_para(indices) arma los trabajos de _codificar_lote,
+                o None si la imagen no se pudo decodificar
+        """
+        reducida, escala = self.decode_image_reduced(img_data)
+        if reducida is None:
+            return None
+        
+        ubicaciones = self._detectar(reducida)
+        
+        if len(ubicaciones) == 0 or escala == 1.0:
+            completa, face_locations = reducida, ubicaciones
+        else:
+            # Los encodings se calculan en resolución completa para no perder precisión
+            completa = self.decode_image_from_bytes(img_data)
+            if completa is None:
+                return None
             
-            # Generar encodings para los rostros detectados
-            face_encodings = face_recognition.face_encodings(
-                image_array, 
-                face_locations
-            )
+            alto, ancho = completa.shape[:2]
+            face_locations = [
+                (
+                    max(0, int(round(top * escala))),
+                    min(ancho, int(round(right * escala))),
+                    min(alto, int(round(bottom * escala))),
+                    max(0, int(round(left * escala)))
+                )
+                for top, right, bottom, left in ubicaciones
+            ]
+        
+        def trabajos_para(indices):
+            if not indices:
+                return []
+            return [(completa, [face_locations[i] for i in indices])]
+        
+        return face_locations, trabajos_para
+    
+    def _localizar_recortes(self, recortes):
+        """
+        Decodifica recortes con ubicación conocida (ver procesar_recortes)
+        
+        Returns:
+            tuple: (cajas en el frame, trabajos_para), o None si algún
+                recorte no se pudo decodificar
+        """
+        imagenes = []
+        ubicaciones = []
+        for recorte in recortes:
+            imagen = self.decode_image_from_bytes(recorte['image'])
+            if imagen is None:
+                return None
             
-            matches_result = []
+            alto, ancho = imagen.shape[:2]
+            location = recorte.get('location')
+            if location:
+                top, right, bottom, left = location
+                location = (max(0, top), min(ancho, right), min(alto, bottom), max(0, left))
+            else:
+                location = (0, ancho, alto, 0)
             
-            # Comparar cada rostro detectado con los conocidos
-            for face_encoding, face_location in zip(face_encodings, face_locations):
-                # Comparar con todos los rostros conocidos
-                matches = face_recognition.compare_faces(
-                    self.known_encodings,
-                    face_encoding,
-                    tolerance=FACE_TOLERANCE
-                )
-                
-                # Calcular distancias para encontrar la mejor coincidencia
-                face_distances = face_recognition.face_distance(
-                    self.known_encodings,
-                    face_encoding
-                )
-                
-                if True in matches:
-                    # Encontrar la mejor coincidencia (menor distancia)
-                    best_match_index = np.argmin(face_distances)
-                    
-                    if matches[best_match_index]:
-                        id_estudiante = self.known_ids[best_match_index]
-                        nombre = self.known_names[best_match_index]
-                        confidence = 1 - face_distances[best_match_index]
-                        
-                        matches_result.append({
-                            'id': id_estudiante,
-                            'name': nombre,
-                            'location': face_location,
-                            'confidence': float(confidence)
-                        })
-            
-            return {
-                'faces_found': len(face_locations),
-                'matches': matches_result
-            }
+            imagenes.append(imagen)
+            ubicaciones.append(location)
+        
+        def trabajos_para(indices):
+            # Un encoding por recorte, con la ubicación conocida (sin detección)
+            return [(imagenes[i], [ubicaciones[i]]) for i in indices]
+        
+        return [tuple(recorte['bbox']) for recorte in recortes], trabajos_para
+    
+    def _detectar(self, image_array):
+        """Detecta ubicaciones de rostros (top, right, bottom, left)"""
+        return face_recognition.face_locations(
+            image_array, 
+            model=FACE_DETECTION_MODEL
+        )
+    
+    def _codificar_lote(self, trabajos):
+        """
+        Genera encodings de varias imágenes en una sola llamada a dlib
+        
+        Args:
+            trabajos (list): (imagen numpy.ndarray, [ubicaciones]) por imagen
             
-        except Exception as e:
-            logger.error(f"Error al procesar frame: {e}")
-            return {
-                'faces_found': 0,
-                'matches': [],
-                'error': str(e)
-            }
+        Returns:
+            list: Encodings en el orden de las ubicaciones de cada trabajo
+        """
+        if len(trabajos) <= 1:
+            return [
+                encoding
+                for imagen, ubicaciones in trabajos
+                for encoding in face_recognition.face_encodings(imagen, ubicaciones)
+            ]
+        
+        # Mismos modelos que face_recognition.face_encodings (landmarks de 5 puntos)
+        imagenes = []
+        landmarks = []
+        for imagen, ubicaciones in trabajos:
+            formas = dlib.full_object_detections()
+            for top, right, bottom, left in ubicaciones:
+                formas.append(fr_api.pose_predictor_5_point(imagen, dlib.rectangle(left, top, right, bottom)))
+            imagenes.append(imagen)
+            landmarks.append(formas)
+        
+        descriptores = fr_api.face_encoder.compute_face_descriptor(imagenes, landmarks, 1)
+        return [np.array(d) for por_imagen in descriptores for d in por_imagen]
+    
+    def _planificar(self, face_locations, device_id=None, origen=None):
+        """
+        Decide qué rostros necesitan encoding
+        
+        Con device_id, los rostros asociados a un track confirmado reutilizan
+        su identidad y solo se calculan encodings para el resto. Si la imagen
+        es una región (origen), las cajas se llevan a coordenadas del frame
+        para que sean comparables entre frames
+        
+        Returns:
+            tuple: (tracks o None, índices de face_locations a codificar)
+        """
+        if self.tracker and device_id:
+            if origen:
+                top0, left0, escala = origen
+                face_locations = [
+                    tuple(int(round(v / escala)) + desplazamiento
+                          for v, desplazamiento in zip(caja, (top0, left0, top0, left0)))
+                    for caja in face_locations
+                ]
+            tracks = self.tracker.asociar(device_id, face_locations)
+            pendientes = [i for i, t in enumerate(tracks) if self.tracker.requiere_encoding(t)]
+        else:
+            tracks = None
+            pendientes = list(range(len(face_locations)))
+        
+        return tracks, pendientes
+    
+    def _componer(self, face_locations, tracks, pendientes, nuevas):
+        """
+        Arma el resultado combinando las coincidencias nuevas (de los
+        rostros pendientes) con las identidades reutilizadas de los tracks
+        """
+        coincidencias = [None] * len(face_locations)
+        
+        for i, coincidencia in zip(pendientes, nuevas):
+            coincidencias[i] = coincidencia
+            if tracks:
+                tracks[i].registrar_encoding(coincidencia)
+        
+        if tracks:
+            pendientes_set = set(pendientes)
+            for i, track in enumerate(tracks):
+                if i not in pendientes_set:
+                    coincidencias[i] = track.identidad
+        
+        matches_result = []
+        
+        for coincidencia, face_location in zip(coincidencias, face_locations):
+            if coincidencia is not None:
+                matches_result.append({
+                    'id': coincidencia['id'],
+                    'name': coincidencia['name'],
+                    'location': face_location,
+                    'confidence': coincidencia['confidence']
+                })
+        
+        return {
+            'faces_found': len(face_locations),
+            'faces_encoded': len(pendientes),
+            'matches': matches_result
+        }
     
     def decode_image_from_base64(self, base64_string):
         """
@@ -213,6 +863,23 @@ class FaceProcessor:
             # Decodificar base64
             img_data = base64.b64decode(base64_string)
             
+        except Exception as e:
+            logger.error(f"Error al decodificar imagen: {e}")
+            return None
+        
+        return self.decode_image_from_bytes(img_data)
+    
+    def decode_image_from_bytes(self, img_data):
+        """
+        Decodifica una imagen JPEG/PNG binaria a numpy array
+        
+        Args:
+            img_data (bytes): Imagen comprimida (BytesIO comparte el buffer, sin copia)
+            
+        Returns:
+            numpy.ndarray: Imagen en formato RGB
+        """
+        try:
             # Convertir a PIL Image
             img = Image.open(io.BytesIO(img_data))
             
@@ -228,6 +895,48 @@ class FaceProcessor:
         except Exception as e:
             logger.error(f"Error al decodificar imagen: {e}")
             return None
+    
+    def decode_image_reduced(self, img_data, ancho_objetivo=FRAME_RESIZE_WIDTH):
+        """
+        Decodifica una imagen directamente a un ancho reducido
+        
+        Para JPEG usa draft(), que hace que libjpeg escale en la decodificación
+        (1/2, 1/4, 1/8) sin generar nunca el bitmap completo; el resto se
+        ajusta con un resize barato.
+        
+        Args:
+            img_data (bytes): Imagen comprimida
+            ancho_objetivo (int): Ancho máximo de la imagen de detección
+            
+        Returns:
+            tuple: (numpy.ndarray RGB reducido, escala completa/reducida),
+                o (None, None) si falla
+        """
+        try:
+            img = Image.open(io.BytesIO(img_data))
+            ancho, alto = img.size
+            
+            if not ancho_objetivo or ancho <= ancho_objetivo:
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                return np.array(img), 1.0
+            
+            alto_objetivo = max(1, round(alto * ancho_objetivo / ancho))
+            
+            # Escalado en el decodificador JPEG (no-op para otros formatos)
+            img.draft('RGB', (ancho_objetivo, alto_objetivo))
+            
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
+            if img.size[0] > ancho_objetivo:
+                img = img.resize((ancho_objetivo, alto_objetivo), Image.BILINEAR)
+            
+            return np.array(img), ancho / img.size[0]
+            
+        except Exception as e:
+            logger.error(f"Error al decodificar imagen: {e}")
+            return None, None
 
 
 # Instancia global
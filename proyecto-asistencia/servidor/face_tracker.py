@@ -0,0 +1,181 @@
+"""
+face_tracker.py - Seguimiento de rostros entre frames consecutivos
+Reutiliza la identidad de un rostro ya confirmado para evitar recalcular
+su encoding en cada frame del mismo dispositivo
+"""
+
+import threading
+import time
+from config import (
+    TRACK_IOU_MIN, TRACK_CENTROID_MAX, TRACK_REENCODE_EVERY,
+    TRACK_CONFIRM_HITS, TRACK_TTL_SECONDS, TRACK_SCALE_JUMP
+)
+
+
+def _iou(a, b):
+    """Intersección sobre unión de dos cajas (top, right, bottom, left)"""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+
+    interseccion = max(0, right - left) * max(0, bottom - top)
+    if interseccion == 0:
+        return 0.0
+
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return interseccion / float(area_a + area_b - interseccion)
+
+
+def _area(caja):
+    return max(0, caja[1] - caja[3]) * max(0, caja[2] - caja[0])
+
+
+def _distancia_centroides(a, b):
+    """Distancia entre centros relativa al ancho promedio de las cajas"""
+    cy_a, cx_a = (a[0] + a[2]) / 2, (a[1] + a[3]) / 2
+    cy_b, cx_b = (b[0] + b[2]) / 2, (b[1] + b[3]) / 2
+    ancho = ((a[1] - a[3]) + (b[1] - b[3])) / 2 or 1
+    return ((cy_a - cy_b) ** 2 + (cx_a - cx_b) ** 2) ** 0.5 / ancho
+
+
+class Track:
+    """Rostro seguido a través de frames de un dispositivo"""
+
+    def __init__(self, location):
+        self.location = location
+        self.identidad = None  # Última coincidencia (dict) o None si es desconocido
+        self.confirmaciones = 0
+        self.frames_sin_encoding = 0
+        self.ultimo_visto = time.monotonic()
+        self.por_iou = False  # Asociado en este frame por solapamiento (no solo por cercanía)
+        self.cambio_escala = 1.0  # Razón de áreas entre la caja actual y la anterior
+
+    @property
+    def confirmado(self):
+        # Una identidad desconocida nunca se confirma: siempre se vuelve a codificar
+        return self.identidad is not None and self.confirmaciones >= TRACK_CONFIRM_HITS
+
+    def registrar_encoding(self, coincidencia):
+        """Actualiza la identidad tras calcular un encoding nuevo"""
+        id_anterior = self.identidad['id'] if self.identidad else None
+        id_nuevo = coincidencia['id'] if coincidencia else None
+
+        if id_nuevo is None:
+            self.confirmaciones = 0
+        elif self.confirmaciones > 0 and id_anterior == id_nuevo:
+            self.confirmaciones += 1
+        else:
+            self.confirmaciones = 1
+
+        self.identidad = coincidencia
+        self.frames_sin_encoding = 0
+
+
+class FaceTracker:
+    """
+    Tracks por dispositivo asociados por IoU (o cercanía de centroides)
+
+    Un rostro asociado por IoU a un track confirmado (misma identidad
+    conocida en TRACK_CONFIRM_HITS encodings seguidos) reutiliza esa
+    identidad; el encoding se recalcula para tracks nuevos, asociaciones solo
+    por cercanía de centros (podría ser otra persona en el mismo lugar),
+    saltos de escala de la caja y cada TRACK_REENCODE_EVERY frames.
+    """
+
+    def __init__(self, iou_min=TRACK_IOU_MIN, centroide_max=TRACK_CENTROID_MAX,
+                 reencode_cada=TRACK_REENCODE_EVERY, ttl=TRACK_TTL_SECONDS,
+                 salto_escala=TRACK_SCALE_JUMP):
+        self.iou_min = iou_min
+        self.salto_escala = salto_escala
+        self.centroide_max = centroide_max
+        self.reencode_cada = reencode_cada
+        self.ttl = ttl
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.reutilizados = 0
+        self.calculados = 0
+
+    def asociar(self, device_id, face_locations):
+        """
+        Asocia las ubicaciones detectadas con los tracks del dispositivo
+
+        Args:
+            device_id (str): Identificador del dispositivo
+            face_locations (list): Cajas (top, right, bottom, left) del frame actual
+
+        Returns:
+            list: Un Track por ubicación (nuevos para rostros sin track previo)
+        """
+        ahora = time.monotonic()
+
+        with self._lock:
+            vigentes = [
+                t for t in self._tracks.get(device_id, [])
+                if ahora - t.ultimo_visto <= self.ttl
+            ]
+
+            # Pares candidatos ordenados por IoU descendente (asignación greedy)
+            pares = []
+            for i, location in enumerate(face_locations):
+                for j, track in enumerate(vigentes):
+                    iou = _iou(location, track.location)
+                    if iou >= self.iou_min:
+                        pares.append((iou, i, j))
+                    elif _distancia_centroides(location, track.location) <= self.centroide_max:
+                        pares.append((0.0, i, j))
+            pares.sort(reverse=True)
+
+            asignados = [None] * len(face_locations)
+            por_iou = [False] * len(face_locations)
+            usados = set()
+            for score, i, j in pares:
+                if asignados[i] is None and j not in usados:
+                    asignados[i] = vigentes[j]
+                    por_iou[i] = score > 0.0
+                    usados.add(j)
+
+            for i, location in enumerate(face_locations):
+                track = asignados[i] or Track(location)
+                track.por_iou = por_iou[i]
+                track.cambio_escala = _area(location) / (_area(track.location) or 1)
+                track.location = location
+                track.ultimo_visto = ahora
+                track.frames_sin_encoding += 1
+                asignados[i] = track
+
+            # Los tracks no vistos en este frame se conservan hasta expirar (ttl)
+            self._tracks[device_id] = asignados + [
+                t for j, t in enumerate(vigentes) if j not in usados
+            ]
+            return asignados
+
+    def requiere_encoding(self, track):
+        """True si hay que recalcular el encoding de este track"""
+        escala_estable = 1 / self.salto_escala <= track.cambio_escala <= self.salto_escala
+        reutilizar = (track.confirmado and track.por_iou and escala_estable
+                      and track.frames_sin_encoding < self.reencode_cada)
+
+        # Con RECOGNITION_EXECUTOR="thread" varios hilos comparten el tracker
+        with self._lock:
+            if reutilizar:
+                self.reutilizados += 1
+            else:
+                self.calculados += 1
+
+        return not reutilizar
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Dispositivos con tracks y encodings reutilizados vs calculados
+        """
+        with self._lock:
+            return {
+                "dispositivos": len(self._tracks),
+                "reutilizados": self.reutilizados,
+                "calculados": self.calculados
+            }
@@ -0,0 +1,88 @@
+"""
+gallery_reloader.py - Recarga de la galería en segundo plano
+Regenera los encodings en un thread propio mientras el reconocimiento sigue
+usando la galería anterior; al terminar publica la nueva versión a los workers
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from database import db
+from face_processor import face_processor
+from recognition_engine import recognition_engine
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryReloader:
+    """Trabajo de recarga con estado consultable (a lo sumo uno en curso)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._estado = {"estado": "inactivo"}
+
+    @property
+    def en_curso(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self):
+        """
+        Lanza la recarga si no hay otra en curso
+
+        Returns:
+            bool: True si se inició, False si ya había una en curso
+        """
+        with self._lock:
+            if self.en_curso:
+                return False
+
+            self._estado = {
+                "estado": "en_curso",
+                "fase": "estudiantes",
+                "procesadas": 0,
+                "total": 0,
+                "version_anterior": face_processor.version,
+                "inicio": datetime.now().isoformat()
+            }
+            self._hilo = threading.Thread(target=self._ejecutar, name="recarga-galeria", daemon=True)
+            self._hilo.start()
+            return True
+
+    def _progreso(self, procesadas, total):
+        self._estado.update(procesadas=procesadas, total=total)
+
+    def _ejecutar(self):
+        inicio = time.monotonic()
+        try:
+            estudiantes = db.obtener_estudiantes() or []
+
+            self._estado["fase"] = "codificando"
+            resumen = face_processor.generar_encodings_desde_fotos(estudiantes, progreso=self._progreso)
+
+            # generar_encodings_desde_fotos ya publicó la galería en este proceso
+            recognition_engine.notificar_galeria(face_processor.version)
+
+            self._estado.update(estado="completado", resumen=resumen, version=face_processor.version)
+            logger.info(f"🔁 Recarga de galería completada en {time.monotonic() - inicio:.1f}s "
+                        f"(v{face_processor.version})")
+
+        except Exception as e:
+            logger.error(f"❌ Error recargando galería: {e}")
+            self._estado.update(estado="error", error=str(e))
+
+        finally:
+            self._estado.pop("fase", None)
+            self._estado.update(fin=datetime.now().isoformat(), duracion=round(time.monotonic() - inicio, 2))
+
+    def estado(self):
+        """
+        Returns:
+            dict: Estado, progreso (fotos codificadas / a codificar) y resumen de la última recarga
+        """
+        return dict(self._estado)
+
+
+# Instancia global
+gallery_reloader = GalleryReloader()
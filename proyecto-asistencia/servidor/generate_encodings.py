@@ -5,6 +5,7 @@ Ejecutar este script después de agregar fotos a la carpeta fotos_conocidas/
 
 import os
 import sys
+from collections import Counter
 from face_processor import face_processor
 from database import db
 import logging
@@ -43,16 +44,19 @@ def main():
     
     # Generar encodings
     logger.info("\n🔄 Iniciando generación de encodings...")
-    face_processor.generar_encodings_desde_fotos(estudiantes)
+    resumen = face_processor.generar_encodings_desde_fotos(estudiantes)
     
     if face_processor.encodings_loaded:
         print("\n" + "="*50)
         print("✅ ENCODINGS GENERADOS EXITOSAMENTE")
         print("="*50)
-        print(f"Total de rostros procesados: {len(face_processor.known_encodings)}")
+        print(f"Total de rostros procesados: {len(face_processor.known_encodings)} ({resumen['estudiantes']} estudiantes)")
+        print(f"Reutilizados: {resumen['reutilizados']} | Codificados: {resumen['codificados']} | Fallidos: {resumen['fallidos']}")
         print("\nEstudiantes registrados:")
-        for i, (id_est, nombre) in enumerate(zip(face_processor.known_ids, face_processor.known_names), 1):
-            print(f"  {i}. {nombre} (ID: {id_est})")
+        fotos = Counter(face_processor.known_ids)
+        nombres = dict(zip(face_processor.known_ids, face_processor.known_names))
+        for i, (id_est, cantidad) in enumerate(fotos.items(), 1):
+            print(f"  {i}. {nombres[id_est]} (ID: {id_est}, {cantidad} fotos)")
     else:
         print("\n❌ ERROR: No se pudieron generar encodings")
         sys.exit(1)
@@ -0,0 +1,245 @@
+"""
+led_dispatcher.py - Envío asíncrono de comandos LED a las Raspberry Pi
+Los comandos se encolan sin bloquear el handler del frame y se entregan con
+un cliente HTTP asíncrono que conserva una conexión keep-alive por dispositivo
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+import httpx
+from config import (
+    LED_CONTROL_TIMEOUT, LED_API_PORT, LED_DISPATCH_WORKERS, LED_QUEUE_MAX,
+    LED_KEEPALIVE_SECONDS, LED_BREAKER_FAILURES, LED_BREAKER_COOLDOWN
+)
+
+logger = logging.getLogger(__name__)
+
+# Latencias (encolado -> entregado) que se conservan para las métricas
+_MUESTRAS_LATENCIA = 500
+
+
+class Circuito:
+    """
+    Circuit breaker de un dispositivo
+
+    Tras `fallos_max` fallos seguidos se abre y los comandos se descartan
+    durante `espera` segundos; luego deja pasar un intento de prueba
+    (semiabierto) que lo cierra si tiene éxito o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self, fallos_max=LED_BREAKER_FAILURES, espera=LED_BREAKER_COOLDOWN):
+        self.fallos_max = fallos_max
+        self.espera = espera
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.probando = False
+
+    @property
+    def abierto(self):
+        return self.fallos >= self.fallos_max
+
+    @property
+    def en_espera(self):
+        """Abierto y todavía sin permitir el intento de prueba"""
+        return self.abierto and time.monotonic() < self.abierto_hasta
+
+    def permite(self):
+        """True si se puede intentar un envío ahora"""
+        if not self.abierto:
+            return True
+        if self.probando or time.monotonic() < self.abierto_hasta:
+            return False
+        self.probando = True
+        return True
+
+    def exito(self):
+        self.fallos = 0
+        self.probando = False
+
+    def fallo(self):
+        self.fallos += 1
+        self.probando = False
+        if self.abierto:
+            self.abierto_hasta = time.monotonic() + self.espera
+
+
+class LedDispatcher:
+    """
+    Cola de comandos LED drenada por workers asíncronos
+
+    Por dispositivo se guarda solo el último comando pendiente: si llega otro
+    antes de enviarse, lo reemplaza (el LED muestra el veredicto más reciente).
+    """
+
+    def __init__(self, workers=LED_DISPATCH_WORKERS, max_pendientes=LED_QUEUE_MAX,
+                 timeout=LED_CONTROL_TIMEOUT, puerto=LED_API_PORT):
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self.timeout = timeout
+        self.puerto = puerto
+        self.resolver = None
+
+        self._pendientes = {}
+        self._cola = None
+        self._tareas = []
+        self._cliente = None
+        self._circuitos = {}
+        self._latencias = deque(maxlen=_MUESTRAS_LATENCIA)
+
+        # Métricas
+        self.encolados = 0
+        self.fusionados = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.descartados = 0
+
+    async def iniciar(self, resolver):
+        """
+        Crea el cliente HTTP y los workers (llamar desde el event loop)
+
+        Args:
+            resolver (callable): device_id -> IP del dispositivo, o None si no se conoce
+                (puede bloquear: se ejecuta en un thread)
+        """
+        self.resolver = resolver
+        self._cola = asyncio.Queue()
+        self._cliente = httpx.AsyncClient(
+            timeout=self.timeout,
+            # La concurrencia la limitan los workers; se conserva una conexión
+            # inactiva por dispositivo para no repetir el handshake TCP
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=self.max_pendientes,
+                keepalive_expiry=LED_KEEPALIVE_SECONDS
+            )
+        )
+        self._tareas = [
+            asyncio.create_task(self._worker(), name=f"led-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"💡 Despachador LED: {self.workers} workers")
+
+    async def detener(self):
+        """Cancela los workers y cierra las conexiones"""
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+        if self._cliente:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    def notificar(self, device_id, color, duration=2):
+        """
+        Encola un comando LED sin esperar su envío
+
+        Args:
+            device_id (str): ID del dispositivo
+            color (str): 'green' o 'red'
+            duration (int): Duración en segundos
+        """
+        if self._cola is None or not device_id:
+            return
+
+        comando = (color, duration, time.monotonic())
+
+        if device_id in self._pendientes:
+            self._pendientes[device_id] = comando
+            self.fusionados += 1
+            return
+
+        circuito = self._circuitos.get(device_id)
+        if len(self._pendientes) >= self.max_pendientes or (circuito and circuito.en_espera):
+            self.descartados += 1
+            return
+
+        self._pendientes[device_id] = comando
+        self._cola.put_nowait(device_id)
+        self.encolados += 1
+
+    async def _worker(self):
+        while True:
+            device_id = await self._cola.get()
+            color, duration, encolado = self._pendientes.pop(device_id)
+            try:
+                await self._enviar(device_id, color, duration, encolado)
+            except Exception as e:
+                # Un error inesperado (resolver, URL inválida...) no debe terminar el worker
+                logger.error(f"Error inesperado enviando LED a {device_id}: {e}")
+                self._registrar_fallo(device_id, self._circuitos.setdefault(device_id, Circuito()))
+
+    async def _enviar(self, device_id, color, duration, encolado):
+        """Entrega un comando respetando el circuit breaker del dispositivo"""
+        circuito = self._circuitos.setdefault(device_id, Circuito())
+        if not circuito.permite():
+            self.descartados += 1
+            return
+
+        device_ip = await asyncio.to_thread(self.resolver, device_id) if self.resolver else None
+        if not device_ip:
+            logger.warning(f"IP de {device_id} no registrada")
+            self.descartados += 1
+            circuito.probando = False
+            return
+
+        host = f"[{device_ip}]" if ":" in device_ip else device_ip  # IPv6 entre corchetes
+        url = f"http://{host}:{self.puerto}/api/led"
+
+        try:
+            response = await self._cliente.post(url, json={"color": color, "duration": duration})
+        except httpx.TimeoutException:
+            logger.warning(f"⏱️  Timeout al conectar con {device_id}")
+            self._registrar_fallo(device_id, circuito)
+            return
+        except httpx.HTTPError as e:
+            logger.warning(f"Error al enviar comando LED a {device_id}: {e}")
+            self._registrar_fallo(device_id, circuito)
+            return
+
+        if response.status_code == 200:
+            circuito.exito()
+            self.enviados += 1
+            self._latencias.append(time.monotonic() - encolado)
+            logger.info(f"✅ LED {color} activado en {device_id}")
+        else:
+            logger.warning(f"⚠️  Error activando LED: {response.status_code}")
+            self._registrar_fallo(device_id, circuito)
+
+    def _registrar_fallo(self, device_id, circuito):
+        self.fallidos += 1
+        circuito.fallo()
+        if circuito.abierto:
+            logger.warning(f"🔌 Circuito LED abierto para {device_id} ({LED_BREAKER_COOLDOWN}s)")
+
+    def metricas(self):
+        """
+        Returns:
+            dict: Contadores, latencia de entrega (ms) y dispositivos con el circuito abierto
+        """
+        latencias = sorted(self._latencias)
+        if latencias:
+            latencia = {
+                "promedio_ms": round(1000 * sum(latencias) / len(latencias), 1),
+                "p95_ms": round(1000 * latencias[int(0.95 * (len(latencias) - 1))], 1),
+                "max_ms": round(1000 * latencias[-1], 1)
+            }
+        else:
+            latencia = None
+
+        return {
+            "pendientes": len(self._pendientes),
+            "encolados": self.encolados,
+            "fusionados": self.fusionados,
+            "enviados": self.enviados,
+            "fallidos": self.fallidos,
+            "descartados": self.descartados,
+            "latencia": latencia,
+            "circuitos_abiertos": [d for d, c in self._circuitos.items() if c.abierto]
+        }
+
+
+# Instancia global
+led_dispatcher = LedDispatcher()
@@ -3,21 +3,32 @@ main.py - API principal FastAPI del servidor
 Recibe frames, procesa reconocimiento facial y gestiona asistencia
 """
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-import requests
+from typing import List, Optional
+import asyncio
+import json
 import logging
 from datetime import datetime
 import uvicorn
 
 from config import (
     SERVER_HOST, SERVER_PORT, CORS_ORIGINS, 
-    COOLDOWN_SECONDS, LED_CONTROL_TIMEOUT
+    COOLDOWN_SECONDS, WRITE_BEHIND_ENABLED,
+    MAX_FRAME_SIZE_MB, MAX_CROPS_PER_FRAME, LED_GREEN_DURATION, LED_RED_DURATION,
+    WS_MAX_INFLIGHT
 )
 from database import db
+from class_schedule import class_schedule
+from device_registry import device_registry
+from attendance_writer import attendance_writer
 from face_processor import face_processor
+from gallery_reloader import gallery_reloader
+from led_dispatcher import led_dispatcher
+from recognition_engine import recognition_engine, ColaLlena
 
 # Configurar logging
 logging.basicConfig(
@@ -44,9 +55,17 @@ app.add_middleware(
 
 
 # Modelos Pydantic
+class RostroRecorte(BaseModel):
+    image: str  # Recorte JPEG en base64
+    bbox: List[int]  # Caja del rostro en el frame original (top, right, bottom, left)
+    location: Optional[List[int]] = None  # Caja del rostro dentro del recorte (None = recorte completo)
+
+
 class FrameRequest(BaseModel):
-    image: str  # Base64 encoded image
+    image: Optional[str] = None  # Base64 encoded image (frame completo)
     device_id: str
+    rostros: Optional[List[RostroRecorte]] = None  # Recortes ya detectados: se omite la detección
+    origen: Optional[List[float]] = None  # [top, left, escala] si image es una región del frame
 
 
 class RegistroRequest(BaseModel):
@@ -54,50 +73,12 @@ class RegistroRequest(BaseModel):
     device_id: str = None
 
 
-# Cache para IPs de dispositivos (evitar consultas constantes)
-dispositivos_cache = {}
+class HeartbeatRequest(BaseModel):
+    device_id: str
 
 
-def enviar_comando_led(device_id: str, color: str, duration: int = 2):
-    """
-    Envía comando para controlar LED en la Raspberry Pi
-    
-    Args:
-        device_id (str): ID del dispositivo
-        color (str): 'green' o 'red'
-        duration (int): Duración en segundos
-    """
-    try:
-        # Obtener IP del dispositivo desde cache o BD
-        if device_id not in dispositivos_cache:
-            # Aquí podrías consultar BD para obtener IP
-            # Por ahora, asumimos formato: device_id = "pi-aula-101" -> IP en config
-            logger.warning(f"IP de {device_id} no encontrada en cache")
-            return
-        
-        device_ip = dispositivos_cache[device_id]
-        url = f"http://{device_ip}:5000/api/led"
-        
-        payload = {
-            "color": color,
-            "duration": duration
-        }
-        
-        response = requests.post(
-            url, 
-            json=payload, 
-            timeout=LED_CONTROL_TIMEOUT
-        )
-        
-        if response.status_code == 200:
-            logger.info(f"✅ LED {color} activado en {device_id}")
-        else:
-            logger.warning(f"⚠️  Error activando LED: {response.status_code}")
-            
-    except requests.exceptions.Timeout:
-        logger.warning(f"⏱️  Timeout al conectar con {device_id}")
-    except Exception as e:
-        logger.error(f"Error al enviar comando LED: {e}")
+# Tamaño máximo aceptado por frame (antes de decodificar)
+MAX_FRAME_BYTES = MAX_FRAME_SIZE_MB * 1024 * 1024
 
 
 @app.on_event("startup")
@@ -114,9 +95,36 @@ async def startup_event():
         if estudiantes:
             face_processor.generar_encodings_desde_fotos(estudiantes)
     
+    # Cache de cooldown con la asistencia de hoy
+    db.calentar_cache()
+    
+    # Reinsertar registros pendientes del spool (se anotan en el cache ya calentado)
+    if WRITE_BEHIND_ENABLED:
+        attendance_writer.iniciar()
+    
+    # Horario de clases para acotar la búsqueda por sala
+    class_schedule.cargar()
+    
+    # Los workers se crean después de cargar la galería
+    recognition_engine.iniciar()
+    
+    # Comandos LED: cola asíncrona, la IP se resuelve en el registro de dispositivos
+    await led_dispatcher.iniciar(device_registry.ip_de)
+    
     logger.info("✅ Servidor listo")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Evento de cierre - Liberar workers y vaciar registros pendientes
+    """
+    await led_dispatcher.detener()
+    recognition_engine.detener()
+    if WRITE_BEHIND_ENABLED:
+        attendance_writer.detener()
+
+
 @app.get("/")
 async def root():
     """Endpoint raíz con información del sistema"""
@@ -126,42 +134,368 @@ async def root():
         "timestamp": datetime.now().isoformat(),
         "endpoints": {
             "procesar_frame": "POST /api/procesar-frame",
+            "procesar_frame_raw": "POST /api/procesar-frame/raw",
+            "procesar_frame_ws": "WS /api/procesar-frame/ws",
             "estudiantes": "GET /api/estudiantes",
             "asistencia_hoy": "GET /api/asistencia/hoy",
-            "registrar": "POST /api/registrar"
+            "registrar": "POST /api/registrar",
+            "dispositivos": "GET /api/dispositivos",
+            "heartbeat": "POST /api/dispositivos/heartbeat"
         }
     }
 
 
 @app.post("/api/procesar-frame")
-async def procesar_frame(request: FrameRequest):
+async def procesar_frame(request: FrameRequest, http_request: Request):
     """
     Procesa un frame recibido de la Raspberry Pi
     Detecta rostros, los compara y registra asistencia
     
+    En lugar del frame completo se pueden enviar en "rostros" los recortes de
+    los rostros que el cliente ya detectó, cada uno con su caja en el frame
+    original; el servidor solo calcula los encodings.
+    
     Args:
-        request: FrameRequest con imagen en base64 y device_id
+        request: FrameRequest con imagen (o rostros) en base64 y device_id
+        http_request: Request (header X-LED-Mode)
         
     Returns:
         JSON con resultado del procesamiento
     """
-    try:
-        device_id = request.device_id
+    device_registry.visto(request.device_id, http_request.client.host if http_request.client else None)
+    led_local = es_led_local(http_request)
+    
+    if request.rostros is not None:
+        recortes = [rostro.model_dump() for rostro in request.rostros]
+        return agregar_carga(await reconocer_y_registrar(
+            None, request.device_id, recortes, led_local=led_local
+        ))
+    
+    if not request.image:
+        raise HTTPException(status_code=400, detail="Se requiere 'image' o 'rostros'")
+    
+    return agregar_carga(await reconocer_y_registrar(
+        request.image, request.device_id, led_local=led_local, origen=request.origen
+    ))
+
+
+@app.post("/api/procesar-frame/raw")
+async def procesar_frame_raw(request: Request):
+    """
+    Procesa un frame enviado como JPEG binario, sin base64 ni JSON
+    
+    Acepta el cuerpo crudo con Content-Type: image/jpeg, o multipart/form-data
+    con el archivo en el campo "image". El device_id va en el header X-Device-ID.
+    Si la imagen es una región del frame, el header X-Frame-Origin lleva
+    "top,left,escala" para ubicarla en el frame del dispositivo.
+    
+    Para el protocolo de recortes, el multipart lleva un archivo "rostro" por
+    rostro y el campo "rostros" con un JSON [{"bbox": [...], "location": [...]}]
+    en el mismo orden.
+    
+    Returns:
+        JSON con resultado del procesamiento (igual que /api/procesar-frame)
+    """
+    device_id = request.headers.get("X-Device-ID")
+    if not device_id:
+        raise HTTPException(status_code=400, detail="Header X-Device-ID requerido")
+    
+    device_registry.visto(device_id, request.client.host if request.client else None)
+    
+    cuerpo = await leer_cuerpo(request, f"Frame excede {MAX_FRAME_SIZE_MB} MB")
+    
+    content_type = request.headers.get("content-type", "")
+    
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        
+        archivos = form.getlist("rostro")
+        if archivos:
+            try:
+                metadatos = json.loads(form.get("rostros") or "[]")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Campo 'rostros' no es JSON válido")
+            if not isinstance(metadatos, list) or len(metadatos) != len(archivos):
+                raise HTTPException(status_code=400, detail="'rostros' debe describir cada archivo 'rostro'")
+            
+            recortes = []
+            for archivo, meta in zip(archivos, metadatos):
+                if isinstance(archivo, str) or not isinstance(meta, dict):
+                    raise HTTPException(status_code=400, detail="Recorte inválido")
+                recortes.append({
+                    "image": await archivo.read(),
+                    "bbox": meta.get("bbox"),
+                    "location": meta.get("location")
+                })
+            
+            return agregar_carga(await reconocer_y_registrar(
+                None, device_id, recortes, led_local=es_led_local(request)
+            ))
         
-        # Registrar dispositivo en cache si no existe
-        if device_id not in dispositivos_cache:
-            # Extraer IP del request (para futura referencia)
-            # dispositivos_cache[device_id] = request.client.host
+        archivo = form.get("image")
+        if archivo is None or isinstance(archivo, str):
+            raise HTTPException(status_code=400, detail="Campo 'image' requerido")
+        img_bytes = await archivo.read()
+    else:
+        img_bytes = cuerpo
+    
+    if not img_bytes:
+        raise HTTPException(status_code=400, detail="Imagen vacía")
+    
+    origen = request.headers.get("X-Frame-Origin")
+    if origen:
+        try:
+            origen = [float(v) for v in origen.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Frame-Origin debe ser 'top,left,escala'")
+    
+    return agregar_carga(await reconocer_y_registrar(
+        img_bytes, device_id, led_local=es_led_local(request), origen=origen or None
+    ))
+
+
+@app.websocket("/api/procesar-frame/ws")
+async def procesar_frame_ws(websocket: WebSocket):
+    """
+    Canal persistente de frames: una conexión por dispositivo
+    
+    El device_id va en el header X-Device-ID (o ?device_id=). Cada mensaje
+    binario es un frame JPEG; un mensaje de texto es un JSON con "image"
+    (base64, con "origen" si es una región) o "rostros" (igual que
+    /api/procesar-frame). Por cada mensaje se
+    responde un JSON con el mismo resultado que los endpoints HTTP más "seq",
+    el número de mensaje en la conexión (las respuestas pueden llegar en otro
+    orden).
+    
+    Control de flujo: con WS_MAX_INFLIGHT frames en proceso, los siguientes se
+    responden de inmediato con status "busy" sin procesarlos.
+    """
+    device_id = websocket.headers.get("X-Device-ID") or websocket.query_params.get("device_id")
+    if not device_id:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    
+    ip_address = websocket.client.host if websocket.client else None
+    led_local = es_led_local(websocket)
+    en_vuelo = set()
+    lock_envio = asyncio.Lock()
+    seq = 0
+    
+    async def responder(respuesta: dict):
+        async with lock_envio:
+            await websocket.send_json(respuesta)
+    
+    async def atender(seq: int, imagen, recortes, origen):
+        try:
+            respuesta = agregar_carga(await reconocer_y_registrar(
+                imagen, device_id, recortes, led_local=led_local, origen=origen
+            ))
+        except HTTPException as e:
+            respuesta = agregar_carga({
+                "status": "busy" if e.status_code == 503 else "error",
+                "code": e.status_code,
+                "message": e.detail
+            })
+        respuesta["seq"] = seq
+        try:
+            await responder(respuesta)
+        except (WebSocketDisconnect, RuntimeError):
             pass
+    
+    logger.info(f"🔗 {device_id} conectado por WebSocket")
+    
+    try:
+        while True:
+            mensaje = await websocket.receive()
+            if mensaje["type"] == "websocket.disconnect":
+                break
+            
+            seq += 1
+            imagen, recortes, origen = mensaje.get("bytes"), None, None
+            
+            if imagen is None:
+                try:
+                    datos = json.loads(mensaje.get("text") or "")
+                    if datos.get("rostros") is not None:
+                        recortes = [RostroRecorte(**r).model_dump() for r in datos["rostros"]]
+                    else:
+                        imagen = datos.get("image")
+                        origen = datos.get("origen")
+                except (ValueError, TypeError, AttributeError):
+                    imagen = None
+                
+                if not imagen and recortes is None:
+                    await responder({
+                        "seq": seq,
+                        "status": "error",
+                        "code": 400,
+                        "message": "Se requiere frame binario, 'image' o 'rostros'"
+                    })
+                    continue
+            
+            if len(en_vuelo) >= WS_MAX_INFLIGHT:
+                await responder(agregar_carga({"seq": seq, "status": "busy"}))
+                continue
+            
+            device_registry.visto(device_id, ip_address)
+            tarea = asyncio.create_task(atender(seq, imagen, recortes, origen))
+            en_vuelo.add(tarea)
+            tarea.add_done_callback(en_vuelo.discard)
+            
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Los frames en proceso terminan igual (pueden registrar asistencia);
+        # su respuesta se descarta
+        logger.info(f"🔌 {device_id} desconectado")
+
+
+def agregar_carga(respuesta: dict):
+    """
+    Adjunta el nivel de carga del servidor (0-1) para que el cliente
+    adapte su frecuencia y calidad de envío
+    """
+    respuesta["carga"] = recognition_engine.nivel_carga
+    return respuesta
+
+
+def es_led_local(request: Request):
+    """
+    True si el dispositivo enciende sus LEDs con el veredicto de la respuesta
+    (header X-LED-Mode: local) y no necesita el callback a su API GPIO
+    """
+    return request.headers.get("X-LED-Mode", "").lower() == "local"
+
+
+def veredicto_led(device_id: str, color: str, duration: int, led_local: bool):
+    """
+    Veredicto LED que se incluye en la respuesta del frame
+    
+    Si el dispositivo no lo aplica localmente, además se encola el comando
+    para su API GPIO
+    """
+    if not led_local:
+        led_dispatcher.notificar(device_id, color, duration)
+    return {"color": color, "duration": duration}
+
+
+def validar_recortes(recortes: list):
+    """
+    Valida cantidad y cajas de los recortes recibidos
+    
+    Raises:
+        HTTPException: 400 si algún recorte está mal formado
+    """
+    if len(recortes) > MAX_CROPS_PER_FRAME:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_CROPS_PER_FRAME} rostros por frame")
+    
+    for recorte in recortes:
+        for campo in ("bbox", "location"):
+            caja = recorte.get(campo)
+            if caja is None and campo == "location":
+                continue
+            if not isinstance(caja, list) or len(caja) != 4 or not all(isinstance(v, int) for v in caja):
+                raise HTTPException(status_code=400, detail=f"'{campo}' debe ser [top, right, bottom, left]")
+
+
+async def leer_cuerpo(request: Request, detalle: str, limite: int = MAX_FRAME_BYTES):
+    """
+    Lee el cuerpo del request con un tope de bytes
+    
+    Rechaza por Content-Length sin leer nada y, si no lo hay (chunked),
+    corta la lectura apenas se supera el tope. El cuerpo queda cacheado en
+    el request, así request.form() lo parsea sin volver a leerlo
+    
+    Raises:
+        HTTPException: 413 si el cuerpo excede el límite
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limite:
+        raise HTTPException(status_code=413, detail=detalle)
+    
+    partes = []
+    total = 0
+    async for parte in request.stream():
+        total += len(parte)
+        if total > limite:
+            raise HTTPException(status_code=413, detail=detalle)
+        partes.append(parte)
+    
+    request._body = b"".join(partes)
+    return request._body
+
+
+def validar_origen(origen):
+    """
+    Valida el origen [top, left, escala] de una región del frame
+
+    Raises:
+        HTTPException: 400 si está mal formado
+    """
+    if origen is None:
+        return
+    if (not isinstance(origen, list) or len(origen) != 3
+            or not all(isinstance(v, (int, float)) for v in origen) or not origen[2] > 0):
+        raise HTTPException(status_code=400, detail="'origen' debe ser [top, left, escala] con escala > 0")
+
+
+def tamano_imagen(imagen):
+    """Bytes de la imagen decodificada (estimado para base64)"""
+    return len(imagen) * 3 // 4 if isinstance(imagen, str) else len(imagen)
+
+
+async def reconocer_y_registrar(imagen, device_id: str, recortes: list = None,
+                                led_local: bool = False, origen: list = None):
+    """
+    Flujo común de reconocimiento y registro para todos los endpoints de frames
+    
+    Args:
+        imagen (str | bytes): Imagen en base64 o bytes JPEG
+        device_id (str): Identificador del dispositivo
+        recortes (list): Recortes de rostros con 'image', 'bbox' y 'location';
+            si se indican, se ignora imagen y no se ejecuta detección
+        led_local (bool): El dispositivo aplica el veredicto "led" de la
+            respuesta; no se le envía el comando LED por HTTP
+        origen (list): [top, left, escala] si imagen es una región del frame
+            (el seguimiento entre frames usa coordenadas del frame)
+        
+    Returns:
+        JSON con resultado del procesamiento
+    """
+    try:
+        if recortes is not None:
+            validar_recortes(recortes)
+            tamano = sum(tamano_imagen(recorte["image"]) for recorte in recortes)
+        else:
+            validar_origen(origen)
+            tamano = tamano_imagen(imagen)
         
-        # Decodificar imagen
-        img_array = face_processor.decode_image_from_base64(request.image)
+        # Rechazar frames sobredimensionados antes de decodificar
+        if tamano > MAX_FRAME_BYTES:
+            raise HTTPException(status_code=413, detail=f"Frame excede {MAX_FRAME_SIZE_MB} MB")
         
-        if img_array is None:
-            raise HTTPException(status_code=400, detail="Error al decodificar imagen")
+        # Inscritos del curso con clase en la sala del dispositivo (se prueban primero)
+        candidatos = class_schedule.candidatos(device_id)
         
-        # Procesar frame
-        resultado = face_processor.procesar_frame(img_array)
+        # Decodificar y procesar frame en el pool de workers
+        try:
+            if recortes is not None:
+                resultado = await recognition_engine.procesar_recortes(recortes, device_id, candidatos)
+            else:
+                resultado = await recognition_engine.procesar(
+                    imagen, device_id, candidatos, tuple(origen) if origen else None
+                )
+        except ColaLlena:
+            raise HTTPException(
+                status_code=503,
+                detail="Servidor saturado, reintentar",
+                headers={"Retry-After": "1"}
+            )
+        
+        if resultado is None:
+            raise HTTPException(status_code=400, detail="Error al decodificar imagen")
         
         if resultado['faces_found'] == 0:
             return {
@@ -178,15 +512,25 @@ async def procesar_frame(request: FrameRequest):
             confidence = match['confidence']
             
             # Verificar cooldown
-            en_cooldown = db.verificar_cooldown(id_estudiante, COOLDOWN_SECONDS)
+            en_cooldown = await run_in_threadpool(
+                db.verificar_cooldown, id_estudiante, COOLDOWN_SECONDS
+            )
             
             if not en_cooldown:
-                # Registrar asistencia
-                registro = db.registrar_asistencia(id_estudiante, device_id)
+                # Registrar asistencia (write-behind: sin esperar el commit de MySQL)
+                if WRITE_BEHIND_ENABLED:
+                    # encolar escribe (y opcionalmente hace fsync) el spool: fuera del event loop
+                    registro = await run_in_threadpool(
+                        attendance_writer.encolar, id_estudiante, device_id
+                    )
+                else:
+                    registro = await run_in_threadpool(
+                        db.registrar_asistencia, id_estudiante, device_id
+                    )
                 
                 if registro['success']:
-                    # Enviar comando LED verde
-                    enviar_comando_led(device_id, "green", 2)
+                    # LED verde
+                    led = veredicto_led(device_id, "green", LED_GREEN_DURATION, led_local)
                     
                     logger.info(f"✅ Asistencia registrada: {nombre} (ID: {id_estudiante})")
                     
@@ -196,7 +540,8 @@ async def procesar_frame(request: FrameRequest):
                         "id_estudiante": id_estudiante,
                         "confidence": confidence,
                         "registrado": True,
-                        "resultado": registro['resultado']
+                        "resultado": registro['resultado'],
+                        "led": led
                     }
                 else:
                     logger.error(f"Error al registrar: {registro.get('error')}")
@@ -217,21 +562,24 @@ async def procesar_frame(request: FrameRequest):
                 }
         
         # No se reconoció ningún rostro
-        enviar_comando_led(device_id, "red", 1)
+        led = veredicto_led(device_id, "red", LED_RED_DURATION, led_local)
         
         return {
             "status": "unknown",
             "message": "Rostro no reconocido",
-            "faces_found": resultado['faces_found']
+            "faces_found": resultado['faces_found'],
+            "led": led
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error procesando frame: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/estudiantes")
-async def obtener_estudiantes():
+def obtener_estudiantes():
     """
     Obtiene la lista completa de estudiantes registrados
     
@@ -250,7 +598,7 @@ async def obtener_estudiantes():
 
 
 @app.get("/api/asistencia/hoy")
-async def obtener_asistencia_hoy():
+def obtener_asistencia_hoy():
     """
     Obtiene los registros de asistencia del día actual
     
@@ -270,7 +618,7 @@ async def obtener_asistencia_hoy():
 
 
 @app.post("/api/registrar")
-async def registrar_manual(request: RegistroRequest):
+def registrar_manual(request: RegistroRequest):
     """
     Endpoint para registrar asistencia manualmente (legacy/backup)
     
@@ -301,25 +649,170 @@ async def registrar_manual(request: RegistroRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/recargar-encodings")
+@app.post("/api/recargar-encodings", status_code=202)
 async def recargar_encodings():
     """
     Recarga los encodings desde las fotos (útil cuando se agregan nuevos estudiantes)
     
+    La regeneración corre en segundo plano: los frames se siguen reconociendo
+    con la galería anterior hasta que la nueva se publica. El avance se
+    consulta en GET /api/recargar-encodings/estado
+    
     Returns:
-        Confirmación de recarga
+        Estado de la recarga iniciada
     """
+    if not gallery_reloader.iniciar():
+        raise HTTPException(status_code=409, detail="Ya hay una recarga de encodings en curso")
+    
+    return {
+        "success": True,
+        "message": "Recarga de encodings iniciada",
+        "recarga": gallery_reloader.estado()
+    }
+
+
+@app.get("/api/recargar-encodings/estado")
+async def estado_recarga_encodings():
+    """
+    Estado y progreso de la última recarga de encodings
+    
+    Returns:
+        Estado (inactivo/en_curso/completado/error), fotos codificadas y resumen
+    """
+    return gallery_reloader.estado()
+
+
+@app.put("/api/estudiantes/{id_estudiante}/rostro")
+async def enrolar_estudiante(id_estudiante: int, request: Request):
+    """
+    Enrola o actualiza la foto principal de un estudiante sin regenerar la galería
+    
+    La foto llega como cuerpo binario (image/jpeg) o como archivo "foto" en
+    multipart. Se codifica una vez y reemplaza a la anterior en la galería
+    (las fotos adicionales se conservan); el índice se actualiza en el lugar
+    y los workers reciben la nueva versión.
+    
+    Returns:
+        Versión de galería publicada
+    """
+    return await enrolar(id_estudiante, request, adicional=False)
+
+
+@app.post("/api/estudiantes/{id_estudiante}/rostros")
+async def agregar_foto_estudiante(id_estudiante: int, request: Request):
+    """
+    Agrega una foto de referencia más a un estudiante (mismo formato que el PUT)
+    
+    Returns:
+        Versión de galería publicada
+    """
+    return await enrolar(id_estudiante, request, adicional=True)
+
+
+async def enrolar(id_estudiante, request, adicional):
+    """Lee la foto del request, la codifica y publica la galería actualizada"""
+    cuerpo = await leer_cuerpo(request, f"Foto excede {MAX_FRAME_SIZE_MB} MB")
+    
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        archivo = form.get("foto")
+        if archivo is None or isinstance(archivo, str):
+            raise HTTPException(status_code=400, detail="Campo 'foto' requerido")
+        img_bytes = await archivo.read()
+    else:
+        img_bytes = cuerpo
+    
+    if not img_bytes:
+        raise HTTPException(status_code=400, detail="Imagen vacía")
+    
+    estudiante = await run_in_threadpool(db.obtener_estudiante_por_id, id_estudiante)
+    if not estudiante:
+        raise HTTPException(status_code=404, detail="Estudiante no encontrado")
+    
+    if gallery_reloader.en_curso:
+        raise HTTPException(status_code=409, detail="Hay una recarga de encodings en curso")
+    
     try:
-        estudiantes = db.obtener_estudiantes()
-        face_processor.generar_encodings_desde_fotos(estudiantes)
+        version = await run_in_threadpool(face_processor.enrolar, estudiante, img_bytes, adicional)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    recognition_engine.notificar_galeria(version)
+    
+    return {
+        "success": True,
+        "message": f"Estudiante enrolado: {estudiante['nombre_completo']}",
+        "version": version,
+        "total_encodings": len(face_processor.known_encodings)
+    }
+
+
+@app.delete("/api/estudiantes/{id_estudiante}/rostro")
+async def desenrolar_estudiante(id_estudiante: int):
+    """
+    Quita los encodings (todas sus fotos) de un estudiante de la galería
+    
+    La foto y el estudiante siguen en la BD: una recarga completa lo vuelve
+    a enrolar si no se da de baja también allí
+    
+    Returns:
+        Versión de galería publicada
+    """
+    if gallery_reloader.en_curso:
+        raise HTTPException(status_code=409, detail="Hay una recarga de encodings en curso")
+    
+    version = await run_in_threadpool(face_processor.desenrolar, id_estudiante)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Estudiante no enrolado")
+    
+    recognition_engine.notificar_galeria(version)
+    
+    return {
+        "success": True,
+        "message": f"Estudiante {id_estudiante} quitado de la galería",
+        "version": version,
+        "total_encodings": len(face_processor.known_encodings)
+    }
+
+
+@app.post("/api/dispositivos/heartbeat")
+def heartbeat_dispositivo(request: HeartbeatRequest, http_request: Request):
+    """
+    Registro / heartbeat de un dispositivo
+    
+    Guarda la IP de origen y el último contacto en la tabla dispositivos,
+    para que cualquier worker o nodo pueda enviarle comandos LED
+    
+    Args:
+        request: HeartbeatRequest con device_id
         
-        return {
-            "success": True,
-            "message": f"Encodings recargados: {len(face_processor.known_encodings)} rostros"
-        }
-    except Exception as e:
-        logger.error(f"Error recargando encodings: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    Returns:
+        Confirmación del registro
+    """
+    ip_address = http_request.client.host if http_request.client else None
+    if not device_registry.registrar(request.device_id, ip_address):
+        raise HTTPException(status_code=500, detail="Error al registrar dispositivo")
+    
+    return {
+        "success": True,
+        "device_id": request.device_id,
+        "ip_address": ip_address
+    }
+
+
+@app.get("/api/dispositivos")
+def obtener_dispositivos():
+    """
+    Obtiene los dispositivos registrados con su último contacto
+    
+    Returns:
+        Lista de dispositivos
+    """
+    dispositivos = device_registry.listar()
+    return {
+        "total": len(dispositivos),
+        "dispositivos": dispositivos
+    }
 
 
 @app.get("/api/health")
@@ -329,29 +822,19 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "encodings_loaded": face_processor.encodings_loaded,
-        "total_encodings": len(face_processor.known_encodings)
+        "total_encodings": len(face_processor.known_encodings),
+        "version_galeria": face_processor.version,
+        "motor": recognition_engine.carga,
+        "seguimiento": await recognition_engine.metricas_seguimiento(),
+        "db_pool": db.pool.metricas(),
+        "cache_asistencia": db.cache.metricas() if db.cache else None,
+        "write_behind": attendance_writer.metricas() if WRITE_BEHIND_ENABLED else None,
+        "leds": led_dispatcher.metricas(),
+        "dispositivos": device_registry.metricas(),
+        "horario": class_schedule.metricas()
     }
 
 
-# Registrar IP de dispositivos cuando envían frames
-@app.middleware("http")
-async def add_device_ip(request: Request, call_next):
-    """Middleware para cachear IPs de dispositivos"""
-    response = await call_next(request)
-    
-    # Si es un request de procesar-frame, cachear la IP
-    if request.url.path == "/api/procesar-frame":
-        try:
-            device_id = request.headers.get("X-Device-ID")
-            if device_id:
-                client_ip = request.client.host
-                dispositivos_cache[device_id] = client_ip
-        except:
-            pass
-    
-    return response
-
-
 if __name__ == "__main__":
     print("""
     ╔═══════════════════════════════════════════════════╗
@@ -0,0 +1,112 @@
+"""
+matcher.py - Comparación vectorizada de rostros contra la galería
+Mantiene los encodings conocidos como una matriz contigua de NumPy
+"""
+
+import numpy as np
+from config import FACE_TOLERANCE, MATCHER_DTYPE
+from ann_index import crear_indice, actualizar_indice, distancias_sq
+
+
+class GalleryMatcher:
+    """
+    Galería de encodings conocidos en una matriz (N, 128) con normas precalculadas.
+
+    Reemplaza el doble recorrido compare_faces + face_distance por rostro:
+    todos los rostros de un frame se comparan contra la galería en un solo paso.
+    La búsqueda se delega a un índice (exacto, IVF o de prototipos) construido al cargar.
+    """
+
+    def __init__(self, encodings, ids, names, dtype=MATCHER_DTYPE, anterior=None, conservadas=None,
+                 centroides=None):
+        """
+        Args:
+            encodings (list | numpy.ndarray): Encodings de 128 dimensiones
+            ids (list): ID de estudiante de cada encoding
+            names (list): Nombre de cada encoding
+            dtype (str): 'float32' o 'float64'
+            anterior (GalleryMatcher): Matcher de la versión previa; con él,
+                encodings son sus filas `conservadas` seguidas de las nuevas y
+                se reutilizan sus normas e índice en lugar de reconstruirlos
+            conservadas (numpy.ndarray): Índices de las filas de `anterior` que siguen
+            centroides (numpy.ndarray): Centroides IVF publicados con la galería
+        """
+        self.dtype = np.dtype(dtype)
+
+        if len(encodings) > 0:
+            matriz = np.asarray(encodings, dtype=self.dtype).reshape(len(encodings), -1)
+        else:
+            matriz = np.empty((0, 128), dtype=self.dtype)
+
+        self.matriz = np.ascontiguousarray(matriz)
+        self.ids = list(ids)
+        self.names = list(names)
+
+        if anterior is not None and anterior.dtype == self.dtype:
+            nuevas = self.matriz[len(conservadas):]
+            self.normas_sq = np.concatenate((
+                anterior.normas_sq[conservadas],
+                np.einsum('ij,ij->i', nuevas, nuevas)
+            ))
+            self.index = actualizar_indice(anterior.index, self.matriz, self.normas_sq, conservadas, ids=self.ids)
+        else:
+            self.normas_sq = np.einsum('ij,ij->i', self.matriz, self.matriz)
+            self.index = crear_indice(self.matriz, self.normas_sq, ids=self.ids, centroides=centroides)
+
+    def __len__(self):
+        return self.matriz.shape[0]
+
+    def distancias(self, face_encodings):
+        """
+        Calcula la distancia euclidiana de cada rostro contra toda la galería
+
+        Usa ||q - g||² = ||q||² + ||g||² - 2·q·g para resolverlo como un GEMM
+
+        Args:
+            face_encodings (list | numpy.ndarray): Encodings de los rostros (F, 128)
+
+        Returns:
+            numpy.ndarray: Matriz de distancias (F, N)
+        """
+        consultas, normas_q = self._preparar(face_encodings)
+        dist_sq = distancias_sq(consultas, normas_q, self.matriz, self.normas_sq)
+        return np.sqrt(dist_sq, out=dist_sq)
+
+    def _preparar(self, face_encodings):
+        """Convierte las consultas al dtype de la galería y calcula sus normas"""
+        consultas = np.asarray(face_encodings, dtype=self.dtype).reshape(-1, self.matriz.shape[1])
+        return consultas, np.einsum('ij,ij->i', consultas, consultas)
+
+    def buscar(self, face_encodings, tolerance=FACE_TOLERANCE):
+        """
+        Busca la mejor coincidencia de cada rostro en la galería
+
+        Args:
+            face_encodings (list | numpy.ndarray): Encodings de los rostros
+            tolerance (float): Distancia máxima para aceptar una coincidencia
+
+        Returns:
+            list: Por cada rostro, None o {'id', 'name', 'distance', 'confidence'}
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        if len(self) == 0:
+            return [None] * len(face_encodings)
+
+        consultas, normas_q = self._preparar(face_encodings)
+        indices, distancias = self.index.buscar(consultas, normas_q, k=1, tolerance=tolerance)
+
+        resultados = []
+        for indice, distancia in zip(indices[:, 0], distancias[:, 0]):
+            if indice >= 0 and distancia <= tolerance:
+                resultados.append({
+                    'id': self.ids[indice],
+                    'name': self.names[indice],
+                    'distance': float(distancia),
+                    'confidence': float(1 - distancia)
+                })
+            else:
+                resultados.append(None)
+
+        return resultados
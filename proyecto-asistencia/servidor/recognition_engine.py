@@ -0,0 +1,431 @@
+"""
+recognition_engine.py - Motor de ejecución del reconocimiento facial
+Ejecuta face_processor.procesar_imagen (o procesar_recortes) en un pool de procesos (o threads)
+para no bloquear el event loop de FastAPI, agrupando en lotes los frames que
+llegan casi al mismo tiempo
+"""
+
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import (
+    RECOGNITION_EXECUTOR, RECOGNITION_WORKERS, RECOGNITION_QUEUE_MAX,
+    RECOGNITION_DEVICE_AFFINITY, RECOGNITION_BATCH_ENABLED, RECOGNITION_BATCH_WAIT_MS,
+    RECOGNITION_BATCH_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ColaLlena(Exception):
+    """Se alcanzó el máximo de frames pendientes; el cliente debe reintentar"""
+
+
+# Versión de galería publicada, compartida con el proceso principal (solo en workers)
+_version_galeria = None
+
+
+def _inicializar_worker(version_galeria=None):
+    """
+    Inicializador de cada proceso worker: al importar face_processor
+    se carga la galería una sola vez por proceso
+    
+    Args:
+        version_galeria (multiprocessing.Value): Versión publicada por el
+            proceso principal; el worker la compara antes de cada frame
+    """
+    global _version_galeria
+    _version_galeria = version_galeria
+    
+    from face_processor import face_processor
+    logger.info(f"👷 Worker {os.getpid()} listo: {len(face_processor.known_encodings)} rostros")
+
+
+def _sincronizar_galeria(face_processor):
+    """Si el proceso principal publicó otra galería, el worker la carga en segundo plano"""
+    if _version_galeria is not None:
+        face_processor.sincronizar(_version_galeria.value)
+
+
+def _procesar_en_worker(imagen, device_id=None, candidatos=None, origen=None):
+    """
+    Decodifica y procesa un frame dentro del worker
+
+    Args:
+        imagen (str | bytes): Imagen en base64 o JPEG binario
+            (se envía comprimida para no serializar el array)
+        device_id (str): Dispositivo de origen (para el seguimiento entre frames)
+        candidatos (tuple): IDs a probar antes que toda la galería
+        origen (tuple): (top, left, escala) si la imagen es una región del frame
+
+    Returns:
+        dict: Resultado de procesar_imagen, o None si la imagen no se pudo decodificar
+    """
+    from face_processor import face_processor
+    _sincronizar_galeria(face_processor)
+
+    if isinstance(imagen, str):
+        try:
+            imagen = base64.b64decode(imagen)
+        except ValueError:
+            return None
+
+    return face_processor.procesar_imagen(imagen, device_id, candidatos, origen)
+
+
+def _procesar_recortes_en_worker(recortes, device_id=None, candidatos=None):
+    """
+    Procesa recortes de rostros con ubicación conocida dentro del worker
+    
+    Args:
+        recortes (list): dicts con 'image' (base64 o JPEG binario), 'location' y 'bbox'
+        device_id (str): Dispositivo de origen
+        candidatos (tuple): IDs a probar antes que toda la galería
+    
+    Returns:
+        dict: Resultado de procesar_recortes, o None si algún recorte es inválido
+    """
+    from face_processor import face_processor
+    _sincronizar_galeria(face_processor)
+    
+    decodificados = []
+    for recorte in recortes:
+        imagen = recorte['image']
+        if isinstance(imagen, str):
+            try:
+                imagen = base64.b64decode(imagen)
+            except ValueError:
+                return None
+        decodificados.append({**recorte, 'image': imagen})
+    
+    return face_processor.procesar_recortes(decodificados, device_id, candidatos)
+
+
+def _metricas_seguimiento_en_worker():
+    """
+    Returns:
+        dict: Métricas del tracker de este worker, o None si el seguimiento está deshabilitado
+    """
+    from face_processor import face_processor
+    return face_processor.tracker.metricas() if face_processor.tracker else None
+
+
+def _procesar_lote_en_worker(solicitudes):
+    """
+    Procesa un lote de solicitudes de varios dispositivos dentro del worker
+    
+    Args:
+        solicitudes (list): dicts con 'device_id', 'candidatos' y 'image' (base64
+            o JPEG binario, con su 'origen') o 'rostros' (recortes como en
+            _procesar_recortes_en_worker)
+    
+    Returns:
+        list: Un resultado por solicitud (None si no se pudo decodificar)
+    """
+    from face_processor import face_processor
+    _sincronizar_galeria(face_processor)
+    
+    normalizadas = []
+    invalidas = set()
+    for i, solicitud in enumerate(solicitudes):
+        try:
+            if 'rostros' in solicitud:
+                rostros = [
+                    {**r, 'image': base64.b64decode(r['image']) if isinstance(r['image'], str) else r['image']}
+                    for r in solicitud['rostros']
+                ]
+                normalizadas.append({**solicitud, 'rostros': rostros})
+            else:
+                imagen = solicitud['image']
+                if isinstance(imagen, str):
+                    imagen = base64.b64decode(imagen)
+                normalizadas.append({**solicitud, 'image': imagen})
+        except ValueError:
+            invalidas.add(i)
+    
+    resultados = iter(face_processor.procesar_lote(normalizadas))
+    return [None if i in invalidas else next(resultados) for i in range(len(solicitudes))]
+
+
+class RecognitionEngine:
+    """Pool de ejecución con cola acotada y backpressure"""
+
+    def __init__(self, modo=RECOGNITION_EXECUTOR, workers=RECOGNITION_WORKERS,
+                 max_pendientes=RECOGNITION_QUEUE_MAX, afinidad=RECOGNITION_DEVICE_AFFINITY,
+                 lotes=RECOGNITION_BATCH_ENABLED, espera_lote_ms=RECOGNITION_BATCH_WAIT_MS,
+                 max_lote=RECOGNITION_BATCH_MAX):
+        """
+        Args:
+            modo (str): 'process' o 'thread'
+            workers (int): Cantidad de workers (0 = un worker por núcleo)
+            max_pendientes (int): Frames en cola + en proceso antes de rechazar
+            afinidad (bool): En modo 'process', enviar cada dispositivo siempre
+                al mismo proceso para que conserve sus tracks de rostros
+            lotes (bool): Agrupar frames que llegan juntos al mismo executor
+                (solo en modo 'process' con afinidad)
+            espera_lote_ms (int): Espera máxima para completar un lote
+            max_lote (int): Frames por lote
+        """
+        self.modo = modo
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pendientes = max_pendientes
+        self.afinidad = afinidad and modo != "thread"
+        self.pendientes = 0
+        self.rechazados = 0
+        self.executors = []
+        self.version_galeria = multiprocessing.Value('i', 0)
+        
+        # Solo con afinidad cada executor es un único proceso que atiende en
+        # serie; con un pool compartido (o threads) el lote serializaría la
+        # detección de frames que de otro modo corren en paralelo
+        self.lotes = lotes and self.afinidad
+        self.espera_lote = espera_lote_ms / 1000
+        self.max_lote = max_lote
+        self._lotes = {}
+        self._temporizadores = {}
+        self.lotes_despachados = 0
+        self.frames_en_lotes = 0
+
+    def _crear_executors(self):
+        if self.modo == "thread":
+            # Un solo pool: los threads comparten el tracker del proceso
+            return [ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="reconocimiento"
+            )]
+
+        if self.afinidad:
+            # Un proceso por executor; el dispositivo elige executor por hash
+            return [
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    initializer=_inicializar_worker,
+                    initargs=(self.version_galeria,)
+                )
+                for _ in range(self.workers)
+            ]
+
+        return [ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_inicializar_worker,
+            initargs=(self.version_galeria,)
+        )]
+
+    def iniciar(self):
+        """Crea el pool de workers"""
+        self.executors = self._crear_executors()
+        afinidad = ", afinidad por dispositivo" if self.afinidad else ""
+        logger.info(f"⚙️  Motor de reconocimiento: {self.workers} workers ({self.modo}{afinidad})")
+
+    def detener(self):
+        """Libera el pool de workers"""
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.executors = []
+
+    def notificar_galeria(self, version):
+        """
+        Publica una nueva versión de galería a los workers
+        
+        Cada proceso la carga en segundo plano al recibir su siguiente frame,
+        sin recrear el pool (en modo 'thread' los workers comparten la
+        galería del proceso principal y no hace falta)
+        """
+        self.version_galeria.value = version
+        logger.info(f"📣 Galería v{version} publicada a los workers")
+
+    def _executor_para(self, device_id):
+        """Executor asignado al dispositivo (estable entre frames)"""
+        if len(self.executors) == 1 or not device_id:
+            return self.executors[0]
+        return self.executors[zlib.crc32(device_id.encode()) % len(self.executors)]
+
+    @property
+    def carga(self):
+        """Ocupación actual del motor"""
+        return {
+            "pendientes": self.pendientes,
+            "max_pendientes": self.max_pendientes,
+            "workers": self.workers,
+            "rechazados": self.rechazados,
+            "lotes": self.lotes_despachados,
+            "frames_por_lote": round(self.frames_en_lotes / self.lotes_despachados, 2) if self.lotes_despachados else 0.0
+        }
+
+    @property
+    def nivel_carga(self):
+        """Fracción de la cola ocupada (0-1), informada a los clientes para que se adapten"""
+        return round(min(1.0, self.pendientes / self.max_pendientes), 2)
+
+    async def procesar(self, imagen, device_id=None, candidatos=None, origen=None):
+        """
+        Procesa un frame en el pool sin bloquear el event loop
+        
+        Args:
+            imagen (str | bytes): Imagen en base64 o JPEG binario
+            device_id (str): Dispositivo de origen
+            candidatos (tuple): IDs a probar antes que toda la galería
+            origen (tuple): (top, left, escala) si la imagen es una región del frame
+            
+        Returns:
+            dict: Resultado de procesar_imagen, o None si la imagen es inválida
+            
+        Raises:
+            ColaLlena: Si ya hay max_pendientes frames en proceso
+        """
+        if self.lotes:
+            return await self._agrupar(device_id, {
+                'image': imagen, 'device_id': device_id, 'candidatos': candidatos, 'origen': origen
+            })
+        return await self._ejecutar(device_id, _procesar_en_worker, imagen, device_id, candidatos, origen)
+    
+    async def procesar_recortes(self, recortes, device_id=None, candidatos=None):
+        """
+        Procesa recortes de rostros (sin detección) en el pool
+        
+        Args:
+            recortes (list): dicts con 'image', 'location' y 'bbox'
+            device_id (str): Dispositivo de origen
+            candidatos (tuple): IDs a probar antes que toda la galería
+            
+        Returns:
+            dict: Resultado de procesar_recortes, o None si algún recorte es inválido
+            
+        Raises:
+            ColaLlena: Si ya hay max_pendientes frames en proceso
+        """
+        if self.lotes:
+            return await self._agrupar(device_id, {'rostros': recortes, 'device_id': device_id, 'candidatos': candidatos})
+        return await self._ejecutar(device_id, _procesar_recortes_en_worker, recortes, device_id, candidatos)
+    
+    async def metricas_seguimiento(self, timeout=1.0):
+        """
+        Métricas del seguimiento de rostros sumadas entre executors
+        
+        Cada proceso tiene su propio tracker, así que se consulta a cada
+        executor (con afinidad, uno por proceso). Los que no responden en
+        `timeout` segundos quedan fuera de la suma
+        
+        Returns:
+            dict: Dispositivos, encodings reutilizados y calculados, y
+                executors que respondieron; o None si no hay datos
+        """
+        if not self.executors:
+            return None
+        
+        loop = asyncio.get_running_loop()
+        consultas = [
+            loop.run_in_executor(executor, _metricas_seguimiento_en_worker)
+            for executor in self.executors
+        ]
+        listas, pendientes = await asyncio.wait(consultas, timeout=timeout)
+        for consulta in pendientes:
+            consulta.cancel()
+        
+        parciales = [c.result() for c in listas if c.exception() is None and c.result()]
+        if not parciales:
+            return None
+        
+        total = {clave: sum(p[clave] for p in parciales) for clave in parciales[0]}
+        total["executors"] = len(parciales)
+        return total
+    
+    async def _ejecutar(self, device_id, funcion, *args):
+        """Ejecuta funcion en el executor del dispositivo aplicando backpressure"""
+        if not self.executors:
+            self.iniciar()
+        
+        if self.pendientes >= self.max_pendientes:
+            self.rechazados += 1
+            raise ColaLlena()
+        
+        self.pendientes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor_para(device_id), funcion, *args
+            )
+        finally:
+            self.pendientes -= 1
+
+    
+    async def _agrupar(self, device_id, solicitud):
+        """
+        Agrega la solicitud al lote en formación del executor del dispositivo
+        
+        El lote se despacha al llegar a max_lote solicitudes o al vencer la
+        espera máxima, lo que ocurra primero
+        """
+        if not self.executors:
+            self.iniciar()
+        
+        if self.pendientes >= self.max_pendientes:
+            self.rechazados += 1
+            raise ColaLlena()
+        
+        self.pendientes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._executor_para(device_id)
+            futuro = loop.create_future()
+            
+            lote = self._lotes.setdefault(executor, [])
+            lote.append((solicitud, futuro))
+            
+            if len(lote) >= self.max_lote:
+                self._despachar(executor)
+            elif len(lote) == 1:
+                self._temporizadores[executor] = loop.call_later(
+                    self.espera_lote, self._despachar, executor
+                )
+            
+            return await futuro
+        finally:
+            self.pendientes -= 1
+    
+    def _despachar(self, executor):
+        """Envía el lote acumulado al executor (se ejecuta en el event loop)"""
+        temporizador = self._temporizadores.pop(executor, None)
+        if temporizador:
+            temporizador.cancel()
+        
+        lote = self._lotes.pop(executor, None)
+        if not lote:
+            return
+        
+        self.lotes_despachados += 1
+        self.frames_en_lotes += len(lote)
+        
+        try:
+            tarea = asyncio.get_running_loop().run_in_executor(
+                executor, _procesar_lote_en_worker, [solicitud for solicitud, _ in lote]
+            )
+        except Exception as e:
+            # Executor cerrado (p. ej. durante el apagado): fallan solo estas solicitudes
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        
+        tarea.add_done_callback(lambda resultado: self._repartir(resultado, lote))
+    
+    @staticmethod
+    def _repartir(resultado, lote):
+        """Entrega a cada solicitud su parte del resultado del lote"""
+        for i, (_, futuro) in enumerate(lote):
+            if futuro.done():
+                continue
+            if resultado.cancelled():
+                futuro.cancel()
+            elif resultado.exception() is not None:
+                futuro.set_exception(resultado.exception())
+            else:
+                futuro.set_result(resultado.result()[i])
+
+
+# Instancia global
+recognition_engine = RecognitionEngine()
@@ -0,0 +1,74 @@
+-- schema.sql - Esquema de la base de datos del sistema de asistencia
+
+-- Base de datos
+CREATE DATABASE IF NOT EXISTS asistencia_db 
+CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+USE asistencia_db;
+
+-- Tabla de estudiantes
+CREATE TABLE IF NOT EXISTS estudiantes (
+    id_estudiante INT AUTO_INCREMENT PRIMARY KEY,
+    nombre_completo VARCHAR(100) NOT NULL,
+    rut VARCHAR(12) UNIQUE,
+    path_foto_referencia VARCHAR(255) NOT NULL,
+    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_nombre (nombre_completo)
+) ENGINE=InnoDB;
+
+-- Tabla de asistencia
+CREATE TABLE IF NOT EXISTS asistencia (
+    id_asistencia INT AUTO_INCREMENT PRIMARY KEY,
+    id_estudiante INT NOT NULL,
+    hora_ingreso TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_registro DATE NOT NULL,
+    dispositivo_id VARCHAR(50),
+    FOREIGN KEY (id_estudiante) REFERENCES estudiantes(id_estudiante) 
+        ON DELETE CASCADE,
+    UNIQUE KEY uq_estudiante_fecha (id_estudiante, fecha_registro),
+    INDEX idx_fecha (fecha_registro)
+) ENGINE=InnoDB;
+
+-- Registro de dispositivos (nombre = device_id de la Raspberry Pi)
+CREATE TABLE IF NOT EXISTS dispositivos (
+    id_dispositivo INT AUTO_INCREMENT PRIMARY KEY,
+    nombre VARCHAR(50) NOT NULL,
+    ip_address VARCHAR(45),
+    ultimo_ping TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    activo BOOLEAN DEFAULT TRUE,
+    sala VARCHAR(50),  -- Sala donde está instalado (para el horario de clases)
+    UNIQUE KEY uq_nombre (nombre)
+) ENGINE=InnoDB;
+-- Bases creadas con el esquema anterior (sin clave única, ip_address VARCHAR(15)):
+-- eliminar duplicados conservando el registro más reciente de cada dispositivo
+--   DELETE d1 FROM dispositivos d1
+--   JOIN dispositivos d2 ON d1.nombre = d2.nombre AND d1.id_dispositivo < d2.id_dispositivo;
+-- y luego
+--   ALTER TABLE dispositivos ADD UNIQUE KEY uq_nombre (nombre), MODIFY ip_address VARCHAR(45);
+-- Bases existentes: ALTER TABLE dispositivos ADD COLUMN sala VARCHAR(50);
+
+-- Cursos y estudiantes inscritos
+CREATE TABLE IF NOT EXISTS cursos (
+    id_curso INT AUTO_INCREMENT PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS inscripciones (
+    id_curso INT NOT NULL,
+    id_estudiante INT NOT NULL,
+    PRIMARY KEY (id_curso, id_estudiante),
+    FOREIGN KEY (id_curso) REFERENCES cursos(id_curso) ON DELETE CASCADE,
+    FOREIGN KEY (id_estudiante) REFERENCES estudiantes(id_estudiante) ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Horario: bloques semanales de cada curso en una sala
+CREATE TABLE IF NOT EXISTS horarios (
+    id_horario INT AUTO_INCREMENT PRIMARY KEY,
+    id_curso INT NOT NULL,
+    sala VARCHAR(50) NOT NULL,
+    dia_semana TINYINT NOT NULL,  -- 0 = lunes ... 6 = domingo
+    hora_inicio TIME NOT NULL,
+    hora_fin TIME NOT NULL,
+    FOREIGN KEY (id_curso) REFERENCES cursos(id_curso) ON DELETE CASCADE,
+    INDEX idx_sala_dia (sala, dia_semana)
+) ENGINE=InnoDB;
@@ -0,0 +1,92 @@
+"""
+test_ann_index.py - Pruebas del índice IVF (ejecutar con pytest desde servidor/)
+"""
+
+import numpy as np
+from ann_index import ExactIndex, IVFIndex
+
+
+def _galeria(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    matriz = rng.standard_normal((n, 128)).astype(np.float32)
+    normas = np.einsum('ij,ij->i', matriz, matriz)
+    return matriz, normas
+
+
+def _comparar_con_exacto(indice, matriz, normas):
+    exacto = ExactIndex(matriz, normas)
+    consultas = matriz[:5] + np.float32(0.01)
+    normas_q = np.einsum('ij,ij->i', consultas, consultas)
+    idx_ivf, _ = indice.buscar(consultas, normas_q, k=1)
+    idx_exacto, _ = exacto.buscar(consultas, normas_q, k=1)
+    assert np.array_equal(idx_ivf, idx_exacto)
+
+
+def test_nlist_mayor_que_muestra():
+    """IVF_NLIST por encima de IVF_TRAIN_SAMPLE no debe fallar al elegir centroides"""
+    matriz, normas = _galeria(40)
+    indice = IVFIndex(matriz, normas, nlist=30, nprobe=40, muestra=10)
+
+    assert indice.nlist <= 10
+    assert indice.nprobe <= indice.nlist
+    assert indice.centroides.shape[0] == indice.nlist
+    _comparar_con_exacto(indice, matriz, normas)
+
+
+def test_nlist_mayor_que_galeria():
+    """ANN_INDEX="ivf" con una galería más chica que IVF_NLIST"""
+    matriz, normas = _galeria(6)
+    indice = IVFIndex(matriz, normas, nlist=50, nprobe=50)
+
+    assert indice.nlist <= 6
+    _comparar_con_exacto(indice, matriz, normas)
+
+
+def _contar_filas(monkeypatch):
+    """Cuenta los pares consulta-fila comparados por el índice (sin los centroides)"""
+    import ann_index
+    original = ann_index.distancias_sq
+    conteo = {"pares": 0, "llamadas": []}
+
+    def contando(consultas, normas_q, matriz, normas_sq):
+        conteo["llamadas"].append((consultas.shape[0], matriz.shape[0]))
+        return original(consultas, normas_q, matriz, normas_sq)
+
+    monkeypatch.setattr(ann_index, "distancias_sq", contando)
+    return conteo
+
+
+def _dispersa(n, semilla=0):
+    """Galería con la dispersión de rostros reales (distancia típica entre pares ~0.9)"""
+    matriz, _ = _galeria(n, semilla)
+    matriz *= np.float32(0.9 / np.sqrt(2 * 128))
+    return matriz, np.einsum('ij,ij->i', matriz, matriz)
+
+
+def test_ivf_recorre_menos_que_fuerza_bruta(monkeypatch):
+    """Con la configuración por defecto cada consulta recorre solo nprobe listas"""
+    matriz, normas = _dispersa(4000)
+    indice = IVFIndex(matriz, normas)
+    conteo = _contar_filas(monkeypatch)
+
+    consultas = matriz[:16] + np.float32(0.01)
+    normas_q = np.einsum('ij,ij->i', consultas, consultas)
+    indice.buscar(consultas, normas_q, k=1, tolerance=0.6)
+
+    pares = sum(f * n for f, n in conteo["llamadas"] if n != indice.nlist)
+    assert pares < 0.5 * len(consultas) * matriz.shape[0]
+
+
+def test_modo_exacto_sin_poda_usa_un_gemm(monkeypatch):
+    """Si la cota no poda, el lote completo se resuelve con una sola multiplicación"""
+    matriz, normas = _dispersa(4000)
+    indice = IVFIndex(matriz, normas, exacto_bajo_tolerancia=True)
+    conteo = _contar_filas(monkeypatch)
+
+    consultas = matriz[:16] + np.float32(0.01)
+    normas_q = np.einsum('ij,ij->i', consultas, consultas)
+    indices, _ = indice.buscar(consultas, normas_q, k=1, tolerance=0.6)
+
+    completas = [f for f, n in conteo["llamadas"] if n == matriz.shape[0]]
+    assert completas == [len(consultas)]
+    assert np.array_equal(indices[:, 0], np.arange(len(consultas)))